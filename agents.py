@@ -0,0 +1,294 @@
+"""
+Agent profiles: a normalized agents table and an enrichment stage keyed by `agent_url`.
+
+With it, listing rows carry an `agent_id` instead of the agent columns (`AGENT_FIELDS`).
+The agency behind each ID, with its latest contacts, is kept once in
+`listings url/agents.sqlite3`. Each agency's profile page (address, IČO, listing count) is
+fetched at most once per TTL. Within a run an agency is fetched at most once however many
+of its listings are being processed concurrently: the first listing queues the fetch and
+later ones find it queued.
+
+Usage:
+    python cli.py byty --agents
+    python agents.py --output data/agents.csv
+"""
+import argparse
+import asyncio
+import csv
+import html
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from dedup import fingerprint
+
+
+# Row columns replaced by `agent_id`
+AGENT_FIELDS = ("agent_name", "agent_url", "agent_website", "agent_email", "agent_phone1", "agent_phone2")
+
+# Profiles are fetched again after this many seconds
+DEFAULT_TTL = 7 * 86400
+
+AGENT_COLUMNS = ("id", "agent_url", "name", "website", "email", "phone1", "phone2", "address", "ico",
+                 "listing_count", "first_seen", "last_seen", "fetched_at")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agents (
+    id INTEGER PRIMARY KEY,
+    agent_url TEXT,
+    name TEXT,
+    website TEXT,
+    email TEXT,
+    phone1 TEXT,
+    phone2 TEXT,
+    address TEXT,
+    ico TEXT,
+    listing_count INTEGER,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    fetched_at REAL
+);
+"""
+
+AGENT_ID_PATTERN = re.compile(r"/(\d+)/?$")
+TAG_PATTERN = re.compile(r"<[^>]+>")
+ADDRESS_PATTERN = re.compile(r"<address[^>]*>(.*?)</address>", re.S)
+# "Street 12, 120 00 City": a line with a Czech postcode
+POSTCODE_LINE_PATTERN = re.compile(r"^[^\n]{2,80}?,\s*\d{3}\s?\d{2}\s+[^\n]{2,60}$", re.M)
+ICO_PATTERN = re.compile(r"IČO?\s*:?\s*(\d{8})\b")
+LISTING_COUNT_PATTERN = re.compile(r"(\d[\d  ]*)\s+inzerát")
+
+
+def agent_id(agent):
+    """
+    Stable ID of the agent in a row's agent columns: the agency number at the end of
+    `agent_url`, otherwise a 63-bit fingerprint of the name and email; None for a row without
+    any agent.
+    """
+    url = agent.get("agent_url")
+    if url:
+        match = AGENT_ID_PATTERN.search(url.split("?")[0])
+        return int(match.group(1)) if match else fingerprint(url) >> 1
+    if agent.get("agent_name") or agent.get("agent_email"):
+        return fingerprint(f"{agent.get('agent_name')}|{agent.get('agent_email')}") >> 1
+    return None
+
+
+def parse_agent_profile(agent_url, body):
+    """
+    Address, IČO and listing count from an agency's profile page, each None when missing.
+    Reads the page text, so it doesn't depend on the page's CSS classes. Module level so it
+    can run in a parser process.
+    """
+    text = html.unescape(TAG_PATTERN.sub("\n", body))
+    address = ADDRESS_PATTERN.search(body)
+    if address is not None:
+        address = " ".join(html.unescape(TAG_PATTERN.sub(" ", address.group(1))).split())
+    else:
+        line = POSTCODE_LINE_PATTERN.search(text)
+        address = line.group(0).strip() if line else None
+    ico = ICO_PATTERN.search(text)
+    listing_count = LISTING_COUNT_PATTERN.search(text)
+    return {
+        "address": address,
+        "ico": ico.group(1) if ico else None,
+        "listing_count": int(re.sub(r"\D", "", listing_count.group(1))) if listing_count else None,
+    }
+
+
+class AgentStore:
+    """
+    The agents table, in a SQLite database in WAL mode shared between threads like `StateStore`.
+
+    Args:
+        db_path (str | Path): Location of the SQLite database file
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def upsert(self, key, agent, seen_at=None):
+        """Record an agent's name, URL and contacts as found in a row; contacts left empty keep their value."""
+        seen_at = seen_at if seen_at is not None else time.time()
+        values = [agent.get(field) for field in AGENT_FIELDS]
+        self._execute(
+            "INSERT INTO agents (id, name, agent_url, website, email, phone1, phone2, first_seen, last_seen) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+            "name = COALESCE(excluded.name, name), agent_url = COALESCE(excluded.agent_url, agent_url), "
+            "website = COALESCE(excluded.website, website), email = COALESCE(excluded.email, email), "
+            "phone1 = COALESCE(excluded.phone1, phone1), phone2 = COALESCE(excluded.phone2, phone2), "
+            "last_seen = excluded.last_seen",
+            (key, *values, seen_at, seen_at))
+
+    def fetched_at(self, key):
+        rows = self._execute("SELECT fetched_at FROM agents WHERE id = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_profile(self, key, profile, fetched_at=None):
+        self._execute("UPDATE agents SET address = ?, ico = ?, listing_count = ?, fetched_at = ? WHERE id = ?",
+                      (profile.get("address"), profile.get("ico"), profile.get("listing_count"),
+                       fetched_at if fetched_at is not None else time.time(), key))
+
+    def get(self, key):
+        rows = self._execute(f"SELECT {', '.join(AGENT_COLUMNS)} FROM agents WHERE id = ?", (key,))
+        return dict(zip(AGENT_COLUMNS, rows[0])) if rows else None
+
+    def export_csv(self, path):
+        """Write the whole table to a CSV file, replacing it once complete."""
+        rows = self._execute(f"SELECT {', '.join(AGENT_COLUMNS)} FROM agents ORDER BY id")
+        os.makedirs(os.path.dirname(str(path)) or ".", exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, mode='w', newline='', encoding='UTF-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(AGENT_COLUMNS)
+            writer.writerows(rows)
+        os.replace(temporary, path)
+        return len(rows)
+
+    def stats(self):
+        agents, profiles = self._execute("SELECT COUNT(*), COUNT(fetched_at) FROM agents")[0]
+        return {"agents": agents, "profiles": profiles}
+
+
+class AgentEnricher:
+    """
+    Enrichment stage run on the crawl's pipeline: `normalize` swaps a row's agent columns for
+    its `agent_id` and queues a refresh of the agency's profile when the stored one is missing
+    or older than `ttl`. Queued profiles are fetched by a single `FetchEngine.run` over the
+    pipeline's engine, started with the first one and fed until `join`, so they share its
+    workers, rate limit and response cache; they are parsed in its parser pool. Database work
+    runs in the default thread executor, off the event loop.
+
+    Args:
+        store (AgentStore): Agents table
+        pipeline (Pipeline): Crawl pipeline to fetch and parse profiles on
+        ttl (float): Seconds a fetched profile stays fresh
+    """
+
+    def __init__(self, store, pipeline, ttl=DEFAULT_TTL):
+        self.store = store
+        self.pipeline = pipeline
+        self.ttl = ttl
+        # Agent ID -> contacts last stored, so repeated rows of an agency don't touch the database
+        self.known = {}
+        # Agent ID -> whether its profile was queued for a refresh (False: the stored one is
+        # fresh); kept for the whole run, so each agency is tried once
+        self.refreshes = {}
+        # Profile URL -> agent ID of the refreshes queued, and the URLs waiting to be fetched
+        self.profile_keys = {}
+        self.profile_urls = asyncio.Queue()
+        self.refresher = None
+        self.fetched = 0
+        self.failed = 0
+
+    def agent_name(self, key):
+        """Name of an agent seen in this run."""
+        contacts = self.known.get(key)
+        return contacts[0] if contacts else None
+
+    async def normalize(self, row):
+        """Return the row with `agent_id` in place of the agent columns."""
+        agent = {field: row.get(field) for field in AGENT_FIELDS}
+        key = agent_id(agent)
+        listing = {}
+        for field, value in row.items():
+            if field == AGENT_FIELDS[0]:
+                listing["agent_id"] = key
+            if field not in AGENT_FIELDS:
+                listing[field] = value
+        listing.setdefault("agent_id", key)
+        if key is None:
+            return listing
+
+        # Both checks are settled before the first await, so concurrent rows of the agency skip them
+        contacts = tuple(agent.values())
+        upsert = self.known.get(key) != contacts
+        self.known[key] = contacts
+        check = bool(agent["agent_url"]) and key not in self.refreshes
+        if check:
+            self.refreshes[key] = False
+        if upsert or check:
+            fetched_at = await asyncio.get_running_loop().run_in_executor(None, self._record, key, agent, upsert,
+                                                                          check)
+            if check and (fetched_at is None or time.time() - fetched_at > self.ttl):
+                self._queue_refresh(key, agent["agent_url"])
+        return listing
+
+    def _record(self, key, agent, upsert, check):
+        """Store the agent's contacts and/or read when its profile was fetched, in one executor call."""
+        if upsert:
+            self.store.upsert(key, agent)
+        return self.store.fetched_at(key) if check else None
+
+    def _queue_refresh(self, key, agent_url):
+        self.refreshes[key] = True
+        self.profile_keys[agent_url] = key
+        self.profile_urls.put_nowait(agent_url)
+        if self.refresher is None:
+            self.refresher = asyncio.create_task(
+                self.pipeline.engine.run(self._next_profile_url(), self._save_profile, on_failure=self._profile_failed))
+
+    async def _next_profile_url(self):
+        # Ends at the None put by `join`
+        while (agent_url := await self.profile_urls.get()) is not None:
+            yield agent_url
+
+    async def _save_profile(self, agent_url, body):
+        loop = asyncio.get_running_loop()
+        try:
+            profile = await loop.run_in_executor(self.pipeline.pool, parse_agent_profile, agent_url, body)
+            await loop.run_in_executor(None, self.store.set_profile, self.profile_keys[agent_url], profile)
+            self.fetched += 1
+        except Exception as e:
+            logging.warning(f"Error parsing agent profile {agent_url}: {e}")
+            self.failed += 1
+
+    def _profile_failed(self, agent_url, error):
+        logging.warning(f"Error fetching agent profile {agent_url}: {error}")
+        self.failed += 1
+
+    async def join(self):
+        """Wait for the queued profile refreshes."""
+        if self.refresher is not None:
+            self.profile_urls.put_nowait(None)
+            await self.refresher
+        logging.info(f"Agent profiles: {self.fetched} fetched, {self.failed} failed, "
+                     f"{sum(not queued for queued in self.refreshes.values())} still fresh; {self.store.stats()}")
+
+
+def main(argv=None):
+    from utils import agents_db_path, configure_logging, output_dir
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=output_dir / "agents.csv", help="CSV file to export the agents to")
+    args = parser.parse_args(argv)
+    with AgentStore(agents_db_path) as store:
+        logging.info(f"Exported {store.export_csv(args.output)} agent(s) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Extraction backends, selectable per run.
+
+`html` renders the web pages and reads them with BeautifulSoup; `api` reads the estate JSON
+API (see `estate_api`). Both produce the same rows. Search pages are parsed by whichever
+backend generated their URL, so pages left pending by a run on the other backend still
+resume correctly.
+"""
+from collections import namedtuple
+
+import estate_api
+from utils import page_url_generator, parse_first_page, parse_listing_html, parse_listing_urls
+
+
+# page_url_generator(property_type, size) -> page -> URL; listing_request_url(listing_url) -> URL to
+# fetch, None to fetch the listing URL itself; parse_listing(listing_url, body, property_type) -> row
+Backend = namedtuple("Backend", "name page_url_generator listing_request_url parse_listing")
+
+BACKENDS = {
+    "html": Backend("html", page_url_generator, None, parse_listing_html),
+    "api": Backend("api", estate_api.search_url_generator, estate_api.estate_url, estate_api.parse_estate),
+}
+
+DEFAULT_BACKEND = "html"
+
+
+def get_backend(name=None):
+    if name is None:
+        name = DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid backend: {name} (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+
+def parse_search_page(page_url, body, property_type):
+    """Listing URLs of a search page from either backend. Runs in a parser process."""
+    if estate_api.is_api_url(page_url):
+        return estate_api.parse_search_page(page_url, body, property_type)
+    return parse_listing_urls(page_url, body, property_type)
+
+
+def parse_first_search_page(page_url, body, property_type):
+    """Last page number and listing URLs of a size's first search page from either backend."""
+    if estate_api.is_api_url(page_url):
+        return estate_api.parse_first_search_page(page_url, body, property_type)
+    return parse_first_page(page_url, body, property_type)
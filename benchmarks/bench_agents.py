@@ -0,0 +1,101 @@
+"""
+Agent normalization: profile fetches, output size and contact parsing cost, with rows whose
+listings belong to a limited number of agencies, against a stand-in serving profile pages.
+
+Rows are normalized all at once, as concurrent listing sinks do, so every agency's
+listings race for its profile; each agency should still be fetched once, and not at all
+on a second run within the TTL.
+
+Usage:
+    python -m benchmarks.bench_agents --rows 20000 --agencies 300
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import tempfile
+import time
+
+import utils
+from agents import AgentEnricher, AgentStore
+from benchmarks.stub_server import FIXTURES, SrealityServer
+from pipeline import Pipeline
+
+
+def make_rows(server_url, count, agencies):
+    template = utils.parse_listing_html(f"{server_url}/detail/prodej/byt/2+kk/praha/3000000001",
+                                        (FIXTURES / "detail_byt.html").read_text(encoding="UTF-8"), "byty")
+    rows = []
+    for number in range(count):
+        agency = random.randrange(agencies)
+        rows.append(dict(template, listing_url=f"{server_url}/detail/prodej/byt/2+kk/praha/{3000000000 + number}",
+                         agent_name=f"Reality {agency} s.r.o.",
+                         agent_url=f"{server_url}/adresar/reality-{agency}/{1000 + agency}",
+                         agent_email=f"makler{random.randrange(3)}@reality-{agency}.cz"))
+    return rows
+
+
+def csv_size(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return len(buffer.getvalue().encode("UTF-8"))
+
+
+async def normalize_all(store, rows, server):
+    server.agent_requests = 0
+    start = time.perf_counter()
+    async with Pipeline(parse_workers=1) as pipeline:
+        enricher = AgentEnricher(store, pipeline)
+
+        async def sink(row):
+            await asyncio.sleep(0)
+            return await enricher.normalize(row)
+
+        normalized = await asyncio.gather(*(sink(row) for row in rows))
+        await enricher.join()
+    return normalized, server.agent_requests, time.perf_counter() - start
+
+
+def contact_split_us(rows, split):
+    contacts = [[row["agent_email"], row["agent_phone1"] or "", row["agent_phone2"] or ""] for row in rows]
+    start = time.perf_counter()
+    for lines in contacts:
+        split(lines)
+    return (time.perf_counter() - start) / len(contacts) * 10 ** 6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--agencies", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with SrealityServer(latency=args.latency) as server, tempfile.TemporaryDirectory() as directory:
+        utils.base_url = server.url
+        rows = make_rows(server.url, args.rows, args.agencies)
+        with AgentStore(os.path.join(directory, "agents.sqlite3")) as store:
+            for run in ("first run", "second run"):
+                normalized, requests, elapsed = asyncio.run(normalize_all(store, rows, server))
+                print(f"{run:<10} {args.rows:,} rows, {args.agencies} agencies: {requests:5,} profile requests "
+                      f"{elapsed:6.2f}s   {store.stats()}")
+            agents_csv = os.path.join(directory, "agents.csv")
+            store.export_csv(agents_csv)
+            agents_bytes = os.path.getsize(agents_csv)
+
+    plain, normalized_bytes = csv_size(rows), csv_size(normalized)
+    print(f"output {plain / 2 ** 20:7.2f} MiB with agent columns   {(normalized_bytes + agents_bytes) / 2 ** 20:7.2f} MiB "
+          f"normalized ({normalized_bytes / 2 ** 20:.2f} MiB rows + {agents_bytes / 2 ** 10:.0f} KiB agents.csv)")
+    uncached = contact_split_us(rows, lambda lines: utils._split_agent_contacts.__wrapped__(tuple(lines)))
+    utils._split_agent_contacts.cache_clear()
+    cached = contact_split_us(rows, utils.split_agent_contacts)
+    print(f"contact split per row {uncached:6.2f} us uncached   {cached:6.2f} us memoized")
+
+
+if __name__ == "__main__":
+    main()
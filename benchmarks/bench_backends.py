@@ -0,0 +1,75 @@
+"""
+Compare the extraction backends on recorded fixtures: bytes transferred and parse CPU time
+per listing, counting each listing's share of its search page plus its own detail document.
+Rows from both backends must agree field by field, empty values included (None in both).
+
+Usage:
+    python -m benchmarks.bench_backends --rounds 50
+"""
+import argparse
+import gzip
+import time
+from pathlib import Path
+
+import estate_api
+from utils import parse_listing_html, parse_listing_urls
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+LISTING_URL = "https://www.sreality.cz/detail/prodej/byt/2+kk/praha-vinohrady-vinohradska/3000000100"
+
+BACKENDS = {
+    "html": ("search.html", "detail_{}.html", parse_listing_urls, parse_listing_html),
+    "api": ("estates_search.json", "estate_{}.json", estate_api.parse_search_page, estate_api.parse_estate),
+}
+
+
+def measure(search_file, detail_pattern, parse_search, parse_detail, rounds):
+    search = (FIXTURES / search_file).read_text(encoding="UTF-8")
+    details = [(FIXTURES / detail_pattern.format(name)).read_text(encoding="UTF-8")
+               for name in ("byt", "dum", "pozemek")]
+    per_page = len(parse_search("page", search, "byty")["listing_url"])
+
+    def transferred(body, compress):
+        data = body.encode("UTF-8")
+        return len(gzip.compress(data)) if compress else len(data)
+
+    sizes = [transferred(search, compress) / per_page
+             + sum(transferred(body, compress) for body in details) / len(details)
+             for compress in (False, True)]
+
+    start = time.process_time()
+    for _ in range(rounds):
+        parse_search("page", search, "byty")
+    search_cpu = (time.process_time() - start) / rounds / per_page
+
+    start = time.process_time()
+    for _ in range(rounds):
+        for body in details:
+            parse_detail(LISTING_URL, body, "byty")
+    detail_cpu = (time.process_time() - start) / rounds / len(details)
+    return per_page, sizes, search_cpu + detail_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    for name in ("byt", "dum", "pozemek"):
+        html_row = parse_listing_html(LISTING_URL, (FIXTURES / f"detail_{name}.html").read_text(encoding="UTF-8"), "byty")
+        api_row = estate_api.parse_estate(LISTING_URL, (FIXTURES / f"estate_{name}.json").read_text(encoding="UTF-8"),
+                                          "byty")
+        differences = {field: (html_row[field], api_row[field]) for field in html_row if html_row[field] != api_row[field]}
+        assert not differences, f"{name}: fields differing between backends (html, api): {differences}"
+        print(f"{name:<8} rows identical across backends")
+
+    for label, (search_file, detail_pattern, parse_search, parse_detail) in BACKENDS.items():
+        per_page, (raw, compressed), cpu = measure(search_file, detail_pattern, parse_search, parse_detail,
+                                                   args.rounds)
+        print(f"{label:<5} {per_page:3d} listings/search page   {raw / 1024:7.1f} KiB/listing "
+              f"({compressed / 1024:5.1f} KiB gzip)   {cpu * 1000:7.2f} ms CPU/listing")
+
+
+if __name__ == "__main__":
+    main()
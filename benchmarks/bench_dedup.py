@@ -0,0 +1,84 @@
+"""
+Memory and speed of a Python set of listing URLs against `dedup.FingerprintSet`, and the
+cost of building the persistent set from an output CSV.
+
+Each structure is filled in a fresh subprocess so the resident memory it adds can be
+measured on its own.
+
+Usage:
+    python -m benchmarks.bench_dedup --urls 2000000
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+URL_PATTERN = "https://www.sreality.cz/detail/prodej/byt/2+kk/praha-vinohrady-vinohradska/{}"
+
+
+def max_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fill(kind, count):
+    """Insert `count` URLs, then look every one up again. Runs in the subprocess."""
+    from dedup import FingerprintSet
+
+    baseline = max_rss_mib()
+    urls = (URL_PATTERN.format(3000000000 + i) for i in range(count))
+    seen = set() if kind == "set" else FingerprintSet()
+    start = time.perf_counter()
+    for url in urls:
+        seen.add(url)
+    inserted = time.perf_counter() - start
+    start = time.perf_counter()
+    found = sum(URL_PATTERN.format(3000000000 + i) in seen for i in range(count))
+    looked_up = time.perf_counter() - start
+    assert found == count
+    return {"insert_ns": inserted / count * 1e9, "lookup_ns": looked_up / count * 1e9,
+            "rss_mib": max_rss_mib() - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=2000000)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(fill(args.child, args.urls)))
+        return
+
+    for kind in ("set", "fingerprints"):
+        output = subprocess.run([sys.executable, "-m", "benchmarks.bench_dedup", "--urls", str(args.urls),
+                                 "--child", kind], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        print(f"{kind:<13} {args.urls:,} URLs   +{result['rss_mib']:7.1f} MiB RSS   "
+              f"insert {result['insert_ns']:6.0f} ns   lookup {result['lookup_ns']:6.0f} ns")
+
+    from dedup import open_seeded
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "byty.csv")
+        with open(csv_path, mode='w', newline='', encoding='UTF-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(["listing_url", "price", "location_long"])
+            for i in range(args.urls):
+                writer.writerow([URL_PATTERN.format(3000000000 + i), "7490000", "Vinohradská, Praha 2 - Vinohrady"])
+        start = time.perf_counter()
+        open_seeded(os.path.join(directory, "written.fpset"), [csv_path]).close()
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        open_seeded(os.path.join(directory, "written.fpset"), [csv_path]).close()
+        reopened = time.perf_counter() - start
+    print(f"persistent set: built from a {args.urls:,} row CSV in {built:.2f}s, reopened in {reopened * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Time-to-first-listing of pagination discovery: the previous two serial sweeps over every
+size against concurrent discovery (`discovery.iter_page_urls`), on a local stub server that
+serves a saved search page with a fixed delay.
+
+Usage:
+    python -m benchmarks.bench_discovery --latency 0.3 --category komercni
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+import requests
+from bs4 import BeautifulSoup
+
+import utils
+from benchmarks.stub_server import StubServer
+from discovery import iter_page_urls
+from pipeline import Pipeline
+
+
+FIXTURE = Path(__file__).parent / "fixtures" / "search.html"
+
+
+def get_soup(url):
+    """The pre-engine fetch: one blocking request per page, parsed on the spot."""
+    return BeautifulSoup(requests.get(url).text, "html.parser")
+
+
+def serial_discovery(property_type, pages):
+    """The pre-concurrency flow: one sweep for max_pages, a second for each size's last page."""
+    start = time.perf_counter()
+    sizes = utils.PROPERTY_SIZES[property_type]
+    for size in sizes:
+        utils.get_last_page_no(get_soup(utils.page_url_generator(property_type, size)(1)))
+    page_urls = []
+    for size in sizes:
+        url_generator = utils.page_url_generator(property_type, size)
+        last_page_no = int(utils.get_last_page_no(get_soup(url_generator(1))))
+        page_urls.extend(url_generator(page) for page in range(1, min(pages, last_page_no) + 1))
+    # Listing extraction could only start once every page URL was known
+    return time.perf_counter() - start
+
+
+async def concurrent_discovery(property_type, pages):
+    start = time.perf_counter()
+    async with Pipeline(parse_workers=1) as pipeline:
+        async for page_url, data_dict in iter_page_urls(pipeline, property_type, pages):
+            if data_dict is not None and data_dict["listing_url"]:
+                first_listing = time.perf_counter() - start
+                break
+    return first_listing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--category", default="komercni", choices=list(utils.PROPERTY_SIZES))
+    parser.add_argument("--pages", type=int, default=3)
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency, body=FIXTURE.read_bytes()) as server:
+        utils.base_url = server.url
+        serial = serial_discovery(args.category, args.pages)
+        concurrent = asyncio.run(concurrent_discovery(args.category, args.pages))
+
+    sizes = len(utils.PROPERTY_SIZES[args.category])
+    print(f"{args.category}: {sizes} sizes, {args.latency * 1000:.0f} ms per request")
+    print(f"serial sweeps       time to first listing {serial:6.2f}s")
+    print(f"concurrent discovery time to first listing {concurrent:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+End-to-end throughput of a whole crawl: pagination discovery, search pages, listing pages,
+parsing and the CSV output, against the local sreality stand-in (`stub_server.SrealityServer`)
+so nothing ever hits sreality.cz.
+
+Each run crawls in a fresh subprocess with its own working directory, so the state store,
+output files and resource usage are its own. Reported per backend: listings/s, p50/p99 fetch
+latency, peak RSS of the crawler and of its largest parser process, and CPU time per listing
+(parser processes included).
+
+With --save, runs are appended to a JSON lines file; with --baseline, each run is compared
+against the last run of the same scenario in a file and the exit status is 1 when it is worse
+by more than --tolerance. Both may name the same file to track every version.
+
+Usage:
+    python -m benchmarks.bench_e2e --backend html api --pages 10 --latency 0.02
+    python -m benchmarks.bench_e2e --error-rate 0.05 --repeat 3 --save e2e.jsonl --baseline e2e.jsonl
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.stub_server import SrealityServer
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+DETAIL_FIXTURES = {"byty": "byt", "domy": "dum", "pozemky": "pozemek"}
+
+# Result fields compared against a baseline: True when higher is better
+COMPARED = {"listings_per_s": True, "fetch_p50_ms": False, "fetch_p99_ms": False, "peak_rss_mib": False,
+            "cpu_ms_per_listing": False}
+
+# Fields that make two runs comparable
+SCENARIO = ("backend", "category", "sizes", "pages", "latency", "error_rate", "fetch_workers", "parse_workers")
+
+
+def crawl(args):
+    """Crawl the stand-in from the current directory and measure it. Runs in the subprocess."""
+    import cli
+    import utils
+    from metrics import default_metrics
+
+    logging.getLogger().setLevel(logging.WARNING)
+    utils.base_url = args.url
+    wall = time.perf_counter()
+    asyncio.run(cli.crawl_async([args.category], pages=args.pages, sizes=args.sizes, passcode=utils.PASSCODE,
+                                fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                                backend=args.backend))
+    wall = time.perf_counter() - wall
+
+    with open(utils.output_dir / f"{args.category}.csv", newline='', encoding='UTF-8') as file:
+        listings = sum(1 for _ in csv.DictReader(file))
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    fetch = default_metrics.stage().summary().get("fetch", {})
+    return {
+        "listings": listings,
+        "seconds": round(wall, 3),
+        "listings_per_s": round(listings / wall, 2),
+        "fetch_p50_ms": fetch.get("p50_ms"),
+        "fetch_p99_ms": fetch.get("p99_ms"),
+        "peak_rss_mib": round(own.ru_maxrss / 1024, 1),
+        "peak_parser_rss_mib": round(children.ru_maxrss / 1024, 1),
+        "cpu_ms_per_listing": round(cpu / max(listings, 1) * 1000, 3),
+        "stages": default_metrics.stage().summary(),
+    }
+
+
+def run_once(args, backend, url):
+    command = [sys.executable, "-m", "benchmarks.bench_e2e", "--child", "--url", url, "--backend", backend,
+               "--category", args.category, "--pages", str(args.pages), "--fetch-workers", str(args.fetch_workers)]
+    if args.sizes:
+        command += ["--sizes", *args.sizes]
+    if args.parse_workers:
+        command += ["--parse-workers", str(args.parse_workers)]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")]))}
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run(command, cwd=directory, env=env, capture_output=True, text=True)
+    if output.returncode:
+        raise RuntimeError(f"{backend} crawl failed:\n{output.stderr[-2000:]}")
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def median_run(runs):
+    """Field-wise median of repeated runs; the stage breakdown is taken from the median-throughput run."""
+    result = {field: statistics.median(run[field] for run in runs) for field in runs[0] if field != "stages"}
+    result["stages"] = sorted(runs, key=lambda run: run["listings_per_s"])[len(runs) // 2]["stages"]
+    return result
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def load_baseline(path, scenario):
+    """The last saved run of the same scenario, or None."""
+    if not path or not os.path.isfile(path):
+        return None
+    baseline = None
+    with open(path, encoding='UTF-8') as file:
+        for line in file:
+            record = json.loads(line)
+            if all(record.get(field) == scenario[field] for field in SCENARIO):
+                baseline = record
+    return baseline
+
+
+def regressions(result, baseline, tolerance):
+    """Compared fields that got worse than `baseline` by more than the `tolerance` share."""
+    found = []
+    for field, higher_is_better in COMPARED.items():
+        old, new = baseline.get(field), result.get(field)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            found.append(f"{field} {old} -> {new} ({change:+.0%})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", nargs="+", default=["html", "api"], choices=["html", "api"])
+    parser.add_argument("--category", default="byty", choices=list(DETAIL_FIXTURES))
+    parser.add_argument("--sizes", nargs="+", default=["2+kk"], help="Sizes of the category to crawl")
+    parser.add_argument("--pages", type=int, default=10, help="Search pages per size")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds before every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/503")
+    parser.add_argument("--fetch-workers", type=int, default=50)
+    parser.add_argument("--parse-workers", type=int)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per backend; the median is reported")
+    parser.add_argument("--save", help="Append the results to this JSON lines file")
+    parser.add_argument("--baseline", help="Compare against the last run of the same scenario in this file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed share a compared field may worsen")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.backend = args.backend[0]
+        print(json.dumps(crawl(args)))
+        return
+
+    revision = git_revision()
+    failed = False
+    with SrealityServer(pages=args.pages, detail=DETAIL_FIXTURES[args.category], latency=args.latency,
+                        error_rate=args.error_rate) as server:
+        for backend in args.backend:
+            result = median_run([run_once(args, backend, server.url) for _ in range(args.repeat)])
+            scenario = {"backend": backend, "category": args.category, "sizes": args.sizes, "pages": args.pages,
+                        "latency": args.latency, "error_rate": args.error_rate, "fetch_workers": args.fetch_workers,
+                        "parse_workers": args.parse_workers}
+            record = {**scenario, "revision": revision, "cpus": os.cpu_count(),
+                      "date": datetime.now(timezone.utc).isoformat(timespec="seconds"), **result}
+            print(f"{backend:<4} {result['listings']:5d} listings in {result['seconds']:6.2f}s  "
+                  f"{result['listings_per_s']:7.1f} listings/s   fetch p50 {result['fetch_p50_ms']} ms "
+                  f"p99 {result['fetch_p99_ms']} ms   peak RSS {result['peak_rss_mib']} MiB "
+                  f"(parser {result['peak_parser_rss_mib']} MiB)   CPU {result['cpu_ms_per_listing']} ms/listing")
+
+            baseline = load_baseline(args.baseline, scenario)
+            if baseline is not None:
+                worse = regressions(result, baseline, args.tolerance)
+                if worse:
+                    failed = True
+                    print(f"     REGRESSION against {baseline.get('revision')}: {'; '.join(worse)}")
+                else:
+                    print(f"     within {args.tolerance:.0%} of {baseline.get('revision')}")
+            if args.save:
+                with open(args.save, mode='a', encoding='UTF-8') as file:
+                    file.write(json.dumps(record) + "\n")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
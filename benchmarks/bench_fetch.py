@@ -0,0 +1,60 @@
+"""
+Compare fetch throughput of the old ThreadPoolExecutor + `requests.get` path with the
+asyncio fetch engine against a local stub server.
+
+Usage:
+    python -m benchmarks.bench_fetch --requests 2000 --latency 0.05 --concurrency 200
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.stub_server import StubServer
+from fetcher import fetch_and_process
+from ratelimit import AdaptiveLimiter
+
+
+def threaded(urls, workers):
+    # The pre-engine behaviour: a fresh requests.get (no shared session) per URL
+    def fetch(url):
+        r = requests.get(url)
+        if r.status_code != 200:
+            raise Exception(f"Error {r.status_code} getting response for {url}")
+        return r.text
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(fetch, urls))
+
+
+def asynchronous(urls, concurrency):
+    # Rate cap lifted so the comparison measures connection handling, not the limiter
+    limiter = AdaptiveLimiter(rate=100000, concurrency=concurrency)
+    fetch_and_process(urls, lambda url, html: None, concurrency=concurrency, per_host=concurrency, limiter=limiter)
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    count = len(args[0])
+    print(f"{label:<32} {count} requests in {elapsed:6.2f}s  ->  {count / elapsed:8.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Server-side delay per request in seconds")
+    parser.add_argument("--threads", type=int, default=35, help="Thread count for the old path (30 + 5 today)")
+    parser.add_argument("--concurrency", type=int, default=200, help="In-flight requests for the asyncio engine")
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency) as server:
+        urls = [f"{server.url}/detail/{i}" for i in range(args.requests)]
+        timed(f"ThreadPoolExecutor({args.threads})", threaded, urls, args.threads)
+        timed(f"FetchEngine({args.concurrency})", asynchronous, urls, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Size and query latency of `history.HistoryStore` over a long synthetic history, against
+keeping a daily full CSV dump.
+
+Every simulated day each listing is observed once; a small share of them change price (mostly
+cuts) or another tracked field, and some are removed and replaced by new ones.
+
+Usage:
+    python -m benchmarks.bench_history --listings 20000 --days 730
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from history import HistoryStore
+from utils import OUTPUT_FIELDS
+
+
+URL_PATTERN = "https://www.sreality.cz/detail/prodej/byt/2+kk/praha-vinohrady-vinohradska/{}"
+DAY = 86400
+
+
+def make_row(listing):
+    row = dict.fromkeys(OUTPUT_FIELDS, "")
+    row.update(listing_url=URL_PATTERN.format(listing["id"]), property_type="byty", price=str(listing["price"]),
+               note_on_price="včetně provize", listing_date_updated=listing["updated"], agent_name=listing["agent"],
+               listing_title="Prodej bytu 2+kk 54 m²", location_long="Vinohradská, Praha 2 - Vinohrady",
+               listing_description="Nabízíme k prodeji světlý byt 2+kk v osobním vlastnictví. " * 8)
+    return row
+
+
+def csv_size(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=OUTPUT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return len(buffer.getvalue().encode("UTF-8"))
+
+
+def timed(function, rounds=200):
+    """Median milliseconds of `function()`."""
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=20000, help="Listings on the market at any time")
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--change-rate", type=float, default=0.01, help="Share of listings changing per day")
+    parser.add_argument("--turnover", type=float, default=0.005, help="Share of listings replaced per day")
+    args = parser.parse_args()
+
+    random.seed(1)
+    next_id = 3000000000
+    market = {}
+    for _ in range(args.listings):
+        market[next_id] = {"id": next_id, "price": random.randrange(3000000, 15000000, 10000), "updated": "1-1-2023",
+                           "agent": f"Agent {random.randrange(500)}"}
+        next_id += 1
+
+    start_time = time.time() - args.days * DAY
+    dump_bytes = None
+    with tempfile.TemporaryDirectory() as directory:
+        with HistoryStore(os.path.join(directory, "history.sqlite3")) as history:
+            recorded = time.perf_counter()
+            for day in range(args.days):
+                now = start_time + day * DAY
+                stamp = time.strftime("%-d-%-m-%Y", time.localtime(now))
+                for listing in random.sample(list(market.values()), int(len(market) * args.change_rate)):
+                    if random.random() < 0.7:
+                        listing["price"] = int(listing["price"] * random.uniform(0.9, 1.02)) // 1000 * 1000
+                    else:
+                        listing["agent"] = f"Agent {random.randrange(500)}"
+                    listing["updated"] = stamp
+                removed = random.sample(list(market), int(len(market) * args.turnover))
+                history.mark_removed([URL_PATTERN.format(key) for key in removed], now)
+                for key in removed:
+                    del market[key]
+                    market[next_id] = {"id": next_id, "price": random.randrange(3000000, 15000000, 10000),
+                                       "updated": stamp, "agent": f"Agent {random.randrange(500)}"}
+                    next_id += 1
+                rows = [make_row(listing) for listing in market.values()]
+                history.record(rows, observed_at=now)
+                if dump_bytes is None:
+                    # Every day's dump is about as large as the first one
+                    dump_bytes = csv_size(rows) * args.days
+            recorded = time.perf_counter() - recorded
+            history.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            stats = history.stats()
+
+            sample = [URL_PATTERN.format(3000000000 + random.randrange(next_id - 3000000000)) for _ in range(200)]
+            series_ms = timed(lambda: history.series(random.choice(sample)))
+            drops = history.price_drops(days=7, now=start_time + args.days * DAY)
+            drops_ms = timed(lambda: history.price_drops(days=7, now=start_time + args.days * DAY), rounds=50)
+
+    observations = args.days * args.listings
+    print(f"{args.days} days x {args.listings:,} listings: {stats['listings']:,} listings, {stats['changes']:,} "
+          f"field changes, recorded at {observations / recorded:,.0f} observations/s")
+    print(f"history database {stats['size_mib']:8.1f} MiB   daily CSV dumps {dump_bytes / 2 ** 20:10.1f} MiB")
+    print(f"price series of one listing {series_ms:6.3f} ms   "
+          f"price drops in the last 7 days ({len(drops)} found) {drops_ms:6.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Per-row field parsers (`utils`) against their column-wise versions (`normalize`) on a
+synthetic frame, column by column. Both must produce the same values.
+
+Usage:
+    python -m benchmarks.bench_normalize --rows 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from normalize import (format_price_batch, parse_construction_batch, parse_location_batch,
+                       split_agent_contacts_batch)
+from utils import format_price, parse_construction, parse_location, split_agent_contacts
+
+
+CITIES = ["Praha", "Brno", "Ostrava", "Plzeň", "Liberec", "Olomouc", "České Budějovice", "Hradec Králové",
+          "Ústí nad Labem", "Pardubice", "Zlín", "Kladno", "Most", "Opava", "Jihlava"]
+STREET_NAMES = ["Vinohradská", "Na Příkopě", "Dlouhá", "Husova", "Palackého", "Masarykova", "Nádražní", "Školní",
+                "Zahradní", "Polní", "Lesní", "Krátká", "Sokolská", "Komenského", "Tyršova", "Jiráskova"]
+
+
+def synthetic_frame(rows, seed=0):
+    """
+    Raw field values shaped like a real dump: thousands of distinct streets and prices,
+    far fewer cities, constructions and agents, and some gaps.
+    """
+    rng = np.random.default_rng(seed)
+
+    def pick(pool, size=rows):
+        return np.array(pool, dtype=object)[rng.integers(0, len(pool), size)]
+
+    streets = [f"{name} {number}" for name in STREET_NAMES for number in range(1, 250)] + ["", "  "]
+    districts = [f"{city} {number}" for city in CITIES[:3] for number in range(1, 11)] + ["Vinohrady", "Líšeň"]
+    locations = [f"{street}, {city} - {district}" if district else f"{street}, {city}"
+                 for street, city, district in zip(pick(streets), pick(CITIES), pick(districts + [None]))]
+    locations = pd.Series(locations, dtype=object)
+    city_only = rng.random(rows) < 0.2
+    locations[city_only] = [f"{city} - {district}" for city, district in
+                            zip(pick(CITIES, city_only.sum()), pick(districts, city_only.sum()))]
+    locations[rng.random(rows) < 0.02] = None
+
+    # Prices in thousands of CZK, formatted the way the site renders them
+    amounts = rng.integers(500, 30000, rows) * 1000
+    prices = pd.Series([f"{amount:,} Kč".replace(",", "\xa0") for amount in amounts], dtype=object)
+    prices[rng.random(rows) < 0.05] = "Info o ceně u RK"
+    prices[rng.random(rows) < 0.02] = None
+
+    constructions = [f"{material}, {state}, {floor}. podlaží z {floor + 3}"
+                     for material in ("Cihlová", "Panelová", "Smíšená")
+                     for state in ("Velmi dobrý", "Dobrý", "Novostavba", "Po rekonstrukci") for floor in range(1, 9)]
+    constructions += ["Smíšená, Novostavba", "", None]
+
+    agents = [[f"+420 {rng.integers(600, 800)} {rng.integers(100, 999)} {rng.integers(100, 999)}",
+               f"makler{agent}@reality{agent % 400}.cz", f"+420 224 {rng.integers(100, 999)} {agent % 900 + 100}"]
+              for agent in range(3000)] + [["www.reality.cz"], [], ["12", "a@b.cz", "603555222"]]
+
+    return pd.DataFrame({"location": locations, "price": prices,
+                         "construction": pick(constructions), "contacts": list(pick(agents))})
+
+
+def scalar_or_missing(parse):
+    """The scrape path's guard: parsers only see non-empty values."""
+    return lambda value: parse(value) if value else (None, None, None)
+
+
+# column, per-row parser, batch parser
+FIELDS = {
+    "location": ("location", scalar_or_missing(parse_location),
+                 lambda column: parse_location_batch(column.where(column != ""))),
+    "price": ("price", format_price, format_price_batch),
+    "construction": ("construction", scalar_or_missing(parse_construction), parse_construction_batch),
+    "contacts": ("contacts", split_agent_contacts, split_agent_contacts_batch),
+}
+
+
+def as_rows(result):
+    """A batch result in the per-row shape, for comparison."""
+    if isinstance(result, pd.Series):
+        return list(result)
+    return list(result.astype(object).where(result.notna(), None).itertuples(index=False, name=None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    frame = synthetic_frame(args.rows)
+    totals = {"per row": 0.0, "batch": 0.0}
+    for name, (column, scalar, batch) in FIELDS.items():
+        values = frame[column]
+        start = time.perf_counter()
+        expected = [scalar(value) for value in values]
+        per_row = time.perf_counter() - start
+        start = time.perf_counter()
+        result = batch(values)
+        batched = time.perf_counter() - start
+
+        mismatches = sum(want != got for want, got in zip(expected, as_rows(result)))
+        if mismatches:
+            raise SystemExit(f"{name}: {mismatches} value(s) differ from the per-row parser")
+        totals["per row"] += per_row
+        totals["batch"] += batched
+        distinct = values.map(lambda value: tuple(value) if isinstance(value, list) else value).nunique()
+        print(f"{name:<13} {distinct:9,} distinct   per row {per_row:6.2f}s   batch {batched:6.2f}s   "
+              f"{per_row / batched:5.1f}x")
+
+    print(f"{'total':<13} {args.rows:9,} rows       per row {totals['per row']:6.2f}s   "
+          f"batch {totals['batch']:6.2f}s   {totals['per row'] / totals['batch']:5.1f}x, identical output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare detail page extraction on saved HTML fixtures: the previous path (full
+`html.parser` soup, walked once per field) against `parse_detail_page` (only the needed
+subtrees, indexed in one pass). Both must produce identical `scraped_data` rows.
+
+Usage:
+    python -m benchmarks.bench_parse --rounds 50
+"""
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from detail_parser import parse_detail_page
+from utils import parse_listing
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def full_soup(html):
+    return BeautifulSoup(html, "html.parser")
+
+
+def run(parse, pages, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name, html in pages:
+            parse_listing(parse(html), name, "byty")
+    elapsed = time.perf_counter() - start
+    return rounds * len(pages) / elapsed
+
+
+def allocations(parse, pages):
+    """Peak traced memory and number of allocated blocks per page, averaged over the fixtures."""
+    peak_total, blocks_total = 0, 0
+    for name, html in pages:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = parse(html)
+        parse_listing(result, name, "byty")
+        after = tracemalloc.take_snapshot()
+        peak_total += tracemalloc.get_traced_memory()[1]
+        blocks_total += sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+        tracemalloc.stop()
+        del result
+    return peak_total / len(pages), blocks_total / len(pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = [(path.name, path.read_text(encoding="UTF-8")) for path in sorted(FIXTURES.glob("detail_*.html"))]
+    for name, html in pages:
+        expected = parse_listing(full_soup(html), name, "byty")
+        actual = parse_listing(parse_detail_page(html), name, "byty")
+        if expected != actual:
+            raise SystemExit(f"Output mismatch on {name}:\n{expected}\n{actual}")
+
+    for label, parse in (("full soup", full_soup), ("parse_detail_page", parse_detail_page)):
+        pages_per_sec = run(parse, pages, args.rounds)
+        peak, blocks = allocations(parse, pages)
+        print(f"{label:<20} {pages_per_sec:8.1f} pages/s   peak {peak / 1024:8.1f} KiB/page   "
+              f"{blocks:8.0f} live blocks/page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Measure how the fetch -> parse pipeline scales with the number of parser processes.
+A local stub server serves a saved detail page fixture with no added latency, so the run
+is bound by parsing rather than the network.
+
+Usage:
+    python -m benchmarks.bench_pipeline --pages 400 --parse-workers 1 2 4 8
+"""
+import argparse
+import os
+import time
+from functools import partial
+from pathlib import Path
+
+from benchmarks.stub_server import StubServer
+from pipeline import run_pipeline
+from ratelimit import AdaptiveLimiter
+from utils import parse_listing_html
+
+
+FIXTURE = Path(__file__).parent / "fixtures" / "detail_byt.html"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--fetch-workers", type=int, default=50)
+    parser.add_argument("--parse-workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--queue-size", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs available")
+    with StubServer(latency=0, body=FIXTURE.read_bytes()) as server:
+        urls = [f"{server.url}/detail/{i}" for i in range(args.pages)]
+        baseline = None
+        for workers in args.parse_workers:
+            rows = []
+            limiter = AdaptiveLimiter(rate=100000, concurrency=args.fetch_workers)
+            start = time.perf_counter()
+            run_pipeline(urls, partial(parse_listing_html, property_type="byty"), lambda url, row: rows.append(row),
+                         fetch_workers=args.fetch_workers, parse_workers=workers, queue_size=args.queue_size,
+                         limiter=limiter)
+            rate = len(rows) / (time.perf_counter() - start)
+            baseline = baseline or rate
+            print(f"{workers:>3} parser process(es): {rate:8.1f} pages/s  ({rate / baseline:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+How soon new listings are scraped when a crawl also has known listings to go through, with
+listings fetched in arrival order (known ones left over from an earlier run first, as before)
+and in freshness order (see `scheduler`), against the local sreality stand-in.
+
+The state store is seeded with `--known` listings scraped before and handed out again, as
+after failures or with --reparse; the crawl then discovers new ones page by page. Reports
+the time until 50% and 95% of the new listings are scraped, and how many new listings a run
+with a time budget of half the arrival-order crawl gets done.
+
+Usage:
+    python -m benchmarks.bench_scheduler --known 1000 --pages 3 --fetch-workers 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import cli
+import scheduler
+import utils
+from benchmarks.stub_server import SrealityServer
+from pipeline import Pipeline
+from state import StateStore
+
+
+def seed(store, server_url, known):
+    """Known listings, scraped before with random `listing_date_updated`, now pending again."""
+    page_url = f"{server_url}/hledani/prodej/byty?strana=1"
+    urls = [f"{server_url}/detail/prodej/byt/2+kk/praha/{1000000000 + number}" for number in range(known)]
+    store.add_listings("byty", page_url, urls)
+    store.mark_written([{"listing_url": url, "listing_date_updated": f"{random.randint(1, 28)}-"
+                         f"{random.randint(1, 12)}-{random.randint(2020, 2024)}"} for url in urls])
+    store.reset_listings("byty")
+    return set(urls)
+
+
+async def crawl(server, directory, args, order, budget=None):
+    """Scrape times in seconds from the start of the crawl, by listing URL."""
+    path = os.path.join(directory, f"{order}-{budget}.sqlite3")
+    scraped = {}
+    with StateStore(path) as store:
+        known = seed(store, server.url, args.known)
+        start = time.perf_counter()
+
+        def save(listing_url, row, property_type):
+            scraped[listing_url] = time.perf_counter() - start
+
+        async with Pipeline(fetch_workers=args.fetch_workers, parse_workers=1) as pipeline:
+            await cli.crawl_category(pipeline, store, "byty", save, pages=args.pages, passcode=utils.PASSCODE,
+                                     backend="html",
+                                     deadline=time.monotonic() + budget if budget is not None else None)
+    return {url: seconds for url, seconds in scraped.items() if url not in known}, len(scraped) - \
+        sum(url not in known for url in scraped), time.perf_counter() - start
+
+
+def time_to(times, share, total):
+    ordered = sorted(times)
+    needed = int(total * share + 0.999999)
+    return ordered[needed - 1] if needed <= len(ordered) else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--known", type=int, default=1000, help="Known listings handed out again")
+    parser.add_argument("--pages", type=int, default=3, help="Search pages per size")
+    parser.add_argument("--fetch-workers", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    freshness_priority = scheduler.freshness_priority
+    with SrealityServer(pages=args.pages, latency=args.latency) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        utils.base_url = server.url
+        results = {}
+        for order in ("arrival", "freshness"):
+            random.seed(1)
+            # Arrival order: every listing gets the same priority, so the frontier is FIFO
+            scheduler.freshness_priority = (lambda *details: 0) if order == "arrival" else freshness_priority
+            new, known, elapsed = asyncio.run(crawl(server, directory, args, order))
+            results[order] = (new, elapsed)
+            total = len(new)
+            print(f"{order:<9} {total:,} new + {known:,} known listings in {elapsed:6.1f}s   "
+                  f"50% of new {time_to(new.values(), 0.5, total):6.1f}s   "
+                  f"95% of new {time_to(new.values(), 0.95, total):6.1f}s   "
+                  f"median new {statistics.median(new.values()):6.1f}s")
+
+        budget = results["arrival"][1] / 2
+        total = len(results["arrival"][0])
+        for order in ("arrival", "freshness"):
+            random.seed(1)
+            scheduler.freshness_priority = (lambda *details: 0) if order == "arrival" else freshness_priority
+            new, known, elapsed = asyncio.run(crawl(server, directory, args, order, budget=budget))
+            print(f"{order:<9} {budget:5.1f}s budget: {len(new):,}/{total:,} new ({len(new) / total:6.1%}) "
+                  f"and {known:,} known listings, stopped after {elapsed:6.1f}s")
+        scheduler.freshness_priority = freshness_priority
+
+
+if __name__ == "__main__":
+    main()
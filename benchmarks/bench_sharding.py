@@ -0,0 +1,114 @@
+"""
+Coverage and time of search page discovery with and without sharding, against a stand-in
+estate API that holds a synthetic set of listings, honours the region, district and price
+filters, and serves no page past a pagination limit, like the real site.
+
+Usage:
+    python -m benchmarks.bench_sharding --listings 60000 --page-limit 20 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import utils
+from backends import parse_search_page
+from benchmarks.stub_server import StubHandler, StubServer
+from discovery import iter_page_urls
+from pipeline import Pipeline
+from sharding import DISTRICTS, REGIONS, ShardProgress, iter_shard_page_urls
+
+
+class ListingsHandler(StubHandler):
+    def body_for(self, path):
+        server = self.server
+        params = {name: values[0] for name, values in parse_qs(urlsplit(path).query).items()}
+        server.requests += 1
+        matches = server.listings
+        if "locality_region_id" in params:
+            matches = [listing for listing in matches if listing[1] == int(params["locality_region_id"])]
+        if "locality_district_id" in params:
+            matches = [listing for listing in matches if listing[2] == int(params["locality_district_id"])]
+        if "czk_price_summary_order2" in params:
+            low, high = params["czk_price_summary_order2"].split("|")
+            matches = [listing for listing in matches if listing[3] is not None and int(low) <= listing[3]
+                       and (not high or listing[3] <= int(high))]
+        page, per_page = int(params.get("page", 1)), int(params.get("per_page", 60))
+        shown = matches[(page - 1) * per_page:page * per_page] if page <= server.page_limit else []
+        document = {"result_size": len(matches), "per_page": per_page, "_embedded": {"estates": [
+            {"hash_id": listing[0], "seo": {"category_main_cb": 1, "category_sub_cb": 4, "category_type_cb": 1,
+                                            "locality": "praha"}} for listing in shown]}}
+        return json.dumps(document).encode(), "application/json"
+
+
+class ListingsServer(StubServer):
+    handler_class = ListingsHandler
+
+    def __init__(self, listings, page_limit, **kwargs):
+        super().__init__(**kwargs)
+        self.page_limit = page_limit
+        self.requests = 0
+        region_weights = {region_id: 4 if slug == "praha" else 1 for slug, region_id in REGIONS.items()}
+        prague_districts = list(DISTRICTS["praha"].values())
+        self.listings = []
+        for number in range(listings):
+            region = random.choices(list(region_weights), weights=list(region_weights.values()))[0]
+            district = random.choice(prague_districts) if region == REGIONS["praha"] else None
+            price = None if random.random() < 0.02 else int(random.lognormvariate(math.log(5000000), 0.6)) // 1000 * 1000
+            self.listings.append((3000000000 + number, region, district, price))
+
+
+async def discover(server_url, sharded, page_limit):
+    """Listing URLs found through every search page, and the shard planner's progress."""
+    found = set()
+    progress = ShardProgress("byty") if sharded else None
+    async with Pipeline(parse_workers=1) as pipeline:
+        if sharded:
+            page_urls = iter_shard_page_urls(pipeline, "byty", 10 ** 6, sizes=["2+kk"], passcode=utils.PASSCODE,
+                                             backend="api", page_limit=page_limit, progress=progress)
+        else:
+            page_urls = iter_page_urls(pipeline, "byty", 10 ** 6, sizes=["2+kk"], passcode=utils.PASSCODE,
+                                       backend="api")
+
+        async def page_source():
+            async for page_url, data_dict in page_urls:
+                if data_dict is not None:
+                    found.update(data_dict["listing_url"])
+                else:
+                    yield page_url
+
+        async def save(page_url, data_dict):
+            found.update(data_dict["listing_url"])
+
+        await pipeline.process(page_source(), partial(parse_search_page, property_type="byty"), save)
+    return found, progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=60000)
+    parser.add_argument("--page-limit", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with ListingsServer(args.listings, args.page_limit, latency=args.latency) as server:
+        utils.base_url = server.url
+        priced = sum(listing[3] is not None for listing in server.listings)
+        for sharded in (False, True):
+            server.requests = 0
+            start = time.perf_counter()
+            found, progress = asyncio.run(discover(server.url, sharded, args.page_limit))
+            elapsed = time.perf_counter() - start
+            reported = f"   {progress.unpriced:,} unpriced reported unreachable" if progress is not None else ""
+            print(f"{'sharded' if sharded else 'unsharded':<9} {len(found):7,}/{args.listings:,} listings "
+                  f"({len(found) / args.listings:6.1%}, {priced / args.listings:.1%} have a price)   "
+                  f"{server.requests:5,} requests   {elapsed:6.1f}s{reported}")
+
+
+if __name__ == "__main__":
+    main()
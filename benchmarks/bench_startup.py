@@ -0,0 +1,64 @@
+"""
+Cold start cost of the entry points, from `python -X importtime`: total import time, the
+heaviest top-level packages, which optional heavy dependencies got loaded, and whether the
+import created anything in the working directory.
+
+Each module is imported in a fresh interpreter in an empty directory, several times; the
+median is reported.
+
+Usage:
+    python -m benchmarks.bench_startup --modules cli main distributed --rounds 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Dependencies only the analytics, export, image or legacy paths should load
+HEAVY = ("pandas", "numpy", "pyarrow", "PIL", "bs4", "requests", "tqdm")
+
+
+def import_times(module):
+    """Microseconds spent importing each top-level package (its own modules only), and the files the import created."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")]))}
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=directory,
+                                env=env, capture_output=True, text=True, check=True)
+        created = sorted(os.listdir(directory))
+    packages = defaultdict(int)
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            packages[name.strip().split(".")[0]] += int(own)
+    return packages, created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["cli", "main", "distributed", "incremental", "backends"])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="Heaviest packages to list per module")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.rounds)]
+        total = statistics.median(sum(packages.values()) for packages, _ in runs)
+        packages = {name: statistics.median(run[0].get(name, 0) for run in runs) for name in runs[0][0]}
+        heavy = [name for name in HEAVY if name in packages]
+        print(f"{module:<12} {total / 1000:7.1f} ms   heavy: {', '.join(heavy) or 'none'}   "
+              f"created: {', '.join(runs[0][1]) or 'nothing'}")
+        for name, micros in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"{'':12} {micros / 1000:7.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Local HTTP stand-in used by the benchmarks so nothing ever hits sreality.cz.
+
+Every GET returns the same HTML body after a fixed delay, which is enough to compare
+how different fetch strategies overlap network latency. A share of requests can be
+answered with 429/503 instead, to exercise the retry and rate limiting paths.
+
+`SrealityServer` serves the saved search and detail page fixtures of both backends instead,
+so a whole crawl can run against it: each search page lists its own listings, and the
+pagination reports a chosen number of pages.
+"""
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+DEFAULT_BODY = b"<html><body><h1>stub</h1>" + b"<p>listing</p>" * 2000 + b"</body></html>"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self.server.injected += 1
+            self.send_error_response()
+            return
+        body, content_type = self.body_for(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body_for(self, path):
+        return self.server.body, "text/html; charset=utf-8"
+
+    def send_error_response(self):
+        status = random.choice(self.server.error_statuses)
+        self.send_response(status)
+        if status == 429 and self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    handler_class = StubHandler
+
+    def __init__(self, latency=0.05, body=DEFAULT_BODY, port=0, error_rate=0.0, error_statuses=(429, 503),
+                 retry_after=1):
+        super().__init__(("127.0.0.1", port), self.handler_class)
+        self.latency = latency
+        self.body = body
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.retry_after = retry_after
+        self.injected = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class SrealityHandler(StubHandler):
+    def body_for(self, path):
+        server = self.server
+        if "/api/cs/v2/estates?" in path:
+            return server.api_search.replace(b'"hash_id": 30000', b'"hash_id": ' + server.page_key(path) + b"30000"), \
+                "application/json"
+        if "/api/cs/v2/estates/" in path:
+            return server.api_detail, "application/json"
+        if "/detail/" in path:
+            return server.html_detail, "text/html; charset=utf-8"
+        if "/adresar/" in path:
+            server.agent_requests += 1
+            return server.agent_profile, "text/html; charset=utf-8"
+        return server.html_search.replace(b"/30000001", b"/" + server.page_key(path) + b"30000001"), \
+            "text/html; charset=utf-8"
+
+
+class SrealityServer(StubServer):
+    """
+    Stand-in for sreality.cz serving the page fixtures, for both the `html` and `api` backends.
+
+    Args:
+        pages (int): Last page number every search reports
+        detail (str): Detail fixture served for every listing, e.g. "byt" for
+            `fixtures/detail_byt.html` and `fixtures/estate_byt.json`
+        latency, port, error_rate, error_statuses, retry_after: See `StubServer`
+    """
+
+    handler_class = SrealityHandler
+
+    def __init__(self, pages=5, detail="byt", **kwargs):
+        super().__init__(**kwargs)
+        self.html_search = (FIXTURES / "search.html").read_bytes() \
+            .replace(b'?strana=25">25<', f'?strana={pages}">{pages}<'.encode())
+        self.api_search = (FIXTURES / "estates_search.json").read_bytes() \
+            .replace(b'"result_size": 1500', f'"result_size": {pages * 60}'.encode())
+        self.html_detail = (FIXTURES / f"detail_{detail}.html").read_bytes()
+        self.api_detail = (FIXTURES / f"estate_{detail}.json").read_bytes()
+        self.agent_profile = (FIXTURES / "agent_profile.html").read_bytes()
+        self.agent_requests = 0
+        self.page_keys = {}
+        self.lock = threading.Lock()
+
+    def page_key(self, path):
+        """Prefix that makes the listing IDs of one search page unique, the same on every request for it."""
+        with self.lock:
+            return str(self.page_keys.setdefault(path, len(self.page_keys) + 1)).encode()
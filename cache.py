@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+
+# zlib level: most of the gain of higher levels at a fraction of their CPU cost
+COMPRESSION_LEVEL = 6
+
+# Eviction trims the cache to this share of `max_bytes`, so it doesn't run on every put
+EVICT_TO = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+class CacheMiss(Exception):
+    """A URL that is not in the cache was requested in replay mode."""
+
+
+def cache_key(url, params=None):
+    """SHA-256 of the URL and its sorted query parameters."""
+    request = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+    return hashlib.sha256(request.encode("UTF-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Optional on-disk cache of response bodies, keyed by URL plus request parameters.
+
+    Bodies are zlib-compressed and kept in one SQLite blob store in WAL mode, next to the
+    state store. Entries older than `ttl` seconds are treated as missing, and once the
+    compressed size passes `max_bytes` the least recently used entries are evicted.
+
+    In replay mode nothing is fetched: every body comes from the cache, TTL is ignored and a
+    URL that isn't cached fails with `CacheMiss`, so parsers can be re-run on a finished crawl
+    without any network traffic.
+
+    Args:
+        db_path (str | Path): Location of the SQLite database file
+        ttl (float, optional): Seconds an entry stays fresh, forever by default
+        max_bytes (int, optional): Compressed size to evict down from, unbounded by default
+        replay (bool): Serve from the cache only
+    """
+
+    def __init__(self, db_path, ttl=None, max_bytes=None, replay=False):
+        self.db_path = str(db_path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get(self, url, params=None):
+        """
+        The cached body of a request, or None when it isn't cached or has expired.
+        """
+        key = cache_key(url, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (not self.replay and self.ttl is not None and row[1] + self.ttl < now):
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return zlib.decompress(row[0]).decode("UTF-8")
+
+    def put(self, url, body, params=None):
+        """Store a response body, evicting least recently used entries when over `max_bytes`."""
+        if self.replay:
+            return
+        key = cache_key(url, params)
+        compressed = zlib.compress(body.encode("UTF-8"), COMPRESSION_LEVEL)
+        now = time.time()
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, url, body, size, stored_at, accessed_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (key, url, compressed, len(compressed), now, now))
+            self.total_bytes += len(compressed) - (previous[0] if previous else 0)
+            if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICT_TO))
+
+    def _evict(self, target_bytes):
+        freed, keys = 0, []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if self.total_bytes - freed <= target_bytes:
+                break
+            keys.append((key,))
+            freed += size
+        self.conn.execute("BEGIN")
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.conn.execute("COMMIT")
+        self.total_bytes -= freed
+        self.evicted += len(keys)
+        logging.info(f"Response cache: Evicted {len(keys)} entries ({freed / 2 ** 20:.1f} MiB)")
+
+    def purge_expired(self):
+        """Delete entries older than `ttl`. Returns the number removed."""
+        if self.ttl is None:
+            return 0
+        with self.lock:
+            cutoff = time.time() - self.ttl
+            freed, count = self.conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM responses "
+                                             "WHERE stored_at < ?", (cutoff,)).fetchone()
+            self.conn.execute("DELETE FROM responses WHERE stored_at < ?", (cutoff,))
+            self.total_bytes -= freed
+        return count
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+                "size_mib": round(self.total_bytes / 2 ** 20, 1)}
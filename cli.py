@@ -0,0 +1,370 @@
+"""
+Headless, non-interactive entry point for scheduled and batch runs.
+
+Several categories can be crawled in one invocation; they share one connection pool, rate
+limiter and parser process pool. Listing URLs found on search pages are streamed straight
+into listing scraping, and progress is kept in the state store so an interrupted run resumes.
+
+Usage:
+    python cli.py byty domy --pages 3 --sizes 2+kk 3+kk
+    python cli.py byty --backend api --pages 3
+    python cli.py byty --replay --reparse
+    python cli.py byty --metrics-port 9100 --metrics-json metrics.jsonl
+    python cli.py byty --images
+    python cli.py byty --history
+    python cli.py byty --agents --agent-ttl 72
+    python cli.py all --pages 50 --passcode <code> --time-budget 30
+    python cli.py byty --shard --pages 1000 --passcode <code>
+    python cli.py all --pages 50 --passcode <code> --fetch-workers 200 --parquet
+    python cli.py --config crawl.json
+
+A config file is a JSON object whose keys are the long option names with underscores,
+e.g. {"categories": ["byty"], "pages": 3, "fetch_workers": 100}. Command line options
+override it.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from functools import partial
+
+from agents import DEFAULT_TTL as DEFAULT_AGENT_TTL, AgentEnricher, AgentStore
+from backends import BACKENDS, DEFAULT_BACKEND, get_backend, parse_search_page
+from cache import ResponseCache
+from dedup import FRONTIER_MAX_BYTES, FingerprintSet
+from fetcher import DEFAULT_CONCURRENCY
+from history import HistoryStore
+from media import MediaDownloader
+from metrics import JsonReporter, default_metrics, start_http_server
+from parquet_output import optional_parquet_sink
+from discovery import iter_page_urls
+from pipeline import DEFAULT_QUEUE_SIZE, Pipeline
+from ratelimit import DEFAULT_RATE, AdaptiveLimiter
+from scheduler import FreshnessFrontier, prioritize
+from sharding import DEFAULT_PAGE_LIMIT, ShardProgress, iter_shard_page_urls
+from state import DONE, FAILED, StateStore
+from utils import (PROPERTY_SIZES, agents_db_path, cache_db_path, configure_logging, history_db_path,
+                   history_snapshot_dir, media_dir, open_written_set, output_dir, save_listing, state_db_path)
+from writer import BatchWriter
+
+
+CATEGORIES = list(PROPERTY_SIZES)
+
+
+async def crawl_category(pipeline, store, property_type, save, pages=1, sizes=None, passcode=None, backend=None,
+                         shard=False, page_limit=DEFAULT_PAGE_LIMIT, deadline=None):
+    """
+    Crawl one category on a shared pipeline. Search page URLs are streamed in while pagination
+    discovery is still running, and every new listing URL is streamed into listing scraping as
+    soon as its search page is parsed. Listings are fetched in order of freshness, see
+    `scheduler`.
+
+    Args:
+        pipeline (Pipeline): Shared fetch and parse workers
+        store (StateStore): Crawl state
+        property_type (str): Category to crawl
+        save (callable): `save(listing_url, row, property_type)` for every scraped listing
+        pages (int): Pages per size
+        sizes (list, optional): Only these sizes of the category
+        passcode (int, optional): Required above the free page limit
+        backend (str, optional): Extraction backend, see `backends`
+        shard (bool): Split searches by region, district and price until each fits within
+            `page_limit` pages, see `sharding`; `pages` then applies per shard
+        page_limit (int): Deepest search page the site serves
+        deadline (float, optional): `time.monotonic()` value at which no further pages or
+            listings are started; what's left stays pending for the next run
+    """
+    extraction = get_backend(backend)
+    progress = ShardProgress(property_type) if shard else None
+    pending_page_urls = store.pending_pages(property_type)
+
+    # Listings left over from an earlier run and newly discovered ones, most valuable first
+    listings = FreshnessFrontier(deadline)
+    queued = FingerprintSet(max_bytes=FRONTIER_MAX_BYTES)
+
+    async def queue_listings(urls):
+        # State store lookups run in a thread, so the event loop keeps feeding the fetch workers
+        urls = [url for url in urls if queued.add(url)]
+        listings.push_all(await asyncio.to_thread(prioritize, store, urls))
+
+    await queue_listings(store.pending_listings(property_type))
+    logging.info(f"Property {property_type}: {len(pending_page_urls) or 'Discovering'} page(s) and "
+                 f"{len(queued)} pending listing(s) to go")
+
+    async def save_listing_urls(page_url, data_dict):
+        urls = [url for url in data_dict["listing_url"] if url]
+        store.add_listings(property_type, page_url, urls)
+        store.mark_page(page_url, DONE)
+        await queue_listings(await asyncio.to_thread(store.unfinished_listings, urls))
+        if progress is not None:
+            progress.page_done(page_url)
+
+    def page_failed(page_url, error):
+        store.mark_page(page_url, FAILED)
+        if progress is not None:
+            progress.page_done(page_url)
+
+    async def page_source():
+        # Resume pending pages of an earlier run, otherwise discover them lazily
+        if pending_page_urls:
+            for page_url in pending_page_urls:
+                if listings.expired():
+                    return
+                yield page_url
+            return
+        if shard:
+            page_urls = iter_shard_page_urls(pipeline, property_type, pages, sizes=sizes, passcode=passcode,
+                                             backend=backend, page_limit=page_limit, progress=progress)
+        else:
+            page_urls = iter_page_urls(pipeline, property_type, pages, sizes=sizes, passcode=passcode, backend=backend)
+        async for page_url, data_dict in page_urls:
+            if listings.expired():
+                await page_urls.aclose()
+                return
+            store.add_pages(property_type, [page_url])
+            if data_dict is not None:
+                await save_listing_urls(page_url, data_dict)
+            else:
+                yield page_url
+
+    async def discover():
+        try:
+            await pipeline.process(page_source(), partial(parse_search_page, property_type=property_type),
+                                   save_listing_urls, on_failure=page_failed)
+        finally:
+            listings.close()
+
+    try:
+        await asyncio.gather(
+            discover(),
+            pipeline.process(listings, partial(extraction.parse_listing, property_type=property_type),
+                             partial(save, property_type=property_type),
+                             on_failure=lambda listing_url, error: store.mark_listing(listing_url, FAILED),
+                             request_url=extraction.listing_request_url))
+    finally:
+        queued.close()
+    if listings.expired():
+        logging.info(f"Property {property_type}: Crawl stopped at the time budget after {listings.handed_out} "
+                     f"listing(s)")
+    else:
+        logging.info(f"Property {property_type}: Crawl finished")
+
+
+async def crawl_async(categories, pages=1, sizes=None, passcode=None, fetch_workers=DEFAULT_CONCURRENCY,
+                      parse_workers=None, queue_size=DEFAULT_QUEUE_SIZE, rate=None, parquet=False, backend=None,
+                      cache=False, cache_ttl=None, cache_max_mb=None, replay=False, reparse=False,
+                      metrics_port=None, metrics_json=None, metrics_interval=30.0, images=False,
+                      history=False, shard=False, page_limit=DEFAULT_PAGE_LIMIT, agents=False,
+                      agent_ttl=None, time_budget=None):
+    """
+    Crawl several categories concurrently on one shared pipeline. See `crawl`.
+    """
+    deadline = time.monotonic() + time_budget * 60 if time_budget else None
+    metrics_server = start_http_server(metrics_port) if metrics_port is not None else None
+    reporter = JsonReporter(metrics_json, interval=metrics_interval) if metrics_json else None
+    # Sized from fetch_workers: the process-wide default limiter caps requests in flight at 100
+    limiter = AdaptiveLimiter(rate=rate or DEFAULT_RATE, concurrency=fetch_workers)
+    parquet_sink = optional_parquet_sink(output_dir / "parquet") if parquet else None
+    response_cache = None
+    if cache or replay:
+        response_cache = ResponseCache(cache_db_path, ttl=cache_ttl * 3600 if cache_ttl else None,
+                                       max_bytes=cache_max_mb * 2 ** 20 if cache_max_mb else None, replay=replay)
+
+    # Listings already in the output; with --reparse the earlier output has been moved aside
+    written = open_written_set(rebuild=reparse)
+
+    with StateStore(state_db_path) as store:
+        if reparse:
+            for property_type in categories:
+                store.reset_pages(property_type)
+                store.reset_listings(property_type)
+        media = MediaDownloader(media_dir) if images else None
+        history_store = HistoryStore(history_db_path) if history else None
+        agent_store = AgentStore(agents_db_path) if agents else None
+        enricher = None
+
+        def on_flush(file_path, rows):
+            store.mark_written(rows)
+            if history_store is not None:
+                if enricher is not None:
+                    # The history tracks the agent by name, which normalized rows no longer carry
+                    rows = [dict(row, agent_name=enricher.agent_name(row["agent_id"])) for row in rows]
+                history_store.record(rows)
+            if media is not None:
+                media.submit_rows(rows)
+
+        try:
+            if media is not None:
+                await media.__aenter__()
+            with BatchWriter(on_flush=on_flush, dedup=written, parquet=parquet_sink) as writer:
+                save = partial(save_listing, writer=writer)
+                async with Pipeline(fetch_workers=fetch_workers, parse_workers=parse_workers,
+                                    queue_size=queue_size, limiter=limiter, cache=response_cache) as pipeline:
+                    if agent_store is not None:
+                        enricher = AgentEnricher(agent_store, pipeline,
+                                                 ttl=agent_ttl * 3600 if agent_ttl is not None else DEFAULT_AGENT_TTL)
+                        save_row = save
+
+                        async def save(listing_url, scraped_data, property_type):
+                            # Normalized on the event loop, where profile fetches are queued
+                            listing = await enricher.normalize(scraped_data)
+                            await asyncio.get_running_loop().run_in_executor(
+                                None, partial(save_row, listing_url, listing, property_type))
+
+                    try:
+                        await asyncio.gather(*(
+                            crawl_category(pipeline, store, property_type, save, pages=pages, sizes=sizes,
+                                           passcode=passcode, backend=backend, shard=shard, page_limit=page_limit,
+                                           deadline=deadline)
+                            for property_type in categories))
+                    finally:
+                        if enricher is not None:
+                            await enricher.join()
+            if history_store is not None and parquet_sink is not None:
+                # With --parquet the history snapshot is refreshed too, once every row is recorded
+                await asyncio.to_thread(history_store.compact, history_snapshot_dir)
+        finally:
+            if media is not None:
+                await media.close()
+            if history_store is not None:
+                history_store.close()
+            if agent_store is not None:
+                logging.info(f"Exported {agent_store.export_csv(output_dir / 'agents.csv')} agent(s)")
+                agent_store.close()
+            written.close()
+            if parquet_sink is not None:
+                parquet_sink.close()
+            if response_cache is not None:
+                logging.info(f"Response cache stats: {response_cache.stats()}")
+                response_cache.close()
+            if reporter is not None:
+                reporter.close()
+            if metrics_server is not None:
+                metrics_server.shutdown()
+            logging.info(f"Stage latency: {default_metrics.stage().summary()}")
+
+
+def crawl(categories, **kwargs):
+    """
+    Library entry point: crawl the given categories without any prompts.
+
+    Args:
+        categories (list): Property types to crawl (byty, domy, pozemky, komercni, ostatni)
+        pages (int): Pages per size
+        sizes (list, optional): Only these sizes, applied to every category that has them
+        passcode (int, optional): Required above the free page limit
+        fetch_workers (int): Requests in flight at once, shared by all categories
+        parse_workers (int, optional): Parser processes, one per CPU by default
+        queue_size (int): Fetched pages that may wait for a parser
+        rate (float, optional): Starting requests per second, `ratelimit.DEFAULT_RATE` if not set
+        parquet (bool): Also write typed Parquet output (needs pyarrow)
+        backend (str, optional): 'html' (rendered pages) or 'api' (estate JSON API, smaller
+            responses and more listings per search request); html by default
+        cache (bool): Keep response bodies in `listings url/cache.sqlite3` and reuse them
+        cache_ttl (float, optional): Hours a cached response is reused for, forever by default
+        cache_max_mb (int, optional): Evict least recently used responses above this size
+        replay (bool): Run from the cache only, without any network traffic
+        reparse (bool): Crawl every known page and listing of the categories again, e.g. with
+            `replay` to re-run changed parsers on a finished crawl
+        metrics_port (int, optional): Serve Prometheus metrics on this port while crawling
+        metrics_json (str, optional): Append a JSON metrics summary to this file periodically
+        metrics_interval (float): Seconds between JSON summaries
+        images (bool): Also download every written listing's image, see `media`
+        history (bool): Log changes of price, note on price, date updated and agent per listing
+            in `listings url/history.sqlite3`, see `history`. A crawl only fetches listings it
+            has not scraped yet, so it logs their first values; changes come from
+            `incremental.py` runs or `reparse`. With `parquet`, also refresh the history's
+            Parquet snapshot at the end of the run
+        shard (bool): Split large searches by region, district and price so listings past the
+            site's deepest page are reached, see `sharding`; `pages` then applies per shard
+        page_limit (int): Deepest search page the site serves, the threshold for splitting
+        agents (bool): Write an `agent_id` instead of the agent columns and keep each agency,
+            with its profile page details, once in `listings url/agents.sqlite3`, exported to
+            `data/agents.csv`; see `agents`
+        agent_ttl (float, optional): Hours an agency's profile is kept before it's fetched again,
+            a week by default
+        time_budget (float, optional): Minutes after which no further pages or listings are
+            started; the run then finishes what's in flight, and the next run resumes the rest
+    """
+    asyncio.run(crawl_async(categories, **kwargs))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("categories", nargs="*", metavar="category",
+                        help=f"One or more of {', '.join(CATEGORIES)}, or 'all'")
+    parser.add_argument("--config", help="JSON file with default values for the options below")
+    parser.add_argument("--pages", type=int, default=1, help="Pages to scrape per size")
+    parser.add_argument("--sizes", nargs="+", help="Only these sizes / sub-categories, e.g. 2+kk lesy")
+    parser.add_argument("--passcode", type=int, help="Needed for more than 5 pages per size")
+    parser.add_argument("--fetch-workers", type=int, default=DEFAULT_CONCURRENCY, help="Requests in flight")
+    parser.add_argument("--parse-workers", type=int, help="Parser processes (default: one per CPU)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Fetched pages that may wait for a parser")
+    parser.add_argument("--rate", type=float, help=f"Starting requests per second (default: {DEFAULT_RATE})")
+    parser.add_argument("--parquet", action="store_true", help="Also write typed Parquet output (needs pyarrow)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help="Read rendered HTML pages or the estate JSON API")
+    parser.add_argument("--cache", action="store_true", help="Cache response bodies and reuse cached ones")
+    parser.add_argument("--cache-ttl", type=float, help="Hours a cached response is reused for (default: forever)")
+    parser.add_argument("--cache-max-mb", type=int, help="Evict least recently used responses above this size")
+    parser.add_argument("--replay", action="store_true", help="Serve every request from the cache, offline")
+    parser.add_argument("--reparse", action="store_true",
+                        help="Crawl all known pages and listings again, e.g. with --replay after a parser change")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port at /metrics")
+    parser.add_argument("--metrics-json", help="Append a JSON metrics summary to this file periodically")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="Seconds between JSON summaries")
+    parser.add_argument("--images", action="store_true",
+                        help="Also download listing images and thumbnails into data/images")
+    parser.add_argument("--history", action="store_true",
+                        help="Record price and field changes per listing, see history.py. A crawl only fetches "
+                             "listings it has not scraped yet, so price series fill from incremental.py runs "
+                             "or --reparse. With --parquet, also refresh the history snapshot in data/history")
+    parser.add_argument("--shard", action="store_true",
+                        help="Split searches by region, district and price to get past the pagination limit")
+    parser.add_argument("--page-limit", type=int, default=DEFAULT_PAGE_LIMIT,
+                        help="Deepest search page the site serves; deeper searches are split with --shard")
+    parser.add_argument("--agents", action="store_true",
+                        help="Normalize agents into data/agents.csv and fetch their profiles, see agents.py")
+    parser.add_argument("--agent-ttl", type=float, help="Hours an agent profile is kept (default: a week)")
+    parser.add_argument("--time-budget", type=float,
+                        help="Minutes to crawl for; the most valuable listings are fetched first")
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        with open(args.config, encoding='UTF-8') as file:
+            config = json.load(file)
+        unknown = set(config) - {action.dest for action in parser._actions}
+        if unknown:
+            parser.error(f"Unknown option(s) in {args.config}: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**config)
+        args = parser.parse_args(argv)
+
+    if not args.categories:
+        parser.error("at least one category is required, on the command line or in the config file")
+    invalid = [category for category in args.categories if category not in CATEGORIES + ["all"]]
+    if invalid:
+        parser.error(f"invalid category: {', '.join(invalid)} (choose from {', '.join(CATEGORIES)}, all)")
+    args.categories = CATEGORIES if "all" in args.categories else list(dict.fromkeys(args.categories))
+    return args
+
+
+def main(argv=None):
+    configure_logging()
+    args = parse_args(argv)
+    crawl(args.categories, pages=args.pages, sizes=args.sizes, passcode=args.passcode,
+          fetch_workers=args.fetch_workers, parse_workers=args.parse_workers, queue_size=args.queue_size,
+          rate=args.rate, parquet=args.parquet, backend=args.backend, cache=args.cache, cache_ttl=args.cache_ttl,
+          cache_max_mb=args.cache_max_mb, replay=args.replay, reparse=args.reparse, metrics_port=args.metrics_port,
+          metrics_json=args.metrics_json, metrics_interval=args.metrics_interval, images=args.images,
+          history=args.history, shard=args.shard, page_limit=args.page_limit, agents=args.agents,
+          agent_ttl=args.agent_ttl, time_budget=args.time_budget)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Bounded-memory set of URLs, stored as 64-bit fingerprints in a fixed-size memory-mapped
+hash table.
+
+Each URL costs 8 bytes however long it is, and the table never grows past the size it was
+created with, so memory stays within a fixed budget however long the crawl history gets.
+Backed by a file, the set persists across runs and the operating system pages it in and out
+as needed; without one it lives in anonymous memory for the duration of a run.
+
+Two different URLs share a fingerprint with a probability of about n² / 2⁶⁵, i.e. one in a
+few hundred thousand for ten million URLs, in which case the second one is taken as already
+seen. Once the table is `MAX_LOAD` full, new URLs are no longer recorded and `add` reports
+every unknown URL as new, so callers must still tolerate the odd duplicate.
+"""
+import csv
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from pathlib import Path
+
+
+MAGIC = b"SRFPSET1"
+
+# Magic, then the number of stored fingerprints
+HEADER_SIZE = 16
+
+# Share of slots used before the table stops accepting fingerprints; linear probing slows
+# down quickly above this
+MAX_LOAD = 0.7
+
+# Persistent set of written listings: 8M slots, room for about 5.9M URLs
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+
+# In-run frontier of a category: 1M slots, room for about 730k URLs
+FRONTIER_MAX_BYTES = 8 * 2 ** 20
+
+
+def fingerprint(url):
+    """Non-zero 64-bit fingerprint of a URL; zero marks an empty slot."""
+    return int.from_bytes(hashlib.blake2b(url.encode("UTF-8"), digest_size=8).digest(), "little") or 1
+
+
+class FingerprintSet:
+    """
+    Set of URL fingerprints in an open-addressing hash table of `max_bytes` (rounded down to
+    a power of two slots) plus a small header. An existing file keeps the size it was created with.
+
+    Args:
+        path (str | Path, optional): Backing file, created sparse if missing; anonymous memory
+            if not given
+        max_bytes (int): Size of the table for a new set
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.lock = threading.Lock()
+        slots = 1 << max(10, (max_bytes // 8).bit_length() - 1)
+        size = HEADER_SIZE + slots * 8
+        if path is None:
+            self.mm = mmap.mmap(-1, size)
+            self.mm[:len(MAGIC)] = MAGIC
+        else:
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            if new:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w+b" if new else "r+b") as file:
+                if new:
+                    file.write(MAGIC)
+                    file.truncate(size)
+                else:
+                    size = os.fstat(file.fileno()).st_size
+                    if file.read(len(MAGIC)) != MAGIC or (size - HEADER_SIZE) & (size - HEADER_SIZE - 1):
+                        raise ValueError(f"{path} is not a fingerprint set")
+                self.mm = mmap.mmap(file.fileno(), size)
+        self.slots = (size - HEADER_SIZE) // 8
+        self.mask = self.slots - 1
+        self.capacity = int(self.slots * MAX_LOAD)
+        self.header = memoryview(self.mm)[len(MAGIC):HEADER_SIZE].cast("Q")
+        self.table = memoryview(self.mm)[HEADER_SIZE:].cast("Q")
+        self.full_logged = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.header[0]
+
+    def __contains__(self, url):
+        value = fingerprint(url)
+        with self.lock:
+            return self.table[self._slot(value)] == value
+
+    def _slot(self, value):
+        # Slot holding `value`, or the empty slot where it belongs
+        table, mask = self.table, self.mask
+        index = value & mask
+        while True:
+            current = table[index]
+            if current == value or current == 0:
+                return index
+            index = (index + 1) & mask
+
+    def add(self, url):
+        """
+        Record a URL.
+
+        Returns:
+            bool: False if it was already in the set
+        """
+        value = fingerprint(url)
+        with self.lock:
+            index = self._slot(value)
+            if self.table[index] == value:
+                return False
+            if self.header[0] >= self.capacity:
+                if not self.full_logged:
+                    logging.warning(f"Fingerprint set {self.path or '(in memory)'} is full at {self.header[0]} URLs, "
+                                    f"new URLs are no longer recorded")
+                    self.full_logged = True
+                return True
+            self.table[index] = value
+            self.header[0] += 1
+        return True
+
+    def flush(self):
+        """Write changed pages of a file-backed set to disk."""
+        with self.lock:
+            self.mm.flush()
+
+    def close(self):
+        with self.lock:
+            self.header.release()
+            self.table.release()
+            self.mm.close()
+
+    def stats(self):
+        return {"urls": len(self), "capacity": self.capacity, "size_mib": round(self.slots * 8 / 2 ** 20, 1)}
+
+
+def seed_from_csv(fingerprints, csv_path, column="listing_url"):
+    """
+    Add the values of one column of a CSV file, streamed row by row.
+
+    Returns:
+        int: Number of rows read
+    """
+    if not os.path.isfile(csv_path):
+        return 0
+    count = 0
+    with open(csv_path, newline='', encoding='UTF-8', errors='replace') as file:
+        rows = csv.reader(file)
+        header = next(rows, [])
+        if column not in header:
+            return 0
+        index = header.index(column)
+        for row in rows:
+            if len(row) > index and row[index]:
+                fingerprints.add(row[index])
+            count += 1
+    return count
+
+
+def open_seeded(path, csv_paths, rebuild=False, column="listing_url", max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Open a persistent set, building it first from the `column` of existing CSV files when it
+    doesn't exist yet (or `rebuild` is set). The build goes to a temporary file that is
+    renamed when complete, so an interrupted build is simply redone.
+    """
+    path = Path(path)
+    if rebuild or not path.exists():
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.unlink(missing_ok=True)
+        with FingerprintSet(temporary, max_bytes=max_bytes) as fingerprints:
+            rows = sum(seed_from_csv(fingerprints, csv_path, column) for csv_path in csv_paths)
+            fingerprints.flush()
+            logging.info(f"Fingerprint set {path.name}: Built from {rows} row(s), {len(fingerprints)} distinct URL(s)")
+        os.replace(temporary, path)
+    return FingerprintSet(path, max_bytes=max_bytes)
@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from bs4 import BeautifulSoup
+from bs4.filter import ElementFilter
+
+
+# Top-level tags `parse_listing` reads from a detail page, as tag name -> classes that mark them.
+# An empty set keeps every tag with that name.
+DETAIL_TARGETS = {
+    "h1": set(),
+    "img": {"css-emihra"},
+    "div": {"css-zbebq3", "css-11wv1wc"},
+    "dt": {"css-tm1g54"},
+    "dd": {"css-urnwfg"},
+    "li": {"css-yu7uzj"},
+    "a": {"css-ny03lw", "css-1vgywwe"},
+}
+
+
+class DetailFilter(ElementFilter):
+    """
+    Parse-time filter that only builds the subtrees `parse_listing` needs.
+
+    BeautifulSoup only consults the filter for tags outside an already kept subtree, so
+    everything under a kept tag (e.g. the footer's dt/dd pairs) is parsed as usual, while
+    scripts, styles, navigation and similar-listing cards are skipped before any Tag is made.
+    """
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        classes = DETAIL_TARGETS.get(name)
+        if classes is None:
+            return False
+        if not classes:
+            return True
+        return not classes.isdisjoint((attrs or {}).get("class", "").split())
+
+    def allow_string_creation(self, string):
+        return False
+
+
+class ClassIndex:
+    """
+    Tag/class index over a parsed page, built in a single pass over its elements.
+
+    Supports the subset of the BeautifulSoup API the listing helpers use - `find` and
+    `findAll` by tag name and `class_` - so it can be passed wherever they expect a soup.
+    A `class_` containing spaces matches the full class attribute exactly, as BeautifulSoup
+    does; a single class matches any tag carrying it.
+    """
+
+    def __init__(self, soup):
+        self.soup = soup
+        self.index = defaultdict(list)
+        for tag in soup.find_all(True):
+            classes = tag.get("class") or []
+            self.index[(tag.name, None)].append(tag)
+            if len(classes) > 1:
+                self.index[(tag.name, " ".join(classes))].append(tag)
+            for cls in classes:
+                self.index[(tag.name, cls)].append(tag)
+
+    def findAll(self, tag, class_=None):
+        return self.index.get((tag, class_), [])
+
+    find_all = findAll
+
+    def find(self, tag, class_=None):
+        matches = self.index.get((tag, class_))
+        return matches[0] if matches else None
+
+
+def parse_detail_page(html):
+    """
+    Parse a listing detail page, keeping only the subtrees the scraper reads.
+
+    Args:
+        html (str): Raw detail page HTML
+
+    Returns:
+        ClassIndex: Index over the kept elements, usable in place of a soup
+    """
+    return ClassIndex(BeautifulSoup(html, "html.parser", parse_only=DetailFilter()))
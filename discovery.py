@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+from backends import get_backend, parse_first_search_page
+from pipeline import Pipeline
+from utils import FREE_PAGE_LIMIT, PASSCODE, select_sizes
+
+
+async def iter_first_pages(pipeline, property_type, sizes, backend=None):
+    """
+    Fetch and parse the first page of every size concurrently, yielding results as they land.
+    `backend` names the extraction backend whose search pages are used, see `backends`.
+
+    Yields:
+        tuple: (size, first page URL, last page number, `parse_listing_urls` dict of page 1)
+    """
+    loop = asyncio.get_running_loop()
+    backend = get_backend(backend)
+    first_urls = {backend.page_url_generator(property_type, size)(1): size for size in sizes}
+    results = asyncio.Queue()
+
+    async def handle(page_url, html):
+        size = first_urls[page_url]
+        try:
+            last_page_no, data_dict = await loop.run_in_executor(pipeline.pool, parse_first_search_page, page_url,
+                                                                 html, property_type)
+        except Exception as e:
+            logging.error(f"Error checking pages for {property_type} - {size}: {e}")
+            return
+        await results.put((size, page_url, last_page_no, data_dict))
+
+    def on_failure(page_url, error):
+        logging.error(f"Error checking pages for {property_type} - {first_urls[page_url]}: {error}")
+
+    async def fetch_all():
+        try:
+            await pipeline.engine.run(list(first_urls), handle, on_failure=on_failure)
+        finally:
+            await results.put(None)
+
+    task = asyncio.create_task(fetch_all())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+    finally:
+        await task
+
+
+async def iter_page_urls(pipeline, property_type, pages_to_scrape, sizes=None, passcode=None, backend=None):
+    """
+    Lazily emit the search page URLs of a category while pagination discovery is running.
+
+    Each size's first page is fetched once, concurrently with the others. As soon as it
+    arrives, its page URLs are emitted: page 1 together with its already parsed listing URLs,
+    the remaining pages as plain URLs to fetch. Listing extraction can therefore start after
+    roughly one round trip instead of after a serial sweep over every size.
+
+    Unlike the interactive prompt, the passcode is checked against the requested page count
+    up front, since sizes are emitted before the overall maximum is known. `backend` names
+    the extraction backend whose search pages are crawled.
+
+    Yields:
+        tuple: (page URL, `parse_listing_urls` dict for page 1 of a size, otherwise None)
+    """
+    if pages_to_scrape < 1:
+        logging.error("Must scrape at least 1 page")
+        return
+    if pages_to_scrape > FREE_PAGE_LIMIT and passcode != PASSCODE:
+        logging.error("INVALID CODE")
+        return
+
+    async for size, first_url, last_page_no, data_dict in iter_first_pages(
+            pipeline, property_type, select_sizes(property_type, sizes), backend=backend):
+        actual_pages = min(pages_to_scrape, last_page_no)
+        logging.info(
+            f"{property_type.capitalize()} Listings: Scraping {actual_pages}/{last_page_no} page(s). Property specs: {size}")
+        yield first_url, data_dict
+        url_generator = get_backend(backend).page_url_generator(property_type, size)
+        for page_no in range(2, actual_pages + 1):
+            yield url_generator(page_no), None
+
+
+def discover_first_pages(property_type, sizes=None):
+    """
+    Blocking helper for the interactive flow: fetch every size's first page concurrently.
+
+    Returns:
+        dict: size -> (first page URL, last page number, `parse_listing_urls` dict of page 1)
+    """
+
+    async def collect():
+        async with Pipeline() as pipeline:
+            return {size: (page_url, last_page_no, data_dict)
+                    async for size, page_url, last_page_no, data_dict in
+                    iter_first_pages(pipeline, property_type, select_sizes(property_type, sizes))}
+
+    return asyncio.run(collect())
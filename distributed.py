@@ -0,0 +1,304 @@
+"""
+Distributed crawl: one coordinator and any number of workers, possibly on different nodes
+and IPs, sharing a leased work queue (see `workqueue`).
+
+The coordinator discovers each category's search pages, queues page and listing URLs, and
+is the only process that touches the state store and the output files. Workers lease URLs,
+fetch and parse them on their own pipeline and report the results (listing URLs of a search
+page, or a listing's row) back through the queue. A crashed worker's leases expire and are
+handed to another worker.
+
+A listing is never written twice: the queue accepts only the first completion of an item,
+and the coordinator skips rows of listings already written, which covers results delivered
+again after a coordinator restart. Results are acknowledged only once their rows are on disk.
+
+Usage:
+    python distributed.py coordinator byty domy --queue sqlite:////mnt/shared/queue.sqlite3 --pages 10
+    python distributed.py worker --queue sqlite:////mnt/shared/queue.sqlite3 --fetch-workers 100
+    python distributed.py worker --queue redis://queue-host:6379/0 --backend api
+
+Start the coordinator first; workers exit once it has marked the crawl finished.
+"""
+import argparse
+import asyncio
+import logging
+import threading
+from functools import partial
+
+from backends import BACKENDS, DEFAULT_BACKEND, get_backend, parse_search_page
+from dedup import FRONTIER_MAX_BYTES, FingerprintSet
+from discovery import iter_page_urls
+from fetcher import DEFAULT_CONCURRENCY
+from parquet_output import optional_parquet_sink
+from pipeline import DEFAULT_QUEUE_SIZE, Pipeline
+from ratelimit import DEFAULT_RATE, AdaptiveLimiter
+from state import DONE, FAILED, StateStore
+from utils import PROPERTY_SIZES, configure_logging, open_written_set, output_dir, save_listing, state_db_path
+from workqueue import DEFAULT_VISIBILITY_TIMEOUT, LISTING, PAGE, default_worker_id, open_queue
+from writer import BatchWriter
+
+
+CATEGORIES = list(PROPERTY_SIZES)
+
+# URLs leased per request; small, so leases don't run down while waiting for a fetch worker
+DEFAULT_LEASE_BATCH = 20
+
+# Seconds between polls of an empty queue
+POLL_INTERVAL = 1.0
+
+# Results the coordinator reads per poll
+RESULT_BATCH = 500
+
+
+async def coordinate_async(work_queue, categories, pages=1, sizes=None, passcode=None, backend=None,
+                           discovery_workers=10, parquet=False):
+    """
+    Run the coordinator until every queued page and listing has been completed or has failed.
+
+    Args:
+        work_queue: Queue shared with the workers, see `workqueue.open_queue`
+        categories (list): Property types to crawl
+        pages (int): Pages per size
+        sizes (list, optional): Only these sizes, applied to every category that has them
+        passcode (int, optional): Required above the free page limit
+        backend (str, optional): Backend whose search pages are queued, see `backends`
+        discovery_workers (int): Requests in flight while fetching each size's first page
+        parquet (bool): Also write typed Parquet output (needs pyarrow)
+    """
+    await asyncio.to_thread(work_queue.set_finished, False)
+    parquet_sink = optional_parquet_sink(output_dir / "parquet") if parquet else None
+    # Listing URL -> result id, acknowledged once the row is on disk
+    unacknowledged = {}
+    lock = threading.Lock()
+    queued = FingerprintSet(max_bytes=FRONTIER_MAX_BYTES)
+    written = open_written_set()
+    saved = 0
+
+    with StateStore(state_db_path) as store:
+        def on_flush(file_path, rows):
+            store.mark_written(rows)
+            with lock:
+                result_ids = [unacknowledged.pop(row["listing_url"]) for row in rows
+                              if row["listing_url"] in unacknowledged]
+            work_queue.ack(result_ids)
+
+        def queue_listings(property_type, urls):
+            work_queue.put(LISTING, property_type, [url for url in urls if queued.add(url)])
+
+        def save_listing_urls(property_type, page_url, urls):
+            store.add_listings(property_type, page_url, urls)
+            store.mark_page(page_url, DONE)
+            queue_listings(property_type, store.unfinished_listings(urls))
+
+        def handle_results(results, save):
+            nonlocal saved
+            result_ids = []
+            for result_id, kind, url, property_type, result in results:
+                if kind == PAGE:
+                    if result is None:
+                        store.mark_page(url, FAILED)
+                    else:
+                        save_listing_urls(property_type, url, result)
+                elif result is None:
+                    store.mark_listing(url, FAILED)
+                elif url in written or not store.unfinished_listings([url]):
+                    logging.info(f"Property {property_type}: Skipped listing {url}, already written")
+                else:
+                    saved += 1
+                    with lock:
+                        unacknowledged[url] = result_id
+                    save(url, result, property_type)
+                    continue
+                result_ids.append(result_id)
+            work_queue.ack(result_ids)
+
+        async def discover(pipeline, property_type):
+            # Resume pending pages and listings of an earlier run, otherwise discover the pages
+            pending_page_urls = store.pending_pages(property_type)
+            work_queue.put(PAGE, property_type, pending_page_urls)
+            queue_listings(property_type, store.pending_listings(property_type))
+            logging.info(f"Property {property_type}: {len(pending_page_urls) or 'Discovering'} page(s) and "
+                         f"{len(queued)} pending listing(s) queued")
+            if pending_page_urls:
+                return
+            async for page_url, data_dict in iter_page_urls(pipeline, property_type, pages, sizes=sizes,
+                                                            passcode=passcode, backend=backend):
+                store.add_pages(property_type, [page_url])
+                if data_dict is not None:
+                    save_listing_urls(property_type, page_url, [url for url in data_dict["listing_url"] if url])
+                else:
+                    work_queue.put(PAGE, property_type, [page_url])
+
+        async def collect(discovery, save):
+            while True:
+                results = await asyncio.to_thread(work_queue.results, RESULT_BATCH)
+                if results:
+                    await asyncio.to_thread(handle_results, results, save)
+                    continue
+                # Completing an item stores its result in the same step, so once nothing is
+                # outstanding one more read sees every result
+                if discovery.done() and not await asyncio.to_thread(work_queue.outstanding):
+                    results = await asyncio.to_thread(work_queue.results, RESULT_BATCH)
+                    if not results:
+                        return
+                    await asyncio.to_thread(handle_results, results, save)
+                    continue
+                await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            with BatchWriter(on_flush=on_flush, dedup=written, parquet=parquet_sink) as writer:
+                save = partial(save_listing, writer=writer)
+                async with Pipeline(fetch_workers=discovery_workers) as pipeline:
+                    discovery = asyncio.ensure_future(asyncio.gather(
+                        *(discover(pipeline, property_type) for property_type in categories)))
+                    await collect(discovery, save)
+                    await discovery
+        finally:
+            queued.close()
+            written.close()
+            if parquet_sink is not None:
+                parquet_sink.close()
+    await asyncio.to_thread(work_queue.set_finished, True)
+    logging.info(f"Coordinator: Crawl finished, {saved} listing(s) written")
+
+
+async def work_async(work_queue, categories=None, backend=None, fetch_workers=DEFAULT_CONCURRENCY,
+                     parse_workers=None, queue_size=DEFAULT_QUEUE_SIZE, rate=None, lease_batch=DEFAULT_LEASE_BATCH,
+                     worker_id=None):
+    """
+    Run a worker until the coordinator marks the crawl finished and nothing is left to lease.
+
+    Args:
+        work_queue: Queue shared with the coordinator, see `workqueue.open_queue`
+        categories (list, optional): Only lease URLs of these categories, all by default
+        backend (str, optional): Backend used to fetch listings, see `backends`
+        fetch_workers (int): Requests in flight at once
+        parse_workers (int, optional): Parser processes, one per CPU by default
+        queue_size (int): Fetched pages that may wait for a parser
+        rate (float, optional): Starting requests per second of this node, `ratelimit.DEFAULT_RATE` if not set
+        lease_batch (int): URLs leased per request
+        worker_id (str, optional): Name of this worker in the queue, host and PID by default
+    """
+    worker_id = worker_id or default_worker_id()
+    extraction = get_backend(backend)
+    # Sized from fetch_workers: the process-wide default limiter caps requests in flight at 100
+    limiter = AdaptiveLimiter(rate=rate or DEFAULT_RATE, concurrency=fetch_workers)
+    # Leased URLs not completed or failed yet; no more are leased above the cap so leases
+    # don't expire while waiting in the fetch queue
+    held = set()
+    held_cap = fetch_workers + lease_batch
+    released = asyncio.Event()
+    completed = {PAGE: 0, LISTING: 0}
+
+    def release(kind, url):
+        held.discard((kind, url))
+        released.set()
+
+    async def leased(kind, property_type):
+        while True:
+            while len(held) >= held_cap:
+                released.clear()
+                await released.wait()
+            urls = await asyncio.to_thread(work_queue.lease, kind, property_type, worker_id, lease_batch)
+            if urls:
+                held.update((kind, url) for url in urls)
+                for url in urls:
+                    yield url
+            elif await asyncio.to_thread(work_queue.is_finished):
+                return
+            else:
+                await asyncio.sleep(POLL_INTERVAL)
+
+    def sink(kind, property_type):
+        async def complete(url, result):
+            try:
+                if kind == PAGE:
+                    result = [listing_url for listing_url in result["listing_url"] if listing_url]
+                if await asyncio.to_thread(work_queue.complete, kind, property_type, url, worker_id, result):
+                    completed[kind] += 1
+                else:
+                    logging.info(f"Property {property_type}: {url} was already completed after its lease expired")
+            finally:
+                release(kind, url)
+        return complete
+
+    def fail(kind, property_type):
+        def give_back(url, error):
+            if (kind, url) in held:
+                release(kind, url)
+                asyncio.get_running_loop().run_in_executor(None, work_queue.fail, kind, property_type, url,
+                                                           worker_id)
+        return give_back
+
+    async with Pipeline(fetch_workers=fetch_workers, parse_workers=parse_workers, queue_size=queue_size,
+                        limiter=limiter) as pipeline:
+        await asyncio.gather(*(
+            task
+            for property_type in categories or CATEGORIES
+            for task in (
+                pipeline.process(leased(PAGE, property_type), partial(parse_search_page, property_type=property_type),
+                                 sink(PAGE, property_type), on_failure=fail(PAGE, property_type)),
+                pipeline.process(leased(LISTING, property_type),
+                                 partial(extraction.parse_listing, property_type=property_type),
+                                 sink(LISTING, property_type), on_failure=fail(LISTING, property_type),
+                                 request_url=extraction.listing_request_url),
+            )))
+    logging.info(f"Worker {worker_id}: Finished, {completed[PAGE]} page(s) and {completed[LISTING]} listing(s) done")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    roles = parser.add_subparsers(dest="role", required=True)
+
+    coordinator = roles.add_parser("coordinator", help="Discover pages, queue work and write the output")
+    coordinator.add_argument("categories", nargs="+", metavar="category",
+                             help=f"One or more of {', '.join(CATEGORIES)}, or 'all'")
+    coordinator.add_argument("--pages", type=int, default=1, help="Pages to scrape per size")
+    coordinator.add_argument("--sizes", nargs="+", help="Only these sizes / sub-categories, e.g. 2+kk lesy")
+    coordinator.add_argument("--passcode", type=int, help="Needed for more than 5 pages per size")
+    coordinator.add_argument("--discovery-workers", type=int, default=10,
+                             help="Requests in flight while discovering pagination")
+    coordinator.add_argument("--parquet", action="store_true", help="Also write typed Parquet output (needs pyarrow)")
+
+    worker = roles.add_parser("worker", help="Fetch and parse leased URLs")
+    worker.add_argument("--categories", nargs="+", choices=CATEGORIES, help="Only work on these categories")
+    worker.add_argument("--fetch-workers", type=int, default=DEFAULT_CONCURRENCY, help="Requests in flight")
+    worker.add_argument("--parse-workers", type=int, help="Parser processes (default: one per CPU)")
+    worker.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Fetched pages that may wait for a parser")
+    worker.add_argument("--rate", type=float, help=f"Starting requests per second (default: {DEFAULT_RATE})")
+    worker.add_argument("--lease-batch", type=int, default=DEFAULT_LEASE_BATCH, help="URLs leased per request")
+    worker.add_argument("--worker-id", help="Name of this worker (default: host and PID)")
+
+    for role in (coordinator, worker):
+        role.add_argument("--queue", required=True,
+                          help="sqlite:///<path on shared storage> or redis://<host>:<port>/<db>")
+        role.add_argument("--visibility-timeout", type=float, default=DEFAULT_VISIBILITY_TIMEOUT,
+                          help="Seconds before a lease of an unresponsive worker is handed out again")
+        role.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                          help="Read rendered HTML pages or the estate JSON API")
+    return parser
+
+
+def main(argv=None):
+    configure_logging()
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    with open_queue(args.queue, visibility_timeout=args.visibility_timeout) as work_queue:
+        if args.role == "coordinator":
+            invalid = [category for category in args.categories if category not in CATEGORIES + ["all"]]
+            if invalid:
+                parser.error(f"invalid category: {', '.join(invalid)} (choose from {', '.join(CATEGORIES)}, all)")
+            categories = CATEGORIES if "all" in args.categories else list(dict.fromkeys(args.categories))
+            asyncio.run(coordinate_async(work_queue, categories, pages=args.pages, sizes=args.sizes,
+                                         passcode=args.passcode, backend=args.backend,
+                                         discovery_workers=args.discovery_workers, parquet=args.parquet))
+        else:
+            asyncio.run(work_async(work_queue, categories=args.categories, backend=args.backend,
+                                   fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                                   queue_size=args.queue_size, rate=args.rate, lease_batch=args.lease_batch,
+                                   worker_id=args.worker_id))
+
+
+if __name__ == "__main__":
+    main()
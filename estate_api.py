@@ -0,0 +1,243 @@
+"""
+Extraction backend for the site's estate JSON API.
+
+Search results come from `/api/cs/v2/estates` (up to `SEARCH_PAGE_SIZE` listings per
+request) and every listing from `/api/cs/v2/estates/<id>`. The documents are a fraction of
+the size of the rendered pages and are mapped onto the same `scraped_data` fields as
+`utils.parse_listing`, so output files don't depend on the backend. Listings keep their web
+URL as `listing_url`; only the URL that is fetched changes.
+"""
+import json
+import math
+import re
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+import utils
+from metrics import timed_step
+from utils import OUTPUT_FIELDS, format_price, parse_area, parse_construction, parse_location
+
+
+API_PATH = "/api/cs/v2/estates"
+
+# Listings per search request; the API caps it at 60
+SEARCH_PAGE_SIZE = 60
+
+# Search parameters (`category_main_cb`) of each property type
+CATEGORY_MAIN = {"byty": 1, "domy": 2, "pozemky": 3, "komercni": 4, "ostatni": 5}
+
+# Search parameters of the sizes in `utils.PROPERTY_SIZES`
+SIZE_PARAMS = {
+    "byty": {size: {"category_sub_cb": code} for size, code in (
+        ("1+kk", 2), ("1+1", 3), ("2+kk", 4), ("2+1", 5), ("3+kk", 6), ("3+1", 7), ("4+kk", 8), ("4+1", 9),
+        ("5+kk", 10), ("5+1", 11), ("6-a-vice", 12), ("atypicky", 16), ("pokoj", 47))},
+    "domy": {size: {"room_count_cb": code} for size, code in (
+        ("1-pokoj", 1), ("2-pokoje", 2), ("3-pokoje", 3), ("4-pokoje", 4), ("5-a-vice", 5), ("atypicky", 6))},
+    "pozemky": {size: {"category_sub_cb": code} for size, code in (
+        ("komercni-pozemky", 18), ("stavebni-parcely", 19), ("pole", 20), ("lesy", 21), ("louky", 22),
+        ("zahrady", 23), ("ostatni-pozemky", 24), ("rybniky", 46), ("sady-vinice", 48))},
+    "komercni": {size: {"category_sub_cb": code} for size, code in (
+        ("kancelare", 25), ("sklady", 26), ("vyrobni-prostory", 27), ("obchodni-prostory", 28), ("ubytovani", 29),
+        ("restaurace", 30), ("zemedelske-objekty", 31), ("ostatni-komercni-prostory", 32),
+        ("cinzovni-domy", 38), ("virtualni-kancelare", 49), ("ordinace", 56), ("apartmany", 57))},
+    "ostatni": {"ostatni": {}},
+}
+
+# Path segments of web detail URLs, by the codes in a search result's `seo` block
+TYPE_SLUGS = {1: "prodej", 2: "pronajem", 3: "drazby"}
+MAIN_SLUGS = {1: "byt", 2: "dum", 3: "pozemek", 4: "komercni", 5: "ostatni"}
+SUB_SLUGS = {
+    2: "1+kk", 3: "1+1", 4: "2+kk", 5: "2+1", 6: "3+kk", 7: "3+1", 8: "4+kk", 9: "4+1", 10: "5+kk", 11: "5+1",
+    12: "6-a-vice", 16: "atypicky", 47: "pokoj",
+    33: "chata", 35: "pamatka", 37: "rodinny", 39: "vila", 40: "na-klic", 43: "chalupa",
+    44: "zemedelska-usedlost", 54: "vicegeneracni",
+    18: "komercni", 19: "bydleni", 20: "pole", 21: "les", 22: "louka", 23: "zahrada", 24: "ostatni",
+    46: "rybnik", 48: "sady-vinice",
+    25: "kancelare", 26: "sklad", 27: "vyroba", 28: "obchodni-prostor", 29: "ubytovani", 30: "restaurace",
+    31: "zemedelsky", 32: "ostatni", 38: "cinzovni-dum", 49: "virtualni-kancelar", 56: "ordinace",
+    57: "apartman",
+    34: "garaz", 36: "ostatni", 50: "vinny-sklep", 51: "pudni-prostor", 52: "garazove-stani",
+    53: "mobilni-dum",
+}
+
+ESTATE_ID_PATTERN = re.compile(r"/(\d+)/?(?:[?#].*)?$")
+
+
+def is_api_url(url):
+    return API_PATH in url
+
+
+def estate_id(listing_url):
+    """The numeric estate ID at the end of a web detail URL."""
+    match = ESTATE_ID_PATTERN.search(listing_url)
+    if match is None:
+        raise ValueError(f"No estate ID in {listing_url}")
+    return match.group(1)
+
+
+def estate_url(listing_url):
+    """API URL holding the data of the listing at `listing_url`."""
+    return f"{utils.base_url}{API_PATH}/{estate_id(listing_url)}"
+
+
+def search_url_generator(property_type, size):
+    """
+    Like `utils.page_url_generator`, but for the search API. Unknown sizes raise ValueError.
+    """
+    if size not in SIZE_PARAMS.get(property_type, {}):
+        raise ValueError(f"Invalid size for {property_type}: {size}")
+    params = {"category_main_cb": CATEGORY_MAIN[property_type], "category_type_cb": 1,
+              **SIZE_PARAMS[property_type][size], "per_page": SEARCH_PAGE_SIZE}
+    search_url = f"{utils.base_url}{API_PATH}?{urlencode(params)}"
+    return lambda page: f"{search_url}&page={page}"
+
+
+def detail_url(estate):
+    """Web detail URL of a search result, the same URL the HTML search pages link to."""
+    seo = estate.get("seo", {})
+    sub = SUB_SLUGS.get(seo.get("category_sub_cb"), "ostatni")
+    return (f"{utils.base_url}/detail/{TYPE_SLUGS.get(seo.get('category_type_cb'), 'prodej')}/"
+            f"{MAIN_SLUGS.get(seo.get('category_main_cb'), 'ostatni')}/{sub}/{seo.get('locality', '')}/"
+            f"{estate['hash_id']}")
+
+
+def parse_search_page(page_url, body, property_type):
+    """
+    API counterpart of `utils.parse_listing_urls`: the same columns from a search response.
+    """
+    estates = json.loads(body).get("_embedded", {}).get("estates", [])
+    listing_urls = [detail_url(estate) for estate in estates if estate.get("hash_id")]
+    return {
+        "page_url": [page_url] * len(listing_urls),
+        "property_type": [property_type] * len(listing_urls),
+        "listing_url": listing_urls,
+    }
+
+
+def parse_first_search_page(page_url, body, property_type):
+    """
+    API counterpart of `utils.parse_first_page`.
+
+    Returns:
+        tuple: (last page number, `parse_search_page` dict)
+    """
+    document = json.loads(body)
+    per_page = document.get("per_page") or SEARCH_PAGE_SIZE
+    last_page_no = max(1, math.ceil(document.get("result_size", 0) / per_page))
+    return last_page_no, parse_search_page(page_url, body, property_type)
+
+
+def format_date(value):
+    """Turn '14.03.2025', 'Dnes' or 'Včera' into the 'D-M-YYYY' dates the HTML footer gives."""
+    if not value:
+        return None
+    if value == "Dnes":
+        day = date.today()
+    elif value == "Včera":
+        day = date.today() - timedelta(days=1)
+    else:
+        try:
+            day_no, month, year = (int(part) for part in value.strip(". ").split("."))
+        except ValueError:
+            return value
+        return f"{day_no}-{month}-{year}"
+    return f"{day.day}-{day.month}-{day.year}"
+
+
+def format_phone(phone):
+    number = phone.get("number", "")
+    grouped = " ".join(number[i:i + 3] for i in range(0, len(number), 3))
+    return f"+{phone['code']} {grouped}" if phone.get("code") else grouped
+
+
+def item_value(item):
+    value = item.get("value")
+    if isinstance(value, list):
+        return ", ".join(str(part.get("value", "")) for part in value)
+    return value
+
+
+def parse_estate(listing_url, body, property_type):
+    """
+    API counterpart of `utils.parse_listing_html`: one output row from an estate document.
+    Module level so it can run in a parser process.
+    """
+    estate = json.loads(body)
+    items = {item["name"]: item for item in estate.get("items", [])}
+
+    def value(*names):
+        for name in names:
+            if name in items:
+                return item_value(items[name])
+        return None
+
+    listing_title = estate.get("name", {}).get("value")
+    listing_location = estate.get("locality", {}).get("value")
+    price_raw = estate.get("price_czk", {}).get("value_raw")
+    price_text = value("Celková cena", "Cena")
+    construction = ", ".join(str(part) for part in (value("Stavba"), value("Stav objektu"), value("Podlaží"))
+                             if part) or None
+
+    # Areas are separate items here; rebuilt into the HTML wording `parse_area` understands
+    areas = ", ".join(f"{label} {area} m²" for label, area in (
+        ("Užitná plocha", value("Užitná plocha")),
+        ("Zastavěná plocha", value("Plocha zastavěná", "Zastavěná plocha")),
+        ("Celková plocha", value("Celková plocha", "Plocha pozemku"))) if area)
+    amenities = ", ".join(name for name, item in items.items() if item.get("type") == "boolean" and item.get("value"))
+
+    seller = estate.get("_embedded", {}).get("seller") or {}
+    premise = seller.get("_embedded", {}).get("premise") or {}
+    phones = seller.get("phones", []) or premise.get("phones", [])
+    agent_url = (f"{utils.base_url}/adresar/{premise['seo_name']}/{premise['id']}"
+                 if premise.get("seo_name") and premise.get("id") else None)
+    images = estate.get("_embedded", {}).get("images") or []
+    image_url = images[0].get("_links", {}).get("view", {}).get("href") if images else None
+
+    # Normalize the extracted values, timed as its own stage when run by the pipeline
+    with timed_step("normalize"):
+        street, city, district = parse_location(listing_location) if listing_location else (None, None, None)
+        price = str(price_raw) if price_raw else format_price(price_text)
+        construction_type, construction_status, floor_location = parse_construction(construction)
+        usable_area, built_up_area, total_area = parse_area(areas)
+        listing_date, listing_date_updated = format_date(value("Vloženo")), format_date(value("Aktualizace", "Upraveno"))
+        phones = [format_phone(phone) for phone in phones]
+
+    scraped_data = dict.fromkeys(OUTPUT_FIELDS)
+    scraped_data.update({
+        "dbq_prd_type": "REAL-ESTATE-BASIC",
+        "website_name": utils.base_url,
+        "competence_date": "DD-MM-YYYY",
+        "listing_title": listing_title,
+        "listing_description": estate.get("text", {}).get("value"),
+        "property_type": property_type,
+        "country_code": 203,
+        "location_description": value("Lokalita"),
+        "location_long": listing_location,
+        "location_city": city,
+        "location_region": district,
+        "location_street": street,
+        "area_unit": "SQMT",
+        "total_area": total_area,
+        "usable_area": usable_area,
+        "built_up_area": built_up_area,
+        "amenities_list": amenities or None,
+        "energy_intensity": value("Energetická náročnost budovy", "Energetická náročnost"),
+        "construction": construction,
+        "construction_type": construction_type,
+        "construction_status": construction_status,
+        "floor_location": floor_location,
+        "listing_date": listing_date,
+        "listing_date_updated": listing_date_updated,
+        "currency_code": "CZK",
+        "price": price,
+        "note_on_price": value("Poznámka k ceně"),
+        "agent_name": premise.get("name") or seller.get("user_name"),
+        "agent_url": agent_url,
+        "agent_website": premise.get("www"),
+        "agent_email": seller.get("email") or premise.get("email"),
+        "agent_phone1": phones[0] if phones else None,
+        "agent_phone2": phones[1] if len(phones) > 1 else None,
+        "image_url": image_url,
+        "listing_url": listing_url,
+    })
+    return scraped_data
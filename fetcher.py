@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from cache import CacheMiss
+from metrics import default_metrics, queue_depth, record_failure, record_status, trace_config
+from ratelimit import MAX_ATTEMPTS, RETRY_STATUSES, RetryableError, backoff_delay, default_limiter, parse_retry_after
+
+
+# Total sockets the pool may hold open, and how many of those may point at one host
+DEFAULT_CONCURRENCY = 100
+DEFAULT_PER_HOST = 50
+DEFAULT_TIMEOUT = 30
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) sreality-scraper"}
+
+
+class NotModified(Exception):
+    """Raised for a 304 answer to a conditional request; the cached copy is still current."""
+
+
+class FetchEngine:
+    """
+    Asyncio fetch engine backed by a single pooled aiohttp session.
+
+    Connections are kept alive and reused across pages and listings, so a run pays for the
+    TCP/TLS handshake once per socket instead of once per URL. Every request goes through an
+    `AdaptiveLimiter`, and 429/5xx or connection failures are put back on the queue with
+    jittered exponential backoff instead of being dropped.
+
+    Args:
+        concurrency (int): Maximum number of requests in flight at once
+        per_host (int): Maximum number of open connections to a single host
+        timeout (int): Total timeout in seconds for a single request
+        limiter (AdaptiveLimiter, optional): Rate limiter, the process-wide one by default
+        max_attempts (int): Attempts per URL before it is given up on
+        cache (ResponseCache, optional): Serve bodies from and store them in this cache
+        metrics (Metrics, optional): Where timings and counts are recorded, `default_metrics` by default
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST, timeout=DEFAULT_TIMEOUT,
+                 limiter=None, max_attempts=MAX_ATTEMPTS, cache=None, metrics=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.limiter = limiter or default_limiter
+        self.max_attempts = max_attempts
+        self.cache = cache
+        self.metrics = metrics or default_metrics
+        self.stage = self.metrics.stage()
+        self.session = None
+        self.untrack_in_flight = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                             trace_configs=[trace_config(self.metrics)])
+        self.untrack_in_flight = self.metrics.gauge("scraper_in_flight", "Requests in flight").track(
+            lambda: self.limiter.in_flight)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.untrack_in_flight()
+        await self.session.close()
+        self.session = None
+
+    async def fetch(self, url, params=None, headers=None, on_response=None):
+        """
+        Download a page and return its body as text.
+
+        Args:
+            url (str): URL to fetch
+            params (dict, optional): Query string parameters
+            headers (dict, optional): Extra request headers, e.g. `If-None-Match`
+            on_response (callable, optional): Called as `on_response(url, status, headers)` for
+                200 and 304 responses
+
+        Cached bodies are returned without a request (and without calling `on_response`).
+
+        Raises:
+            CacheMiss: When the cache is in replay mode and holds no body for the URL
+            NotModified: On a 304 answer to a conditional request
+            RetryableError: On connection errors, timeouts and statuses in `RETRY_STATUSES`
+            Exception: On any other non-200 status
+        """
+        loop = asyncio.get_running_loop()
+        if self.cache is not None:
+            html = await loop.run_in_executor(None, self.cache.get, url, params)
+            if html is not None:
+                return html
+            if self.cache.replay:
+                raise CacheMiss(f"{url} is not in the response cache")
+
+        start = time.perf_counter()
+        await self.limiter.acquire()
+        self.stage.observe(time.perf_counter() - start, "rate_limit_wait")
+        start = time.perf_counter()
+        try:
+            async with self.session.get(url, params=params, headers=headers) as r:
+                record_status(r.status, self.metrics)
+                if on_response is not None and r.status in (200, 304):
+                    on_response(url, r.status, r.headers)
+                if r.status == 304:
+                    self.limiter.record(r.status)
+                    raise NotModified(url)
+                if r.status == 200:
+                    with self.stage.time("download"):
+                        html = await r.text()
+                    self.stage.observe(time.perf_counter() - start, "fetch")
+                    self.limiter.record(r.status)
+                    if self.cache is not None:
+                        await loop.run_in_executor(None, self.cache.put, url, html, params)
+                    return html
+                if r.status in RETRY_STATUSES:
+                    retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                    self.limiter.record(r.status, error=True, retry_after=retry_after)
+                    raise RetryableError(f"Error {r.status} getting response for {url}", r.status, retry_after)
+                self.limiter.record(r.status)
+                raise Exception(f"Error {r.status} getting response for {url}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.limiter.record(error=True)
+            raise RetryableError(f"{type(e).__name__} getting response for {url}") from e
+        finally:
+            self.limiter.release()
+
+    async def run(self, urls, handler, progress=None, on_failure=None, request_headers=None, on_response=None,
+                  request_url=None):
+        """
+        Fetch every URL and hand the body to `handler(url, html)`.
+
+        `urls` may be a plain iterable or an async iterable; the latter is consumed while the
+        fetch is running, so URLs can be streamed in as they are discovered. It is read only as
+        workers free up, with at most `concurrency` URLs waiting, so a prioritized source such as
+        `scheduler.FreshnessFrontier` decides what is fetched next. A fixed number of worker
+        coroutines pull from a shared queue, so only `concurrency` requests are ever in flight
+        no matter how many URLs are given. Retryable failures are re-queued after their backoff
+        delay without holding a worker. Coroutine handlers are awaited directly; plain functions
+        run in the default thread executor to keep parsing off the event loop.
+
+        Args:
+            urls (iterable | async iterable): URLs to fetch
+            handler (callable): Called with the URL and its HTML once the download succeeds
+            progress (tqdm, optional): Progress bar updated once per finished URL
+            on_failure (callable, optional): Called as `on_failure(url, error)` for URLs that
+                could not be fetched or handled
+            request_headers (callable, optional): `request_headers(url)` returning extra headers
+                for that URL (or None); URLs answered with 304 are not passed to the handler
+            on_response (callable, optional): See `fetch`; called with the URL as given in `urls`
+            request_url (callable, optional): `request_url(url)` returning the URL to actually fetch
+                for that URL, e.g. an API document instead of the web page. Everything else,
+                including the handler, still receives the URL as given in `urls`
+        """
+        queue = asyncio.Queue()
+        streaming = hasattr(urls, "__aiter__")
+        # Streamed URLs read but not yet picked up by a worker
+        waiting = asyncio.Semaphore(self.concurrency)
+        if not streaming:
+            for url in urls:
+                queue.put_nowait((url, 1))
+
+        loop = asyncio.get_running_loop()
+        is_coroutine = asyncio.iscoroutinefunction(handler)
+
+        def requeue(item):
+            # Put the retry back before marking the failed attempt done, so join() can't finish early
+            queue.put_nowait(item)
+            queue.task_done()
+
+        async def worker():
+            while True:
+                url, attempt = await queue.get()
+                if streaming and attempt == 1:
+                    waiting.release()
+                try:
+                    headers = request_headers(url) if request_headers is not None else None
+                    respond = on_response
+                    if request_url is not None and on_response is not None:
+                        respond = lambda _, status, response_headers: on_response(url, status, response_headers)
+                    html = await self.fetch(request_url(url) if request_url is not None else url,
+                                            headers=headers, on_response=respond)
+                    if is_coroutine:
+                        await handler(url, html)
+                    else:
+                        await loop.run_in_executor(None, handler, url, html)
+                except NotModified:
+                    pass
+                except RetryableError as e:
+                    if attempt < self.max_attempts:
+                        self.limiter.record_retry()
+                        record_failure("fetch_retry", e, self.metrics)
+                        loop.call_later(backoff_delay(attempt, retry_after=e.retry_after), requeue, (url, attempt + 1))
+                        continue
+                    self.limiter.record_failure()
+                    record_failure("fetch", e, self.metrics)
+                    logging.error(f"Giving up on {url} after {attempt} attempts: {e}")
+                    if on_failure is not None:
+                        on_failure(url, e)
+                except Exception as e:
+                    record_failure("fetch", e, self.metrics)
+                    logging.error(f"Error fetching {url}: {e}")
+                    if on_failure is not None:
+                        on_failure(url, e)
+                if progress is not None:
+                    progress.update(1)
+                queue.task_done()
+
+        async def feed():
+            source = aiter(urls)
+            while True:
+                await waiting.acquire()
+                try:
+                    url = await anext(source)
+                except StopAsyncIteration:
+                    return
+                queue.put_nowait((url, 1))
+
+        worker_count = self.concurrency if streaming else min(self.concurrency, queue.qsize())
+        workers = [asyncio.create_task(worker()) for _ in range(worker_count)]
+        untrack = queue_depth(self.metrics).track(queue.qsize, "fetch")
+        try:
+            if streaming:
+                await feed()
+            await queue.join()
+        finally:
+            untrack()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        logging.info(f"Fetch stats: {self.limiter.stats()}")
+
+
+def fetch_and_process(urls, handler, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST, progress=None,
+                      limiter=None):
+    """
+    Blocking entry point: fetch all URLs on a fresh event loop and process each with `handler`.
+
+    Args:
+        urls (iterable): URLs to fetch
+        handler (callable): Called as `handler(url, html)` for every successful download
+        concurrency (int): Maximum number of requests in flight at once
+        per_host (int): Maximum number of open connections to a single host
+        progress (tqdm, optional): Progress bar updated once per finished URL
+        limiter (AdaptiveLimiter, optional): Rate limiter, the process-wide one by default
+    """
+
+    async def _run():
+        async with FetchEngine(concurrency=concurrency, per_host=per_host, limiter=limiter) as engine:
+            await engine.run(urls, handler, progress=progress)
+
+    asyncio.run(_run())
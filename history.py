@@ -0,0 +1,327 @@
+"""
+Per-listing change history: price series, time on market and recent price drops, without
+keeping full dumps of every run.
+
+Only field-level changes of the tracked fields (price, note on price, date updated, agent) are
+stored, in an append-only SQLite log keyed by listing ID, field and time, next to one row of
+current values per listing. A listing whose fields did not change costs nothing but an update
+of its `last_seen`. Queries are index range scans: the series of one listing is a contiguous
+slice of the log's primary key, and price drops have their own partial index, so both answer
+in milliseconds however many years the log covers.
+
+A listing is recorded each time a run fetches it. `cli.py` only fetches listings it has not
+scraped yet, so it records first values; the series grow with `incremental.py`, which re-checks
+a sample of known listings every run, or with `cli.py --reparse`.
+
+`compact` writes the whole history as a columnar Parquet snapshot (needs pyarrow) for analysis
+with pandas, replacing the previous snapshot. `cli.py --history --parquet` runs it at the end
+of every crawl; otherwise run it by hand.
+
+Usage:
+    python history.py series https://www.sreality.cz/detail/prodej/byt/2+kk/praha/3000000100
+    python history.py drops --days 7 --property-type byty
+    python history.py compact
+"""
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from dedup import fingerprint
+from parquet_output import to_int
+
+
+# Tracked output column -> column of current values in the `listings` table. The position is
+# the field's code in the change log, so new fields may only be appended.
+TRACKED_FIELDS = {
+    "price": "price",
+    "note_on_price": "note_on_price",
+    "listing_date_updated": "date_updated",
+    "agent_name": "agent",
+}
+FIELD_CODES = {field: code for code, field in enumerate(TRACKED_FIELDS)}
+PRICE = FIELD_CODES["price"]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS listings (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    property_type TEXT,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    removed_at INTEGER,
+    price INTEGER,
+    note_on_price TEXT,
+    date_updated TEXT,
+    agent TEXT
+);
+CREATE INDEX IF NOT EXISTS listings_url ON listings (url);
+
+-- Append-only: one row per changed field per observation. `value` has no declared type, so
+-- prices stay integers; `price_change` is the difference to the previous price.
+CREATE TABLE IF NOT EXISTS changes (
+    listing_id INTEGER NOT NULL,
+    field INTEGER NOT NULL,
+    observed_at INTEGER NOT NULL,
+    value,
+    price_change INTEGER,
+    PRIMARY KEY (listing_id, field, observed_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS price_drops ON changes (observed_at) WHERE field = {PRICE} AND price_change < 0;
+"""
+
+LISTING_ID_PATTERN = re.compile(r"/(\d+)/?$")
+
+
+def listing_id(url):
+    """
+    The listing's numeric ID, the last path segment of both the detail page and the estate API
+    URLs; a 63-bit fingerprint of the URL when it has none.
+    """
+    match = LISTING_ID_PATTERN.search(url.split("?")[0])
+    if match and int(match.group(1)) < 2 ** 63:
+        return int(match.group(1))
+    return fingerprint(url) >> 1
+
+
+def tracked_values(row):
+    values = []
+    for field in TRACKED_FIELDS:
+        value = row.get(field)
+        if field == "price":
+            value = to_int(value)
+        values.append(None if value in ("", None) else value)
+    return values
+
+
+class HistoryStore:
+    """
+    Change log and current values of every listing seen, in a SQLite database in WAL mode.
+    One connection is shared between threads and guarded by a lock, like `StateStore`.
+
+    Args:
+        db_path (str | Path): Location of the SQLite database file
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    # -- recording ----------------------------------------------------------------------------
+
+    def record(self, rows, observed_at=None):
+        """
+        Record scraped rows: log every tracked field that differs from the listing's current
+        value (all of them on its first observation) and refresh `last_seen`. Observations of
+        a listing are expected in the order they were scraped.
+
+        Returns:
+            int: Number of field changes logged
+        """
+        observed_at = int(observed_at if observed_at is not None else time.time())
+        logged = 0
+        columns = ", ".join(TRACKED_FIELDS.values())
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    url = row.get("listing_url")
+                    if not url:
+                        continue
+                    key = listing_id(url)
+                    values = tracked_values(row)
+                    current = self.conn.execute(f"SELECT {columns} FROM listings WHERE id = ?", (key,)).fetchone()
+                    if current is None:
+                        self.conn.execute(
+                            f"INSERT INTO listings (id, url, property_type, first_seen, last_seen, {columns}) "
+                            f"VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(values))})",
+                            (key, url, row.get("property_type"), observed_at, observed_at, *values))
+                        current = [None] * len(values)
+                    else:
+                        self.conn.execute(
+                            f"UPDATE listings SET last_seen = MAX(last_seen, ?), removed_at = NULL, "
+                            f"{', '.join(f'{column} = ?' for column in TRACKED_FIELDS.values())} WHERE id = ?",
+                            (observed_at, *values, key))
+                    changed = [(key, code, observed_at, new,
+                                new - old if code == PRICE and new is not None and old is not None else None)
+                               for code, (old, new) in enumerate(zip(current, values)) if old != new]
+                    self.conn.executemany("INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?)", changed)
+                    logged += len(changed)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return logged
+
+    def seen(self, urls, observed_at=None):
+        """Refresh `last_seen` of listings confirmed unchanged without a new row (e.g. HTTP 304)."""
+        observed_at = int(observed_at if observed_at is not None else time.time())
+        with self.lock:
+            self.conn.executemany("UPDATE listings SET last_seen = MAX(last_seen, ?) WHERE id = ?",
+                                  ((observed_at, listing_id(url)) for url in urls))
+
+    def mark_removed(self, urls, removed_at=None):
+        """Flag listings that are no longer on the site; recording them again clears the flag."""
+        removed_at = int(removed_at if removed_at is not None else time.time())
+        with self.lock:
+            self.conn.executemany("UPDATE listings SET removed_at = ? WHERE id = ? AND removed_at IS NULL",
+                                  ((removed_at, listing_id(url)) for url in urls))
+
+    # -- queries ------------------------------------------------------------------------------
+
+    def series(self, listing, field="price"):
+        """
+        Values a field of one listing took, oldest first.
+
+        Args:
+            listing (str | int): Listing URL or ID
+
+        Returns:
+            list: (observed_at, value) tuples, times in Unix seconds
+        """
+        key = listing if isinstance(listing, int) else listing_id(listing)
+        return self._execute("SELECT observed_at, value FROM changes WHERE listing_id = ? AND field = ? "
+                             "ORDER BY observed_at", (key, FIELD_CODES[field]))
+
+    def price_drops(self, days=7, property_type=None, now=None):
+        """
+        Price cuts observed in the last `days` days, newest first.
+
+        Returns:
+            list: (url, observed_at, old price, new price) tuples
+        """
+        since = int((now if now is not None else time.time()) - days * 86400)
+        sql = (f"SELECT l.url, c.observed_at, c.value - c.price_change, c.value FROM changes c "
+               f"JOIN listings l ON l.id = c.listing_id "
+               f"WHERE c.field = {PRICE} AND c.price_change < 0 AND c.observed_at >= ?")
+        params = [since]
+        if property_type:
+            sql += " AND l.property_type = ?"
+            params.append(property_type)
+        return self._execute(sql + " ORDER BY c.observed_at DESC", params)
+
+    def time_on_market(self, listing, now=None):
+        """
+        Seconds from the first observation of a listing to its removal, or to `now` while it is
+        still listed; None for an unknown listing.
+        """
+        key = listing if isinstance(listing, int) else listing_id(listing)
+        rows = self._execute("SELECT first_seen, removed_at FROM listings WHERE id = ?", (key,))
+        if not rows:
+            return None
+        first_seen, removed_at = rows[0]
+        return (removed_at if removed_at is not None else int(now if now is not None else time.time())) - first_seen
+
+    def stats(self):
+        listings, removed = self._execute("SELECT COUNT(*), COUNT(removed_at) FROM listings")[0]
+        changes = self._execute("SELECT COUNT(*) FROM changes")[0][0]
+        return {"listings": listings, "removed": removed, "changes": changes,
+                "size_mib": round(os.path.getsize(self.db_path) / 2 ** 20, 1)}
+
+    # -- snapshot -----------------------------------------------------------------------------
+
+    def compact(self, root):
+        """
+        Write the change log and the current values as Parquet files under `root`
+        (`changes.parquet`, sorted by listing, field and time, and `listings.parquet`). Each file
+        is written under a temporary name and renamed, so readers never see a partial snapshot.
+        Then checkpoint the WAL into the database file.
+
+        Returns:
+            dict: Rows written per file
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            changes = self.conn.execute("SELECT listing_id, field, observed_at, value, price_change FROM changes "
+                                        "ORDER BY listing_id, field, observed_at").fetchall()
+            listings = self.conn.execute("SELECT * FROM listings ORDER BY id").fetchall()
+            listing_columns = [column[1] for column in self.conn.execute("PRAGMA table_info(listings)")]
+        names = list(TRACKED_FIELDS)
+        tables = {
+            "changes": pa.table({
+                "listing_id": pa.array([row[0] for row in changes], pa.int64()),
+                "field": pa.array([names[row[1]] for row in changes], pa.string()).dictionary_encode(),
+                "observed_at": pa.array([row[2] * 1000 for row in changes], pa.timestamp("ms")),
+                "value": pa.array([None if row[3] is None else str(row[3]) for row in changes], pa.string()),
+                "price_change": pa.array([row[4] for row in changes], pa.int64()),
+            }),
+            "listings": pa.Table.from_pylist([dict(zip(listing_columns, row)) for row in listings]),
+        }
+        for name, table in tables.items():
+            path = root / f"{name}.parquet"
+            temporary = path.with_name(path.name + ".tmp")
+            pq.write_table(table, temporary, compression="zstd")
+            os.replace(temporary, path)
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logging.info(f"History snapshot: {len(changes)} change(s) of {len(listings)} listing(s) written to {root}")
+        return {name: table.num_rows for name, table in tables.items()}
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+def main(argv=None):
+    from utils import configure_logging, history_db_path, history_snapshot_dir
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    series = commands.add_parser("series", help="History of one field of a listing")
+    series.add_argument("listing", help="Listing URL or ID")
+    series.add_argument("--field", choices=list(TRACKED_FIELDS), default="price")
+    drops = commands.add_parser("drops", help="Listings whose price dropped recently")
+    drops.add_argument("--days", type=float, default=7)
+    drops.add_argument("--property-type")
+    compact = commands.add_parser("compact", help="Write the Parquet snapshot")
+    compact.add_argument("--output", default=history_snapshot_dir, help="Snapshot directory")
+    args = parser.parse_args(argv)
+
+    with HistoryStore(history_db_path) as history:
+        if args.command == "series":
+            listing = int(args.listing) if args.listing.isdigit() else args.listing
+            for observed_at, value in history.series(listing, args.field):
+                print(f"{format_time(observed_at)}  {value}")
+            on_market = history.time_on_market(listing)
+            if on_market is not None:
+                print(f"on the market for {on_market / 86400:.1f} day(s)")
+        elif args.command == "drops":
+            for url, observed_at, old, new in history.price_drops(args.days, property_type=args.property_type):
+                change = f" ({(new - old) / old:+.1%})" if old else ""
+                print(f"{format_time(observed_at)}  {old} -> {new}{change}  {url}")
+        else:
+            history.compact(args.output)
+        logging.info(f"History stats: {history.stats()}")
+
+
+if __name__ == "__main__":
+    main()
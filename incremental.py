@@ -0,0 +1,181 @@
+"""
+Incremental re-crawl: re-discover a category's listing URLs, fetch only new listings plus a
+bounded sample of known ones, and write a delta (added / updated / removed) instead of a
+full dump.
+
+Usage:
+    python incremental.py byty --sample 200
+    python incremental.py byty --pages 50 --passcode <code>
+    python incremental.py byty --backend api
+    python incremental.py byty --history
+"""
+import argparse
+import logging
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from datetime import date
+from functools import partial
+import time
+
+from backends import BACKENDS, DEFAULT_BACKEND, get_backend
+from history import HistoryStore
+from pipeline import run_pipeline
+from scheduler import order_by_freshness
+from state import DONE, FAILED, StateStore
+from utils import (FREE_PAGE_LIMIT, OUTPUT_FIELDS, configure_logging, history_db_path, listing_urls_scraper, output_dir,
+                   state_db_path)
+from writer import BatchWriter
+
+
+# Known listings re-checked per run, least recently fetched first
+DEFAULT_SAMPLE_SIZE = 200
+
+DELTA_FIELDS = ("change_type",) + OUTPUT_FIELDS
+
+
+def conditional_headers(etag, last_modified):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers or None
+
+
+def run_incremental(property_type, store, sample_size=DEFAULT_SAMPLE_SIZE, fetch_workers=30, parse_workers=None,
+                    backend=None, history=None, pages_to_scrape=FREE_PAGE_LIMIT, sizes=None, passcode=None):
+    """
+    Re-crawl a category incrementally.
+
+    Every search page is crawled again, which refreshes `last_seen` for listings still on the
+    site. Then only new (or previously failed) listings and `sample_size` known ones are
+    fetched; known ones are requested conditionally (ETag / Last-Modified) and counted as
+    updated only when `listing_date_updated` changed. Listings no longer on any search page are
+    reported as removed, but only when the crawl covers every size of the category to its last
+    page and all pages succeeded: listings of other sizes, past the crawled depth or on a
+    failed page would look removed otherwise.
+
+    Args:
+        property_type (str): Property category to crawl
+        store (StateStore): Crawl state from earlier runs
+        sample_size (int): Known listings to re-check
+        fetch_workers (int): Requests in flight at once
+        parse_workers (int, optional): Parser processes, one per CPU by default
+        backend (str, optional): Extraction backend used for the listings, see `backends`
+        history (HistoryStore, optional): Also log field changes of every fetched listing, and
+            removals, for price series and time on market
+        pages_to_scrape (int): Search pages per size
+        sizes (list, optional): Only these sizes of the category, all by default; removals are
+            not detected when the crawl is narrowed
+        passcode (int, optional): Required for more than `FREE_PAGE_LIMIT` pages
+
+    Returns:
+        Counter: Number of added, updated, unchanged and removed listings
+    """
+    run_started = time.time()
+    extraction = get_backend(backend)
+    store.reset_pages(property_type)
+    complete = listing_urls_scraper(property_type, store, fetch_workers=fetch_workers, parse_workers=parse_workers,
+                                    pages_to_scrape=pages_to_scrape, sizes=sizes, passcode=passcode)
+
+    new_urls = set(store.listings_first_seen_since(property_type, run_started))
+    # Listings that failed in earlier runs; those written before are compared like known ones
+    retried = [url for url in store.pending_listings(property_type) if url not in new_urls]
+    sampled = store.sample_listings(property_type, sample_size)
+    known = store.listing_details(retried + sampled)
+    added = new_urls | {url for url in retried if known[url][0] is None}
+    logging.info(f"Property {property_type}: {len(new_urls)} new listing(s), retrying {len(retried)} and "
+                 f"re-checking {len(sampled)} known")
+
+    delta_path = output_dir / f"{property_type}_delta_{date.today().isoformat()}.csv"
+    # Counted from the event loop (304 answers) and from sink threads
+    changes = Counter()
+    changes_lock = threading.Lock()
+
+    def count(change_type, amount=1):
+        with changes_lock:
+            changes[change_type] += amount
+
+    def request_headers(url):
+        details = known.get(url)
+        return conditional_headers(details[1], details[2]) if details else None
+
+    def on_response(url, status, headers):
+        if status == 304:
+            count("unchanged")
+            store.mark_listings([url], DONE)
+            if history is not None:
+                history.seen([url])
+        elif url in known:
+            store.set_validators(url, headers.get("ETag"), headers.get("Last-Modified"))
+
+    def save_change(url, row):
+        if history is not None:
+            history.record([row])
+        if url in added:
+            change_type = "added"
+        # Earlier runs stored a missing update date as "" instead of None
+        elif (known[url][0] or None) != row["listing_date_updated"]:
+            change_type = "updated"
+        else:
+            count("unchanged")
+            store.mark_written([row])
+            return
+        count(change_type)
+        writer.write(delta_path, dict(change_type=change_type, **row))
+
+    with BatchWriter(on_flush=lambda file_path, rows: store.mark_written(rows)) as writer:
+        run_pipeline(order_by_freshness(store, list(new_urls) + retried + sampled),
+                     partial(extraction.parse_listing, property_type=property_type),
+                     save_change,
+                     fetch_workers=fetch_workers, parse_workers=parse_workers,
+                     on_failure=lambda url, error: store.mark_listing(url, FAILED),
+                     request_headers=request_headers, on_response=on_response,
+                     request_url=extraction.listing_request_url)
+
+    if not complete:
+        logging.info(f"Property {property_type}: Crawled pages don't cover every size to its last page, "
+                     f"skipping removal detection")
+    elif store.count_incomplete_pages(property_type):
+        logging.warning(f"Property {property_type}: Some search pages failed, skipping removal detection")
+    else:
+        removed = store.mark_removed(property_type, run_started)
+        changes["removed"] = len(removed)
+        if history is not None:
+            history.mark_removed(removed)
+        with BatchWriter() as removed_writer:
+            for url in removed:
+                # Padded to the full column list so the delta file keeps one header
+                row = dict.fromkeys(DELTA_FIELDS, "")
+                row.update(change_type="removed", property_type=property_type, listing_url=url)
+                removed_writer.write(delta_path, row)
+
+    logging.info(f"Property {property_type}: Incremental run finished {dict(changes)} -> {delta_path}")
+    return changes
+
+
+def main():
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("property_type", choices=["byty", "domy", "pozemky", "komercni", "ostatni"])
+    parser.add_argument("--sample", type=int, default=DEFAULT_SAMPLE_SIZE, help="Known listings to re-check")
+    parser.add_argument("--pages", type=int, default=FREE_PAGE_LIMIT,
+                        help="Search pages per size; removals are only detected when every size's last page is reached")
+    parser.add_argument("--sizes", nargs="+",
+                        help="Only these sizes / sub-categories, e.g. 2+kk lesy; removals are then not detected")
+    parser.add_argument("--passcode", type=int, help=f"Needed for more than {FREE_PAGE_LIMIT} pages per size")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help="Read listings from rendered HTML pages or the estate JSON API")
+    parser.add_argument("--history", action="store_true",
+                        help="Record price and field changes per listing, see history.py")
+    args = parser.parse_args()
+
+    with StateStore(state_db_path) as store, \
+            (HistoryStore(history_db_path) if args.history else nullcontext()) as history:
+        run_incremental(args.property_type, store, sample_size=args.sample, backend=args.backend, history=history,
+                        pages_to_scrape=args.pages, sizes=args.sizes, passcode=args.passcode)
+
+
+if __name__ == "__main__":
+    main()
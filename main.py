@@ -1,67 +1,79 @@
-from concurrent.futures import ThreadPoolExecutor
-import pandas as pd
-import os
-from utils import logging, scrape_listings, listing_urls_scraper, input_dir, output_dir
+import argparse
+from functools import partial
+from utils import (logging, configure_logging, parse_listing_html, save_listing, listing_urls_scraper, state_db_path,
+                   output_dir, open_written_set)
+from parquet_output import optional_parquet_sink
+from pipeline import run_pipeline
+from scheduler import order_by_freshness
+from state import FAILED, StateStore
+from writer import BatchWriter
 
 
-print(
-    "=============================================\n"
-    "          🌟 S-REALITY SCRAPER 🌟\n"
-    "                by Anzywiz\n"
-    
-    "=============================================\n"
-    "Choose a listing category to scrape:\n"
-    "---------------------------------------------\n"
-    " 1️⃣  Apartment (Byty)\n"
-    " 2️⃣  Houses (Domy)\n"
-    " 3️⃣  Land (Pozemky)\n"
-    " 4️⃣  Commercial (Komercni)\n"
-    " 5️⃣  Others (Ostatni)\n"
-    "---------------------------------------------\n"
-)
+def main():
+    parser = argparse.ArgumentParser(description="Interactive scraper for one sreality.cz category")
+    parser.add_argument("--parquet", action="store_true", help="Also write typed Parquet output (needs pyarrow)")
+    args = parser.parse_args()
 
-try:
-    prompt = int(input("🔎 Enter the number corresponding to your category: "))
-    if prompt not in range(1, 6):
-        print("❌ Invalid choice! Please select a number between 1 and 5.")
-        exit()
-except ValueError:
-    print("❌ Invalid input! Please enter a number between 1 and 5.")
-    exit()
+    configure_logging()
+    print(
+        "=============================================\n"
+        "          🌟 S-REALITY SCRAPER 🌟\n"
+        "                by Anzywiz\n"
 
+        "=============================================\n"
+        "Choose a listing category to scrape:\n"
+        "---------------------------------------------\n"
+        " 1️⃣  Apartment (Byty)\n"
+        " 2️⃣  Houses (Domy)\n"
+        " 3️⃣  Land (Pozemky)\n"
+        " 4️⃣  Commercial (Komercni)\n"
+        " 5️⃣  Others (Ostatni)\n"
+        "---------------------------------------------\n"
+    )
 
-property_type_dict = {1: "byty", 2: "domy", 3: "pozemky", 4: "komercni", 5: "ostatni"}
-property_type = property_type_dict[prompt]
+    try:
+        prompt = int(input("🔎 Enter the number corresponding to your category: "))
+        if prompt not in range(1, 6):
+            print("❌ Invalid choice! Please select a number between 1 and 5.")
+            exit()
+    except ValueError:
+        print("❌ Invalid input! Please enter a number between 1 and 5.")
+        exit()
 
-print(f"✅ You selected category {prompt} ({property_type}). Starting the scraper...")
+    property_type_dict = {1: "byty", 2: "domy", 3: "pozemky", 4: "komercni", 5: "ostatni"}
+    property_type = property_type_dict[prompt]
 
-# scrape listings URL from all pages
-listing_urls_scraper(property_type)
+    print(f"✅ You selected category {prompt} ({property_type}). Starting the scraper...")
 
-df = pd.read_csv(input_dir/f"{property_type}_listing_urls.csv")
-total_listing_urls = df["listing_url"].dropna().to_list()
+    with StateStore(state_db_path) as store:
+        # scrape listings URL from all pages
+        listing_urls_scraper(property_type, store)
 
+        # listings not yet written (or failed in an earlier run), straight from the state store, newest first
+        remaining_listing_urls = order_by_freshness(store, store.pending_listings(property_type))
+        logging.info(f"{len(remaining_listing_urls)} listing url to go!")
 
-# check if data have ben scraped
-scraped_data_path = output_dir / f"{property_type}.csv"
-if os.path.isfile(scraped_data_path):
-    # logging.info(f"Scraped data FOUND in output directory")
+        def mark_written(file_path, rows):
+            store.mark_written(rows)
 
-    df = pd.read_csv(scraped_data_path, on_bad_lines='skip', encoding='UTF-8', encoding_errors="replace")
-    df.to_csv(scraped_data_path, index=False, encoding='UTF-8')
-    df = df.drop_duplicates().dropna(axis=0, how="all")
-    scraped_data = df["listing_url"].to_list()
-    remaining_page_urls = list(set(total_listing_urls) - set(scraped_data))
-else:
-    remaining_page_urls = total_listing_urls
+        # Typed Parquet copy of the output alongside the CSV, fed the rows the writer puts in the CSV
+        parquet = optional_parquet_sink(output_dir / "parquet") if args.parquet else None
 
-logging.info(f"{len(remaining_page_urls)} listing url to go!")
+        # Rows of listings already in the output are dropped instead of appended again
+        written = open_written_set()
 
-with ThreadPoolExecutor(max_workers=5) as executor:
-    futures = [executor.submit(scrape_listings, listing_url, property_type) for listing_url in remaining_page_urls]
-    for future in futures:
+        # Fetching and parsing run as separate stages: async downloads, parsing in a process pool
         try:
-            result = future.result()
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            continue
+            with BatchWriter(on_flush=mark_written, dedup=written, parquet=parquet) as writer:
+                run_pipeline(remaining_listing_urls,
+                             partial(parse_listing_html, property_type=property_type),
+                             partial(save_listing, property_type=property_type, writer=writer),
+                             on_failure=lambda listing_url, error: store.mark_listing(listing_url, FAILED))
+        finally:
+            written.close()
+            if parquet is not None:
+                parquet.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Optional media stage: download listing images into a content-addressed store, with
+thumbnails.
+
+Images are fetched on a connection pool and `AdaptiveLimiter` of their own, with a bounded
+number of downloads in flight, so they never take sockets or rate budget from the page and
+listing fetchers. Every image URL is fetched once: URLs already in the index are skipped,
+which is also how an interrupted run resumes. Identical bytes behind different URLs are
+stored once, as `<root>/<aa>/<bb>/<sha256><ext>`. Thumbnails are made in a process pool when
+Pillow is installed, queued behind the downloads so a download worker never waits for one.
+
+Usage:
+    python media.py byty domy --concurrency 16 --rate 5
+    python cli.py byty --images
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import logging
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import aiohttp
+
+from dedup import FRONTIER_MAX_BYTES, FingerprintSet
+from fetcher import HEADERS
+from metrics import default_metrics, record_failure, record_status
+from pipeline import default_parse_workers
+from ratelimit import MAX_ATTEMPTS, RETRY_STATUSES, AdaptiveLimiter, RetryableError, backoff_delay, parse_retry_after
+
+
+# Downloads in flight and starting requests per second; well below the page fetchers
+DEFAULT_CONCURRENCY = 16
+DEFAULT_RATE = 5.0
+
+# Longest side of a thumbnail in pixels
+DEFAULT_THUMBNAIL_SIZE = 320
+
+DEFAULT_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT,
+    thumbnail TEXT
+);
+"""
+
+
+def image_url_of(row):
+    """The image URL of an output row, None when the listing has none."""
+    url = row.get("image_url")
+    # Output written before missing images became empty holds "https:None"
+    if not url or url in ("https:None", "https:"):
+        return None
+    return url
+
+
+def make_thumbnail(source, destination, size):
+    """Write a JPEG thumbnail of an image. Runs in a worker process."""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        temporary = f"{destination}.tmp"
+        image.convert("RGB").save(temporary, "JPEG", quality=85)
+    os.replace(temporary, destination)
+    return destination
+
+
+class MediaStore:
+    """
+    Content-addressed image files plus a SQLite index of URL -> content hash.
+
+    Files are written to a temporary name and renamed into place, and a URL enters the index
+    only after its file exists, so an interrupted run never leaves a truncated image behind.
+
+    Args:
+        root (str | Path): Directory holding the files, the thumbnails and `index.sqlite3`
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        (self.root / "thumbnails").mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.root / "index.sqlite3"), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def has(self, url):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM images WHERE url = ?", (url,)).fetchone() is not None
+
+    def path_of(self, url):
+        """Local file of an image URL, None when it hasn't been downloaded."""
+        with self.lock:
+            row = self.conn.execute("SELECT path FROM blobs JOIN images USING (sha256) WHERE url = ?",
+                                    (url,)).fetchone()
+        return self.root / row[0] if row else None
+
+    def add(self, url, body, content_type=None):
+        """
+        Store a downloaded image under its content hash.
+
+        Returns:
+            tuple: (sha256, whether these bytes are new to the store)
+        """
+        sha256 = hashlib.sha256(body).hexdigest()
+        extension = mimetypes.guess_extension((content_type or "").split(";")[0].strip()) or ".jpg"
+        relative = Path(sha256[:2]) / sha256[2:4] / f"{sha256}{extension}"
+        with self.lock:
+            known = self.conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if known is None:
+            path = self.root / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Two URLs with the same bytes may arrive at once; each writes its own temporary file
+            temporary = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            temporary.write_bytes(body)
+            os.replace(temporary, path)
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("INSERT OR IGNORE INTO blobs (sha256, path, size, content_type) VALUES (?, ?, ?, ?)",
+                              (sha256, relative.as_posix(), len(body), content_type))
+            self.conn.execute("INSERT OR REPLACE INTO images (url, sha256, fetched_at) VALUES (?, ?, ?)",
+                              (url, sha256, time.time()))
+            self.conn.execute("COMMIT")
+        return sha256, known is None
+
+    def missing_thumbnails(self):
+        """(sha256, image path) of stored images without a thumbnail yet."""
+        with self.lock:
+            rows = self.conn.execute("SELECT sha256, path FROM blobs WHERE thumbnail IS NULL").fetchall()
+        return [(sha256, self.root / path) for sha256, path in rows]
+
+    def blob_path(self, sha256):
+        with self.lock:
+            row = self.conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return self.root / row[0]
+
+    def thumbnail_path(self, sha256):
+        return self.root / "thumbnails" / f"{sha256}.jpg"
+
+    def set_thumbnail(self, sha256, path):
+        with self.lock:
+            self.conn.execute("UPDATE blobs SET thumbnail = ? WHERE sha256 = ?",
+                              (Path(path).relative_to(self.root).as_posix(), sha256))
+
+    def stats(self):
+        with self.lock:
+            urls = self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            blobs, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"urls": urls, "files": blobs, "size_mib": round(size / 2 ** 20, 1)}
+
+
+class MediaDownloader:
+    """
+    Background image downloader: `submit` image URLs from anywhere (any thread), and they
+    are fetched by `concurrency` workers on the running event loop until `close`. New images
+    go on a queue of their own, drained into the thumbnail process pool by dispatchers of
+    their own, so downloads carry on while thumbnails are made.
+
+    Args:
+        root (str | Path): Media directory, see `MediaStore`
+        concurrency (int): Downloads in flight at once
+        rate (float): Starting image requests per second
+        thumbnail_size (int, optional): Longest side of thumbnails, None for no thumbnails
+        thumbnail_workers (int, optional): Thumbnail processes, one per CPU by default
+    """
+
+    def __init__(self, root, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE,
+                 thumbnail_size=DEFAULT_THUMBNAIL_SIZE, thumbnail_workers=None):
+        self.store = MediaStore(root)
+        self.concurrency = concurrency
+        self.limiter = AdaptiveLimiter(rate=rate, concurrency=concurrency, max_concurrency=concurrency)
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_workers = thumbnail_workers or default_parse_workers()
+        self.stage = default_metrics.stage()
+        self.downloaded = default_metrics.counter("scraper_images_total", "Images by outcome", ("outcome",))
+        self.submitted = FingerprintSet(max_bytes=FRONTIER_MAX_BYTES)
+        self.session = None
+        self.pool = None
+        self.queue = None
+        self.thumbnails = None
+        self.loop = None
+        self.workers = []
+        if thumbnail_size:
+            try:
+                import PIL  # noqa: F401 - thumbnails are optional
+            except ImportError:
+                logging.info("Pillow is not installed, downloading images without thumbnails")
+                self.thumbnail_size = None
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.thumbnails = asyncio.Queue()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                             timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT))
+        if self.thumbnail_size:
+            self.pool = ProcessPoolExecutor(max_workers=self.thumbnail_workers)
+            for sha256, path in await self.loop.run_in_executor(None, self.store.missing_thumbnails):
+                self.thumbnails.put_nowait(sha256)
+            # Two dispatchers per process so each has the next image ready when it finishes one
+            self.workers = [asyncio.create_task(self._thumbnail_worker()) for _ in range(self.thumbnail_workers * 2)]
+        self.workers += [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def submit(self, url):
+        """Queue an image URL; thread-safe, duplicates and already stored URLs are skipped."""
+        if url and self.submitted.add(url):
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, url)
+
+    def submit_rows(self, rows):
+        """Queue the image of every output row, e.g. as a `BatchWriter` `on_flush` hook."""
+        for row in rows:
+            self.submit(image_url_of(row))
+
+    async def join(self):
+        """Wait until everything submitted so far is downloaded and thumbnailed."""
+        # Let URLs handed over from other threads land in the queue first
+        await asyncio.sleep(0)
+        await self.queue.join()
+        # Every download is done, so every thumbnail it needs is queued
+        await self.thumbnails.join()
+
+    async def close(self):
+        await self.join()
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        await self.session.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+        logging.info(f"Media: {self.store.stats()}, requests {self.limiter.stats()}")
+        self.store.close()
+        self.submitted.close()
+
+    async def _worker(self):
+        while True:
+            url = await self.queue.get()
+            try:
+                await self._download(url)
+            except Exception as e:
+                record_failure("image", e)
+                self.downloaded.inc("failed")
+                logging.error(f"Error downloading image {url}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _thumbnail_worker(self):
+        while True:
+            sha256 = await self.thumbnails.get()
+            try:
+                await self._thumbnail(sha256)
+            except Exception as e:
+                record_failure("thumbnail", e)
+                logging.error(f"Error making thumbnail of {sha256}: {e}")
+            finally:
+                self.thumbnails.task_done()
+
+    async def _download(self, url):
+        if await self.loop.run_in_executor(None, self.store.has, url):
+            self.downloaded.inc("known")
+            return
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                body, content_type = await self._fetch(url)
+                break
+            except RetryableError as e:
+                if attempt == MAX_ATTEMPTS:
+                    self.limiter.record_failure()
+                    raise
+                self.limiter.record_retry()
+                await asyncio.sleep(backoff_delay(attempt, retry_after=e.retry_after))
+        sha256, new = await self.loop.run_in_executor(None, self.store.add, url, body, content_type)
+        self.downloaded.inc("downloaded" if new else "same_content")
+        if new and self.thumbnail_size:
+            self.thumbnails.put_nowait(sha256)
+
+    async def _fetch(self, url):
+        await self.limiter.acquire()
+        try:
+            with self.stage.time("image"):
+                async with self.session.get(url) as r:
+                    record_status(r.status)
+                    if r.status == 200:
+                        self.limiter.record(r.status)
+                        return await r.read(), r.headers.get("Content-Type")
+                    if r.status in RETRY_STATUSES:
+                        retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                        self.limiter.record(r.status, error=True, retry_after=retry_after)
+                        raise RetryableError(f"Error {r.status} getting image {url}", r.status, retry_after)
+                    self.limiter.record(r.status)
+                    raise Exception(f"Error {r.status} getting image {url}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.limiter.record(error=True)
+            raise RetryableError(f"{type(e).__name__} getting image {url}") from e
+        finally:
+            self.limiter.release()
+
+    async def _thumbnail(self, sha256):
+        source = await self.loop.run_in_executor(None, self.store.blob_path, sha256)
+        destination = self.store.thumbnail_path(sha256)
+        with self.stage.time("thumbnail"):
+            await self.loop.run_in_executor(self.pool, make_thumbnail, str(source), str(destination),
+                                            self.thumbnail_size)
+        await self.loop.run_in_executor(None, self.store.set_thumbnail, sha256, destination)
+
+
+def iter_image_urls(csv_path):
+    """Image URLs of an output CSV, streamed row by row."""
+    if not os.path.isfile(csv_path):
+        return
+    with open(csv_path, newline='', encoding='UTF-8', errors='replace') as file:
+        for row in csv.DictReader(file):
+            url = image_url_of(row)
+            if url:
+                yield url
+
+
+async def download_images_async(csv_paths, root, **kwargs):
+    """Download the images of every row in the given output CSVs. See `MediaDownloader`."""
+    async with MediaDownloader(root, **kwargs) as downloader:
+        for csv_path in csv_paths:
+            for url in iter_image_urls(csv_path):
+                downloader.submit(url)
+                # Keep the queue short; submitted URLs are cheap but the CSV may be huge
+                while downloader.queue.qsize() > downloader.concurrency * 10:
+                    await asyncio.sleep(0.05)
+
+
+def main(argv=None):
+    from utils import PROPERTY_SIZES, configure_logging, media_dir, output_dir
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("categories", nargs="+", choices=list(PROPERTY_SIZES), metavar="category",
+                        help=f"One or more of {', '.join(PROPERTY_SIZES)}")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Downloads in flight")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Starting image requests per second")
+    parser.add_argument("--thumbnail-size", type=int, default=DEFAULT_THUMBNAIL_SIZE,
+                        help="Longest side of thumbnails in pixels, 0 for none")
+    parser.add_argument("--thumbnail-workers", type=int, help="Thumbnail processes, one per CPU by default")
+    args = parser.parse_args(argv)
+    asyncio.run(download_images_async([output_dir / f"{category}.csv" for category in args.categories], media_dir,
+                                      concurrency=args.concurrency, rate=args.rate,
+                                      thumbnail_size=args.thumbnail_size or None,
+                                      thumbnail_workers=args.thumbnail_workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Lightweight, always-on instrumentation: histograms, counters and gauges kept in memory and
+exported as Prometheus text or as a JSON summary.
+
+Recording is a dictionary lookup, a bisect and a lock per observation, so it stays on in
+production. Components record into `default_metrics` (like `ratelimit.default_limiter`);
+nothing is sent anywhere until `start_http_server` or `JsonReporter` is used.
+"""
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds in seconds: 0.5 ms doubling up to about 65 s
+DEFAULT_BUCKETS = tuple(0.0005 * 2 ** i for i in range(18))
+
+# Histogram of every pipeline stage, labelled with the stage name
+STAGE_SECONDS = "scraper_stage_seconds"
+
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Bucketed distribution of observed values, one series per combination of label values."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def quantile(self, q, *label_values):
+        """Estimate of the `q` quantile, interpolated linearly within its bucket."""
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None or not series[2]:
+                return None
+            counts, count = list(series[0]), series[2]
+        rank, seen = q * count, 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else lower * 2
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            items = [(values, list(counts), total, count) for values, (counts, total, count) in self.series.items()]
+        for values, counts, total, count in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, values)} {total:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, values)} {count}")
+        return lines
+
+    def summary(self):
+        with self.lock:
+            items = sorted((values, total, count) for values, (_, total, count) in self.series.items())
+        result = {}
+        for values, total, count in items:
+            result[",".join(map(str, values)) or "all"] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000, 2) if count else None,
+                **{f"p{int(q * 100)}_ms": round(self.quantile(q, *values) * 1000, 2) for q in (0.5, 0.95, 0.99)},
+            }
+        return result
+
+
+class Counter:
+    """Monotonic count, one series per combination of label values."""
+
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def prometheus(self):
+        with self.lock:
+            items = sorted(self.series.items())
+        return [f"{self.name}{_label_text(self.labels, values)} {count}" for values, count in items]
+
+    def summary(self):
+        with self.lock:
+            return {",".join(map(str, values)) or "all": count for values, count in sorted(self.series.items())}
+
+
+class Gauge:
+    """
+    Current value, read from callbacks when exported. Several callbacks may be tracked under
+    the same label values (e.g. one queue per concurrent `Pipeline.process`); they are summed.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.functions = {}
+        self.lock = threading.Lock()
+
+    def track(self, function, *label_values):
+        """Report `function()` under the label values until the returned `untrack` is called."""
+        with self.lock:
+            self.functions.setdefault(label_values, []).append(function)
+
+        def untrack():
+            with self.lock:
+                self.functions[label_values].remove(function)
+
+        return untrack
+
+    def values(self):
+        with self.lock:
+            items = [(values, list(functions)) for values, functions in self.functions.items()]
+        return {values: sum(function() for function in functions) for values, functions in sorted(items)}
+
+    def prometheus(self):
+        return [f"{self.name}{_label_text(self.labels, values)} {value}" for values, value in self.values().items()]
+
+    def summary(self):
+        return {",".join(map(str, values)) or "all": value for values, value in self.values().items()}
+
+
+class Metrics:
+    """Registry of every metric of the process, with the Prometheus and JSON exports."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def _get(self, metric_class, name, help_text, labels, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, help_text, labels, **kwargs)
+            return self.metrics[name]
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._get(Gauge, name, help_text, labels)
+
+    def stage(self):
+        """The per-stage latency histogram: fetch sub-stages, parse, normalize, sink and write."""
+        return self.histogram(STAGE_SECONDS, "Seconds spent per pipeline stage", ("stage",))
+
+    def prometheus(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {"uptime_s": round(time.time() - self.started, 1),
+                **{metric.name: metric.summary() for metric in metrics}}
+
+
+default_metrics = Metrics()
+
+
+def record_status(status, registry=None):
+    """Count an HTTP response by status code."""
+    (registry or default_metrics).counter("scraper_http_responses_total", "HTTP responses by status code",
+                                          ("status",)).inc(status)
+
+
+def queue_depth(registry=None):
+    """Gauge of items waiting in each queue (fetch, parse, writer)."""
+    return (registry or default_metrics).gauge("scraper_queue_depth", "Items waiting per queue", ("queue",))
+
+
+def record_failure(stage, error, registry=None):
+    """Count a failure by stage and exception type."""
+    (registry or default_metrics).counter("scraper_failures_total", "Failures by stage and exception type",
+                                          ("stage", "exception")).inc(stage, type(error).__name__)
+
+
+# (stage, seconds) of the `timed_step` blocks run under `collect_steps`
+_collected_steps = contextvars.ContextVar("collected_steps", default=None)
+
+
+@contextmanager
+def timed_step(name, registry=None):
+    """
+    Time a step of a parse function, e.g. normalization, as its own stage. Parse functions run
+    in parser processes whose metrics are never exported, so under `collect_steps` the timing is
+    handed back to the caller instead, which is how `Pipeline` records it in the main process.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        steps = _collected_steps.get()
+        if steps is not None:
+            steps.append((name, seconds))
+        else:
+            (registry or default_metrics).stage().observe(seconds, name)
+
+
+def collect_steps(function, *args):
+    """
+    Call `function(*args)` and return its result together with the (stage, seconds) of the
+    `timed_step` blocks it ran. Module level so it can run in a parser process.
+    """
+    steps = []
+    token = _collected_steps.set(steps)
+    try:
+        return function(*args), steps
+    finally:
+        _collected_steps.reset(token)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.prometheus().encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="0.0.0.0", registry=None):
+    """
+    Serve the Prometheus text format on `http://<host>:<port>/metrics` from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Call `shutdown()` on it to stop serving
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry or default_metrics
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class JsonReporter:
+    """
+    Append a JSON summary of the registry to `path` (one object per line) every `interval`
+    seconds, and once more on `close()`. Without a path the summary is logged instead.
+    """
+
+    def __init__(self, path=None, interval=30.0, registry=None):
+        self.path = path
+        self.interval = interval
+        self.registry = registry or default_metrics
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="JsonReporter", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def report(self):
+        summary = json.dumps(self.registry.summary(), ensure_ascii=False)
+        if self.path is None:
+            logging.info(f"Metrics: {summary}")
+            return
+        with open(self.path, mode='a', encoding='UTF-8') as file:
+            file.write(summary + "\n")
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.report()
+            except Exception as e:
+                logging.error(f"Error reporting metrics: {e}")
+
+
+def trace_config(registry=None):
+    """
+    aiohttp `TraceConfig` recording connection pool wait, DNS, connect and time to first byte
+    into the stage histogram, for a `ClientSession(trace_configs=[...])`.
+    """
+    import aiohttp
+
+    stage = (registry or default_metrics).stage()
+
+    def mark(name):
+        async def handler(session, context, params):
+            setattr(context, name, time.perf_counter())
+        return handler
+
+    def observe(stage_name, start_name):
+        async def handler(session, context, params):
+            start = getattr(context, start_name, None)
+            if start is not None:
+                stage.observe(time.perf_counter() - start, stage_name)
+        return handler
+
+    config = aiohttp.TraceConfig()
+    config.on_connection_queued_start.append(mark("queued"))
+    config.on_connection_queued_end.append(observe("pool_wait", "queued"))
+    config.on_dns_resolvehost_start.append(mark("dns"))
+    config.on_dns_resolvehost_end.append(observe("dns", "dns"))
+    config.on_connection_create_start.append(mark("connect"))
+    config.on_connection_create_end.append(observe("connect", "connect"))
+    config.on_request_headers_sent.append(mark("sent"))
+    config.on_request_end.append(observe("ttfb", "sent"))
+    return config
@@ -0,0 +1,113 @@
+"""
+Column-wise versions of the field parsers in `utils`, for re-normalizing whole output files.
+
+Output files repeat the same prices, constructions and agents over and over, so each column is
+factorized and the parser runs once per distinct value; the results are spread back over the
+rows with one array lookup. Locations are mostly distinct, so deduplicating them saves little;
+they are split with string methods instead of the backtracking `LOCATION_PATTERN`, which is
+what makes the column faster than the loop. `Series.str.extract` is no help: on object columns
+it runs the same Python regex row by row. Areas have no column-wise version, since output files
+keep only the parsed numbers, and `utils.parse_area` is three short searches per row.
+
+Values are identical to the scalar versions (`benchmarks.bench_normalize` checks), with
+missing inputs giving None. The scrape path keeps calling the scalar versions one row at a
+time.
+"""
+import numpy as np
+import pandas as pd
+
+from utils import format_price, parse_construction, parse_location, split_agent_contacts
+
+
+def _on_distinct(parse, values, columns=None):
+    """
+    Run `parse` once per distinct non-missing value and spread the results back over the rows.
+    With `columns`, `parse` returns a tuple and a DataFrame with those columns is returned.
+    """
+    codes, uniques = pd.factorize(values)
+    parsed = [parse(value) for value in uniques]
+    if columns is not None:
+        parsed = list(zip(*parsed)) or [()] * len(columns)
+
+    def spread(results):
+        # The extra trailing None is what missing values (code -1) pick up
+        table = np.empty(len(results) + 1, dtype=object)
+        table[:-1] = results
+        table[-1] = None
+        return table[codes]
+
+    if columns is None:
+        return pd.Series(spread(parsed), index=values.index)
+    return pd.DataFrame({name: spread(results) for name, results in zip(columns, parsed)}, index=values.index)
+
+
+def _split_location(location):
+    """
+    `utils.parse_location` without the regex: the first "," or "-" ends the first part, and
+    after a comma the next "-" separates city and district. `LOCATION_PATTERN` does not match
+    across line breaks, so values with one go through it as before.
+    """
+    if "\n" in location:
+        return parse_location(location)
+    comma, dash = location.find(","), location.find("-")
+    if comma == dash == -1:
+        return None, location.strip() if location else None, None
+    if comma == -1 or -1 < dash < comma:
+        return None, location[:dash].strip() or None, location[dash + 1:].strip() or None
+    street = location[:comma].strip() if comma else None
+    city, dash, district = location[comma + 1:].partition("-")
+    city, district = city.strip() or None, dash and district.strip() or None
+    return (street, city, district) if city else (None, street, district)
+
+
+def parse_location_batch(locations):
+    """
+    `utils.parse_location` over a column.
+
+    Returns:
+        DataFrame: Columns street, city, district
+    """
+    return _on_distinct(_split_location, locations, ("street", "city", "district"))
+
+
+def format_price_batch(prices):
+    """`utils.format_price` over a column."""
+    return _on_distinct(format_price, prices)
+
+
+def parse_construction_batch(constructions):
+    """
+    `utils.parse_construction` over a column.
+
+    Returns:
+        DataFrame: Columns construction_type, construction_status, floor_location
+    """
+    return _on_distinct(parse_construction, constructions,
+                        ("construction_type", "construction_status", "floor_location"))
+
+
+def split_agent_contacts_batch(contacts):
+    """
+    `utils.split_agent_contacts` over a column holding each row's list of contact lines.
+
+    Returns:
+        DataFrame: Columns agent_email, agent_phone1, agent_phone2
+    """
+    return _on_distinct(split_agent_contacts, contacts.map(tuple, na_action="ignore"),
+                        ("agent_email", "agent_phone1", "agent_phone2"))
+
+
+def normalize_frame(frame):
+    """
+    Re-derive the parsed columns of an output file from the raw ones it keeps
+    (`location_long`, `construction`, `price`), e.g. after a parser fix. The frame should be
+    read with `dtype=str`. Returns a new frame.
+    """
+    frame = frame.copy()
+    location = parse_location_batch(frame["location_long"])
+    frame["location_street"], frame["location_city"], frame["location_region"] = (
+        location["street"], location["city"], location["district"])
+    frame[["construction_type", "construction_status", "floor_location"]] = parse_construction_batch(
+        frame["construction"])
+    frame["price"] = format_price_batch(frame["price"])
+    return frame
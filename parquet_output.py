@@ -0,0 +1,156 @@
+import csv
+import logging
+import threading
+import time
+from pathlib import Path
+
+from utils import to_date
+
+
+FIELD_DESCRIPTION_PATH = Path(__file__).parent / "field_description.csv"
+
+# Rows held per partition before they are written out as one row group
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+
+def load_field_types(path=FIELD_DESCRIPTION_PATH):
+    """
+    Read the output schema from `field_description.csv`.
+
+    Returns:
+        dict: Field name -> data type (string, int, date or category), in file order
+    """
+    with open(path, newline='', encoding='UTF-8') as file:
+        return {row["Field"]: row.get("Data Type") or "string" for row in csv.DictReader(file)}
+
+
+def to_int(value):
+    """Convert scraped numbers such as '7490000' or 54 to int; anything else becomes None."""
+    if value is None or value == "":
+        return None
+    try:
+        return int(str(value).replace(" ", ""))
+    except ValueError:
+        return None
+
+
+def to_string(value):
+    return None if value is None else str(value)
+
+
+CONVERTERS = {"int": to_int, "date": to_date, "category": to_string, "string": to_string}
+
+
+def arrow_schema(field_types):
+    import pyarrow as pa
+
+    arrow_types = {
+        "int": pa.int64(),
+        "date": pa.date32(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+        "string": pa.string(),
+    }
+    return pa.schema([(name, arrow_types[data_type]) for name, data_type in field_types.items()])
+
+
+class ParquetSink:
+    """
+    Streaming, typed Parquet output partitioned by property type.
+
+    Rows are converted to the schema in `field_description.csv` (ints for price and areas,
+    dates as dates, dictionary-encoded categoricals) and buffered per partition. Every
+    `row_group_size` rows the buffer is written out as one row group of a long-lived
+    `pq.ParquetWriter`, so memory stays bounded however large the crawl is. Files are laid
+    out as `<root>/property_type=<type>/part-<timestamp>.parquet`; `property_type` itself comes
+    from the directory name rather than being stored in every file.
+
+    Parquet files only become readable once their footer is written in `close()`; the CSV
+    output remains the crash-safe record.
+
+    Args:
+        root (str | Path): Directory the partitions are written under
+        row_group_size (int): Rows per row group, and the most rows buffered per partition
+        field_types (dict, optional): Schema override, read from `field_description.csv` by default
+    """
+
+    def __init__(self, root, row_group_size=DEFAULT_ROW_GROUP_SIZE, field_types=None):
+        import pyarrow  # noqa: F401 - fail early when the optional dependency is missing
+
+        self.root = Path(root)
+        self.row_group_size = row_group_size
+        self.field_types = {name: data_type for name, data_type in (field_types or load_field_types()).items()
+                            if name != "property_type"}
+        self.schema = arrow_schema(self.field_types)
+        self.buffers = {}
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row):
+        partition = row.get("property_type") or "unknown"
+        typed = {name: CONVERTERS[data_type](row.get(name)) for name, data_type in self.field_types.items()}
+        with self.lock:
+            buffer = self.buffers.setdefault(partition, [])
+            buffer.append(typed)
+            if len(buffer) >= self.row_group_size:
+                self._write_row_group(partition)
+
+    def close(self):
+        with self.lock:
+            for partition in list(self.buffers):
+                self._write_row_group(partition)
+            for writer in self.writers.values():
+                writer.close()
+            self.writers.clear()
+
+    def _write_row_group(self, partition):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = self.buffers.pop(partition, [])
+        if not rows:
+            return
+        if partition not in self.writers:
+            directory = self.root / f"property_type={partition}"
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"part-{time.strftime('%Y%m%d-%H%M%S')}.parquet"
+            self.writers[partition] = pq.ParquetWriter(path, self.schema, compression="zstd")
+            logging.info(f"Writing Parquet output to {path}")
+        self.writers[partition].write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+
+def optional_parquet_sink(root, **kwargs):
+    """
+    A `ParquetSink` when pyarrow is installed, otherwise None so callers fall back to CSV only.
+    """
+    try:
+        return ParquetSink(root, **kwargs)
+    except ImportError:
+        logging.info("pyarrow is not installed, writing CSV output only")
+        return None
+
+
+def load_parquet(root, property_type=None, columns=None):
+    """
+    Columnar read of the Parquet output as a pandas DataFrame, with the schema's types.
+
+    Args:
+        root (str | Path): Directory given to `ParquetSink`
+        property_type (str, optional): Only read this partition
+        columns (list, optional): Only read these columns
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.HivePartitioning.discover(infer_dictionary=True)
+    dataset = ds.dataset(root, format="parquet", partitioning=partitioning)
+    table_filter = ds.field("property_type") == property_type if property_type else None
+    table = dataset.to_table(columns=columns, filter=table_filter)
+    # Nullable ints stay ints and dates become datetime64 instead of float / object columns
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get, date_as_object=False)
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fetcher import DEFAULT_CONCURRENCY, DEFAULT_PER_HOST, FetchEngine
+from metrics import collect_steps, queue_depth, record_failure
+
+
+# Parsed pages waiting for a parser process; fetchers block once it is full
+DEFAULT_QUEUE_SIZE = 256
+
+
+def default_parse_workers():
+    return os.cpu_count() or 1
+
+
+class Pipeline:
+    """
+    Two-stage pipeline: async fetch workers push raw HTML into a bounded queue, and a
+    process pool turns it into rows, so parsing is no longer capped at one core by the GIL.
+
+    The bounded queue provides backpressure: when parsers fall behind, fetch workers wait on
+    `put` instead of buffering pages in memory. One `Pipeline` holds a single connection pool
+    and process pool, and `process` may be called concurrently (e.g. one call per category,
+    or discovery and listing scraping side by side) so all of them share the same workers.
+
+    Args:
+        fetch_workers (int): Requests in flight at once
+        parse_workers (int, optional): Parser processes, one per CPU by default
+        queue_size (int): Fetched pages that may wait for a parser
+        per_host (int): Maximum number of open connections to a single host
+        limiter (AdaptiveLimiter, optional): Rate limiter, the process-wide one by default
+        cache (ResponseCache, optional): Response cache, see `FetchEngine`
+    """
+
+    def __init__(self, fetch_workers=DEFAULT_CONCURRENCY, parse_workers=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 per_host=DEFAULT_PER_HOST, limiter=None, cache=None):
+        self.parse_workers = parse_workers or default_parse_workers()
+        self.queue_size = queue_size
+        self.engine = FetchEngine(concurrency=fetch_workers, per_host=per_host, limiter=limiter, cache=cache)
+        self.pool = None
+
+    async def __aenter__(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        await self.engine.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.engine.__aexit__(*exc)
+        self.pool.shutdown()
+
+    async def process(self, urls, parse, sink, progress=None, on_failure=None, request_headers=None,
+                      on_response=None, request_url=None):
+        """
+        Fetch `urls`, parse each page in the process pool and hand the rows to `sink`.
+
+        Args:
+            urls (iterable | async iterable): URLs to fetch
+            parse (callable): Picklable `parse(url, html)` run in a worker process, returns a row
+            sink (callable): `sink(url, row)` run in the main process for every parsed row;
+                coroutine functions are awaited, plain functions run in a thread
+            progress (tqdm, optional): Progress bar updated once per fetched URL
+            on_failure (callable, optional): `on_failure(url, error)` for URLs that could not be
+                fetched, parsed or written
+            request_headers (callable, optional): Per-URL extra headers, see `FetchEngine.run`
+            on_response (callable, optional): Response hook, see `FetchEngine.fetch`
+            request_url (callable, optional): Per-URL fetch target, see `FetchEngine.run`
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        sink_is_coroutine = asyncio.iscoroutinefunction(sink)
+        metrics = self.engine.metrics
+        stage = self.engine.stage
+
+        async def enqueue(url, html):
+            await queue.put((url, html))
+
+        async def parser():
+            while True:
+                url, html = await queue.get()
+                step = "parse"
+                try:
+                    # Wall time in the process pool, including waiting for a free parser, less
+                    # the steps the parser timed as stages of their own (normalize)
+                    start = time.perf_counter()
+                    row, steps = await loop.run_in_executor(self.pool, collect_steps, parse, url, html)
+                    step = "sink"
+                    middle = time.perf_counter()
+                    stage.observe(middle - start - sum(seconds for _, seconds in steps), "parse")
+                    for name, seconds in steps:
+                        stage.observe(seconds, name)
+                    if sink_is_coroutine:
+                        await sink(url, row)
+                    else:
+                        await loop.run_in_executor(None, sink, url, row)
+                    stage.observe(time.perf_counter() - middle, "sink")
+                except Exception as e:
+                    record_failure(step, e, metrics)
+                    logging.error(f"Error parsing {url}: {e}")
+                    if on_failure is not None:
+                        on_failure(url, e)
+                finally:
+                    queue.task_done()
+
+        # Two dispatchers per process so each has the next page ready when it finishes one
+        parsers = [asyncio.create_task(parser()) for _ in range(self.parse_workers * 2)]
+        untrack = queue_depth(metrics).track(queue.qsize, "parse")
+        try:
+            await self.engine.run(urls, enqueue, progress=progress, on_failure=on_failure,
+                                  request_headers=request_headers, on_response=on_response,
+                                  request_url=request_url)
+            await queue.join()
+        finally:
+            untrack()
+            for task in parsers:
+                task.cancel()
+            await asyncio.gather(*parsers, return_exceptions=True)
+
+
+async def run_pipeline_async(urls, parse, sink, fetch_workers=DEFAULT_CONCURRENCY, parse_workers=None,
+                             queue_size=DEFAULT_QUEUE_SIZE, per_host=DEFAULT_PER_HOST, limiter=None, cache=None,
+                             **kwargs):
+    """
+    Run a single `Pipeline.process` call on a pipeline of its own. Worker settings are the
+    `Pipeline` arguments, everything else is passed on to `process`.
+    """
+    async with Pipeline(fetch_workers=fetch_workers, parse_workers=parse_workers, queue_size=queue_size,
+                        per_host=per_host, limiter=limiter, cache=cache) as pipeline:
+        await pipeline.process(urls, parse, sink, **kwargs)
+
+
+def run_pipeline(urls, parse, sink, **kwargs):
+    """
+    Blocking wrapper around `run_pipeline_async`, see there for the arguments.
+    """
+    asyncio.run(run_pipeline_async(urls, parse, sink, **kwargs))
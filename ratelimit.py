@@ -0,0 +1,228 @@
+import asyncio
+import random
+import threading
+import time
+from collections import Counter, deque
+from email.utils import parsedate_to_datetime
+
+
+# Responses worth trying again; anything else (404, 410...) fails straight away
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Attempts per URL, first try included
+MAX_ATTEMPTS = 5
+
+
+class RetryableError(Exception):
+    """
+    Raised for responses that should go back on the retry queue.
+
+    Args:
+        message (str): Error message
+        status (int, optional): HTTP status code, None for connection errors
+        retry_after (float, optional): Seconds the server asked us to wait
+    """
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Convert a `Retry-After` header (delta seconds or HTTP date) to seconds, or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=0.5, cap=60.0, retry_after=None):
+    """
+    Jittered exponential backoff ("full jitter") for the given attempt number, starting at 1.
+
+    A server supplied `Retry-After` always wins over the computed delay.
+    """
+    if retry_after is not None:
+        return min(retry_after, cap)
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, shared by every fetch engine using the same limiter.
+
+    Callers reserve a token and are told how long to wait for it, so the lock is never held
+    while sleeping.
+
+    Args:
+        rate (float): Tokens added per second
+        capacity (float): Maximum burst size
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the number of seconds to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds`, e.g. after a 429 with `Retry-After`."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+# Starting requests per second when none is configured
+DEFAULT_RATE = 50
+
+
+class AdaptiveLimiter:
+    """
+    Central rate limiter for all HTTP traffic.
+
+    Combines a token bucket (requests per second) with a concurrency cap (requests in flight).
+    Every `window` completed requests the error rate is checked: above `high_water` both the
+    rate and the concurrency are halved, below `low_water` they are ramped back up towards
+    their maximums. `stats()` exposes the counters used for tuning.
+
+    Args:
+        rate (float): Starting requests per second
+        max_rate (float): Upper bound the rate ramps back up to
+        concurrency (int): Starting number of requests allowed in flight
+        min_concurrency (int): Lower bound when backing off
+        max_concurrency (int): Upper bound when ramping up
+        window (int): Completed requests between adjustments
+        high_water (float): Error rate that triggers a back-off
+        low_water (float): Error rate under which limits ramp up again
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=None, concurrency=100, min_concurrency=2, max_concurrency=None,
+                 window=50, high_water=0.1, low_water=0.02):
+        self.bucket = TokenBucket(rate)
+        self.min_rate = 1.0
+        self.max_rate = max_rate or rate
+        self.limit = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency or concurrency
+        self.window = window
+        self.high_water = high_water
+        self.low_water = low_water
+
+        self.in_flight = 0
+        self.waiters = deque()
+        self.window_total = 0
+        self.window_errors = 0
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    # -- async path ---------------------------------------------------------------------------
+
+    async def acquire(self):
+        """Wait for a free concurrency slot and a rate token."""
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wake-up this caller got but can no longer use
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                raise
+        self.in_flight += 1
+        wait = self.bucket.reserve()
+        if wait > 0:
+            with self.lock:
+                self.counters["throttled"] += 1
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Cancelled before the request started (time budget, teardown): the caller's
+                # `release` is never reached, so give the slot back here
+                self.release()
+                raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    def _wake_next(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    # -- feedback -----------------------------------------------------------------------------
+
+    def record(self, status=None, error=None, retry_after=None):
+        """
+        Feed the outcome of one request back into the limiter.
+
+        Args:
+            status (int, optional): HTTP status code, None if the request never got a response
+            error (bool): Whether the outcome counts towards the error rate
+            retry_after (float, optional): Server requested pause, applied to every caller
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters[f"status_{status}" if status else "connection_errors"] += 1
+            if error:
+                self.counters["errors"] += 1
+                self.window_errors += 1
+            self.window_total += 1
+            if retry_after:
+                self.bucket.pause(retry_after)
+            if self.window_total >= self.window:
+                self._adjust()
+
+    def record_retry(self):
+        with self.lock:
+            self.counters["retries"] += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.counters["gave_up"] += 1
+
+    def _adjust(self):
+        error_rate = self.window_errors / self.window_total
+        if error_rate > self.high_water:
+            self.limit = max(self.min_concurrency, self.limit // 2)
+            self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+            self.counters["backoffs"] += 1
+        elif error_rate < self.low_water:
+            self.limit = min(self.max_concurrency, self.limit + max(1, self.limit // 10))
+            self.bucket.rate = min(self.max_rate, self.bucket.rate * 1.25)
+        self.window_total = 0
+        self.window_errors = 0
+
+    def stats(self):
+        """Snapshot of the counters plus the current limits."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats.update(concurrency=self.limit, rate=round(self.bucket.rate, 2), in_flight=self.in_flight)
+            return stats
+
+
+# Shared by every fetch in the process unless a caller passes its own limiter
+default_limiter = AdaptiveLimiter()
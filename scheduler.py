@@ -0,0 +1,122 @@
+"""
+Freshness-priority scheduling of listing fetches, so the listings users care about most are
+scraped first and a run that is stopped early, or runs out of its time budget, has done them.
+
+Listings are ordered by:
+
+1. whether they were ever scraped: new listings first
+2. for new listings, their search page and position on it, since earlier pages hold the
+   listings added most recently
+3. for known ones (failed earlier, or handed out again by --reparse or a re-check), the
+   `listing_date_updated` seen last time, most recent first, since recently edited listings
+   are the ones still being edited
+
+The frontier feeds a fetch engine that only pulls a URL when a worker is free, so the order
+holds however many URLs are queued, and new listings discovered mid-crawl overtake the known
+ones that are still waiting.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+
+from utils import to_date
+
+
+PAGE_PATTERN = re.compile(r"[?&](?:strana|page)=(\d+)")
+
+NEW, KNOWN = 0, 1
+
+
+def page_number(page_url):
+    """Search page number of a page URL, 1 when it has none."""
+    match = PAGE_PATTERN.search(page_url or "")
+    return int(match.group(1)) if match else 1
+
+
+def freshness_priority(page_url, date_updated, order):
+    """
+    Sort key of a listing, smallest first.
+
+    Args:
+        page_url (str): Search page the listing was first found on
+        date_updated (str): `listing_date_updated` of its last scrape, None if never scraped
+        order (int): Position among the listings found so far, for ties on the same page
+    """
+    if not date_updated:
+        return NEW, page_number(page_url), order
+    updated = to_date(date_updated)
+    return KNOWN, -(updated.toordinal() if updated else 0), page_number(page_url), order
+
+
+def prioritize(store, urls):
+    """Pair every URL with its `freshness_priority` from the state store."""
+    details = store.scheduling_details(urls)
+    return [(freshness_priority(*details.get(url, (None, None, 0))), url) for url in urls]
+
+
+def order_by_freshness(store, urls):
+    """URLs sorted most valuable first, for callers that have the whole list up front."""
+    return [url for priority, url in sorted(prioritize(store, urls))]
+
+
+class FreshnessFrontier:
+    """
+    Priority queue of listing URLs, consumed as an async iterator by `Pipeline.process`.
+
+    Iteration waits for URLs while the frontier is open, ends once it is closed and empty,
+    and ends early at `deadline`, leaving the least valuable URLs for the next run.
+
+    Args:
+        deadline (float, optional): `time.monotonic()` value to stop handing out URLs at
+    """
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.heap = []
+        self.sequence = itertools.count()
+        self.closed = False
+        self.changed = asyncio.Event()
+        self.handed_out = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, url, priority):
+        heapq.heappush(self.heap, (priority, next(self.sequence), url))
+        self.changed.set()
+
+    def push_all(self, prioritized):
+        for priority, url in prioritized:
+            self.push(url, priority)
+
+    def close(self):
+        """No more URLs are coming; iteration ends once the frontier is empty."""
+        self.closed = True
+        self.changed.set()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self):
+        return None if self.deadline is None else max(self.deadline - time.monotonic(), 0)
+
+    async def __aiter__(self):
+        while True:
+            if self.expired():
+                if self.heap:
+                    logging.info(f"Time budget used up, leaving {len(self.heap)} listing(s) for the next run")
+                return
+            if self.heap:
+                self.handed_out += 1
+                yield heapq.heappop(self.heap)[2]
+            elif self.closed:
+                return
+            else:
+                self.changed.clear()
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=self.remaining())
+                except asyncio.TimeoutError:
+                    pass
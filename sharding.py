@@ -0,0 +1,284 @@
+"""
+Search sharding: split a category's searches by region, district and price until each one
+fits within the site's pagination limit, so that every listing is reachable.
+
+A search that reports `page_limit` pages or more may be cut off, and listings past its
+last page are never discovered. The planner fetches the first page of every size, splits
+the ones that hit the limit and probes the parts, recursively, all concurrently on the
+crawl's pipeline:
+
+1. by region (kraj)
+2. by district, where districts are known (Prague)
+3. by price band, then by halving the band
+
+As soon as a shard is known to fit, its pages are emitted, so the crawl of small shards
+runs while large ones are still being split. Regions and districts don't overlap and price
+bands are disjoint; a listing that still turns up in two shards is dropped by the crawl's
+frontier.
+
+Listings without a price ("Info o ceně u RK") drop out of price-filtered searches, and the
+site has no filter that selects them alone, so they are only reached in shards that fit
+without a price split. How many a price split loses is known exactly from the estate API,
+whose `result_size` for the unsplit search exceeds the sum over its price bands by that
+number; it is logged per split, and in total through `ShardProgress.unpriced`. Web search
+pages only give a page count, so with the `html` backend the loss is logged without a number.
+"""
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+from backends import get_backend, parse_first_search_page
+from estate_api import is_api_url
+from utils import FREE_PAGE_LIMIT, PASSCODE, select_sizes
+
+
+# Deepest search page the site serves; searches reporting this many pages or more are split
+DEFAULT_PAGE_LIMIT = 50
+
+# Regions as (web URL slug, `locality_region_id` of the estate API)
+REGIONS = {
+    "praha": 10, "stredocesky-kraj": 11, "jihocesky-kraj": 1, "plzensky-kraj": 2, "karlovarsky-kraj": 3,
+    "ustecky-kraj": 4, "liberecky-kraj": 5, "kralovehradecky-kraj": 6, "pardubicky-kraj": 7, "kraj-vysocina": 13,
+    "jihomoravsky-kraj": 14, "olomoucky-kraj": 8, "zlinsky-kraj": 9, "moravskoslezsky-kraj": 12,
+}
+
+# Districts of a region as (web URL slug, `locality_district_id`)
+DISTRICTS = {
+    "praha": {f"praha-{number}": 5000 + number for number in range(1, 11)},
+}
+
+# Initial price bands in CZK, split further by halving; the last band is open-ended
+PRICE_BOUNDS = (0, 1000000, 2000000, 3000000, 4000000, 5000000, 6000000, 8000000, 10000000, 15000000, 25000000)
+
+# Price bands narrower than this are not split any further, nor the open-ended band above this
+MIN_PRICE_BAND = 10000
+MAX_PRICE = 10 ** 10
+
+Shard = namedtuple("Shard", "size region district price_from price_to", defaults=(None, None, None, None))
+
+
+def describe(shard):
+    parts = [shard.size, shard.district or shard.region]
+    if shard.price_from is not None:
+        parts.append(f"{shard.price_from}-{shard.price_to if shard.price_to is not None else ''} CZK")
+    return " ".join(part for part in parts if part)
+
+
+def split(shard):
+    """
+    The next level of a shard's split, or an empty list when it can't be split any further.
+    Price bands are inclusive at both ends, so neighbouring bands don't overlap.
+    """
+    if shard.region is None:
+        return [shard._replace(region=region) for region in REGIONS]
+    if shard.district is None and shard.region in DISTRICTS:
+        return [shard._replace(district=district) for district in DISTRICTS[shard.region]]
+    if shard.price_from is None:
+        bounds = PRICE_BOUNDS + (None,)
+        return [shard._replace(price_from=low, price_to=None if high is None else high - 1)
+                for low, high in zip(bounds, bounds[1:])]
+    low, high = shard.price_from, shard.price_to
+    if high is None:
+        if low >= MAX_PRICE:
+            return []
+        middle = max(low * 2, MIN_PRICE_BAND)
+    elif high - low + 1 < 2 * MIN_PRICE_BAND:
+        return []
+    else:
+        middle = (low + high + 1) // 2 // 1000 * 1000
+    return [shard._replace(price_to=middle - 1), shard._replace(price_from=middle)]
+
+
+def shard_url_generator(property_type, shard, backend=None):
+    """
+    Like the backend's `page_url_generator`, restricted to the shard: the estate API takes
+    region, district and price as query parameters; web search URLs take the most specific
+    locality as an extra path segment and the price as `cena-od` / `cena-do`.
+    """
+    generate = get_backend(backend).page_url_generator(property_type, shard.size)
+
+    def page_url(page):
+        scheme, netloc, path, query, fragment = urlsplit(generate(page))
+        if is_api_url(path):
+            params = {"locality_region_id": REGIONS.get(shard.region),
+                      "locality_district_id": DISTRICTS.get(shard.region, {}).get(shard.district)}
+            if shard.price_from is not None:
+                params["czk_price_summary_order2"] = \
+                    f"{shard.price_from}|{shard.price_to if shard.price_to is not None else ''}"
+        else:
+            if shard.district or shard.region:
+                path = f"{path}/{shard.district or shard.region}"
+            params = {"cena-od": shard.price_from, "cena-do": shard.price_to}
+        extra = urlencode({name: value for name, value in params.items() if value is not None})
+        return urlunsplit((scheme, netloc, path, "&".join(filter(None, [query, extra])), fragment))
+
+    return page_url
+
+
+def probe_shard(page_url, body, property_type):
+    """
+    `parse_first_search_page` plus the number of listings the search reports, from the estate
+    API's `result_size`; None for web search pages. Runs in a parser process.
+
+    Returns:
+        tuple: (last page number, parsed dict, result size or None)
+    """
+    last_page_no, data_dict = parse_first_search_page(page_url, body, property_type)
+    result_size = json.loads(body).get("result_size") if is_api_url(page_url) else None
+    return last_page_no, data_dict, result_size
+
+
+class ShardProgress:
+    """
+    Pages done per shard of one category, logged as each shard completes. Fed by the crawl
+    with every search page it finishes or gives up on, and by the planner with the listings
+    without a price that its price splits put out of reach (`unpriced`, counted where the
+    backend reports result sizes).
+    """
+
+    def __init__(self, property_type):
+        self.property_type = property_type
+        self.shard_of = {}
+        self.remaining = {}
+        self.total = {}
+        self.complete = 0
+        self.unpriced = 0
+
+    def add(self, shard, page_urls):
+        label = describe(shard)
+        self.total[label] = self.remaining[label] = len(page_urls)
+        for page_url in page_urls:
+            self.shard_of[page_url] = label
+
+    def page_done(self, page_url):
+        label = self.shard_of.pop(page_url, None)
+        if label is None:
+            return
+        self.remaining[label] -= 1
+        if not self.remaining[label]:
+            self.complete += 1
+            logging.info(f"Property {self.property_type}: Shard {label} done, {self.total[label]} page(s) "
+                         f"({self.complete}/{len(self.total)} shard(s) planned so far)")
+
+    def summary(self):
+        return {label: f"{self.total[label] - remaining}/{self.total[label]}"
+                for label, remaining in self.remaining.items()}
+
+
+async def iter_shard_page_urls(pipeline, property_type, pages_to_scrape, sizes=None, passcode=None, backend=None,
+                               page_limit=DEFAULT_PAGE_LIMIT, progress=None):
+    """
+    Sharded counterpart of `discovery.iter_page_urls`: plan the shards of a category and
+    lazily emit the search page URLs of each one as soon as it is known to fit.
+    `pages_to_scrape` caps the pages crawled per shard.
+
+    Args:
+        progress (ShardProgress, optional): Told about the pages of every planned shard
+
+    Yields:
+        tuple: (page URL, parsed dict for page 1 of a shard, otherwise None)
+    """
+    if pages_to_scrape < 1:
+        logging.error("Must scrape at least 1 page")
+        return
+    if pages_to_scrape > FREE_PAGE_LIMIT and passcode != PASSCODE:
+        logging.error("INVALID CODE")
+        return
+
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    tasks = []
+
+    def probe(shards):
+        """Fetch and parse the first page of every shard in the background; returns how many."""
+        first_urls = {shard_url_generator(property_type, shard, backend)(1): shard for shard in shards}
+
+        async def handle(page_url, body):
+            try:
+                last_page_no, data_dict, result_size = await loop.run_in_executor(pipeline.pool, probe_shard,
+                                                                                  page_url, body, property_type)
+            except Exception as e:
+                on_failure(page_url, e)
+                return
+            await results.put((first_urls[page_url], page_url, last_page_no, data_dict, result_size))
+
+        def on_failure(page_url, error):
+            logging.error(f"Error checking pages for {property_type} - {describe(first_urls[page_url])}: {error}")
+            results.put_nowait((first_urls[page_url], page_url, None, None, None))
+
+        tasks.append(asyncio.create_task(pipeline.engine.run(list(first_urls), handle, on_failure=on_failure)))
+        return len(first_urls)
+
+    # Shards split into price bands -> listings they report, bands still to report and the
+    # listings the bands report so far (None once one of them is unknown)
+    price_splits = {}
+    band_parent = {}
+    unpriced = 0
+
+    def count_price_band(shard, result_size):
+        """Add a price band's result size to its split, and log what the split missed once all are in."""
+        nonlocal unpriced
+        parent = band_parent.pop(shard, None)
+        if parent is None:
+            return
+        counts = price_splits[parent]
+        counts["bands"] -= 1
+        if result_size is None or counts["covered"] is None:
+            counts["covered"] = None
+        else:
+            counts["covered"] += result_size
+        if counts["bands"]:
+            return
+        del price_splits[parent]
+        if counts["covered"] is None or counts["reported"] is None:
+            logging.warning(f"Property {property_type}: {describe(parent)} was split by price; its listings "
+                            f"without a price are not reached")
+            return
+        missed = counts["reported"] - counts["covered"]
+        if missed > 0:
+            unpriced += missed
+            if progress is not None:
+                progress.unpriced += missed
+            logging.warning(f"Property {property_type}: {describe(parent)} reports {counts['reported']} listing(s), "
+                            f"its price bands {counts['covered']}: {missed} without a price are not reached")
+
+    outstanding = probe([Shard(size) for size in select_sizes(property_type, sizes)])
+    planned = split_count = 0
+    try:
+        while outstanding:
+            shard, first_url, last_page_no, data_dict, result_size = await results.get()
+            outstanding -= 1
+            count_price_band(shard, result_size)
+            if last_page_no is None:
+                continue
+            if last_page_no >= page_limit:
+                children = split(shard)
+                if children:
+                    split_count += 1
+                    logging.info(f"Property {property_type}: {describe(shard)} has {last_page_no} page(s), "
+                                 f"splitting into {len(children)}")
+                    if shard.price_from is None and children[0].price_from is not None:
+                        price_splits[shard] = {"reported": result_size, "bands": len(children), "covered": 0}
+                        band_parent.update(dict.fromkeys(children, shard))
+                    outstanding += probe(children)
+                    continue
+                logging.warning(f"Property {property_type}: {describe(shard)} can't be split any further, "
+                                f"listings past page {last_page_no} are not reachable")
+
+            planned += 1
+            url_generator = shard_url_generator(property_type, shard, backend)
+            page_urls = [first_url] + [url_generator(page_no) for page_no in range(2, min(pages_to_scrape,
+                                                                                            last_page_no) + 1)]
+            logging.info(f"Property {property_type}: Shard {describe(shard)}: Scraping {len(page_urls)}/"
+                         f"{last_page_no} page(s)")
+            if progress is not None:
+                progress.add(shard, page_urls)
+            yield first_url, data_dict
+            for page_url in page_urls[1:]:
+                yield page_url, None
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    logging.info(f"Property {property_type}: Planned {planned} shard(s) after {split_count} split(s)"
+                 + (f", {unpriced} listing(s) without a price not reachable" if unpriced else ""))
@@ -0,0 +1,262 @@
+import csv
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+# Runs in a row a URL may fail in before it stops being handed out again
+MAX_RUN_ATTEMPTS = 3
+
+# Most URLs looked up per `url IN (...)` query, well below SQLite's limit on bound parameters
+LOOKUP_BATCH = 500
+
+# `attempts` counts consecutive failed runs: a failure adds one, a success starts over
+COUNT_ATTEMPT = f"attempts = CASE WHEN ? = '{FAILED}' THEN attempts + 1 ELSE 0 END"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    property_type TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_fetched REAL
+);
+CREATE INDEX IF NOT EXISTS pages_type_status ON pages (property_type, status);
+
+CREATE TABLE IF NOT EXISTS listings (
+    url TEXT PRIMARY KEY,
+    property_type TEXT NOT NULL,
+    page_url TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_fetched REAL
+);
+CREATE INDEX IF NOT EXISTS listings_type_status ON listings (property_type, status);
+"""
+
+# Columns added after the first release, created on open for databases that predate them
+LISTING_COLUMNS = {
+    "first_seen": "REAL",
+    "last_seen": "REAL",
+    "date_updated": "TEXT",
+    "etag": "TEXT",
+    "last_modified": "TEXT",
+    "removed_at": "REAL",
+}
+
+
+class StateStore:
+    """
+    Persistent crawl frontier: every page URL and listing URL with its status, attempt count
+    and last fetch time, in a SQLite database in WAL mode.
+
+    Resuming a run is an indexed query on (property_type, status), so startup cost does not
+    grow with the size of the output files. One connection is shared between threads and
+    guarded by a lock; WAL keeps readers from blocking the writer.
+
+    Args:
+        db_path (str | Path): Location of the SQLite database file
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _migrate(self):
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(listings)")}
+        for column, column_type in LISTING_COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE listings ADD COLUMN {column} {column_type}")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS listings_type_seen ON listings (property_type, last_seen)")
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _executemany(self, sql, rows):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(sql, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    # -- pages --------------------------------------------------------------------------------
+
+    def add_pages(self, property_type, urls):
+        self._executemany("INSERT OR IGNORE INTO pages (url, property_type) VALUES (?, ?)",
+                          ((url, property_type) for url in urls))
+
+    def reset_pages(self, property_type):
+        """Forget the page frontier so the next discovery regenerates and re-crawls every page."""
+        self._execute("DELETE FROM pages WHERE property_type = ?", (property_type,))
+
+    def count_pages(self, property_type):
+        return self._execute("SELECT COUNT(*) FROM pages WHERE property_type = ?", (property_type,))[0][0]
+
+    def count_incomplete_pages(self, property_type):
+        return self._execute("SELECT COUNT(*) FROM pages WHERE property_type = ? AND status != ?",
+                             (property_type, DONE))[0][0]
+
+    def pending_pages(self, property_type):
+        return self._pending("pages", property_type)
+
+    def mark_page(self, url, status):
+        self._mark("pages", url, status)
+
+    # -- listings -----------------------------------------------------------------------------
+
+    def add_listings(self, property_type, page_url, urls):
+        """Record listing URLs found on a search page, refreshing `last_seen` for known ones."""
+        now = time.time()
+        self._executemany(
+            "INSERT INTO listings (url, property_type, page_url, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (url) DO UPDATE SET last_seen = excluded.last_seen, removed_at = NULL",
+            ((url, property_type, page_url, now, now) for url in urls if url))
+
+    def unfinished_listings(self, urls):
+        """The subset of `urls` that has not been scraped yet."""
+        urls = list(urls)
+        done = {row[0] for row in self._lookup("status", urls) if row[1] == DONE}
+        return [url for url in urls if url not in done]
+
+    def count_listings(self, property_type):
+        return self._execute("SELECT COUNT(*) FROM listings WHERE property_type = ?", (property_type,))[0][0]
+
+    def pending_listings(self, property_type):
+        return self._pending("listings", property_type)
+
+    def reset_listings(self, property_type):
+        """Hand every still listed URL of a category out again, e.g. to re-parse a crawl from the cache."""
+        self._execute("UPDATE listings SET status = ?, attempts = 0 WHERE property_type = ? AND removed_at IS NULL",
+                      (PENDING, property_type))
+
+    def mark_listing(self, url, status):
+        self._mark("listings", url, status)
+
+    def mark_listings(self, urls, status):
+        now = time.time()
+        self._executemany(f"UPDATE listings SET status = ?, {COUNT_ATTEMPT}, last_fetched = ? WHERE url = ?",
+                          ((status, status, now, url) for url in urls))
+
+    def mark_written(self, rows):
+        """Mark scraped rows done once they are on disk, remembering their `listing_date_updated`."""
+        now = time.time()
+        self._executemany(
+            "UPDATE listings SET status = ?, attempts = 0, last_fetched = ?, date_updated = ? WHERE url = ?",
+            ((DONE, now, row.get("listing_date_updated"), row["listing_url"]) for row in rows))
+
+    def listings_first_seen_since(self, property_type, since):
+        """Listings of a category found for the first time at or after `since`."""
+        rows = self._execute("SELECT url FROM listings WHERE property_type = ? AND first_seen >= ?",
+                             (property_type, since))
+        return [row[0] for row in rows]
+
+    def sample_listings(self, property_type, limit):
+        """Up to `limit` already scraped, still listed URLs, least recently fetched first."""
+        rows = self._execute(
+            "SELECT url FROM listings WHERE property_type = ? AND status = ? AND removed_at IS NULL "
+            "ORDER BY last_fetched LIMIT ?", (property_type, DONE, limit))
+        return [row[0] for row in rows]
+
+    def listing_details(self, urls):
+        """Map URL -> (date_updated, etag, last_modified) for the given listings."""
+        return {row[0]: row[1:] for row in self._lookup("date_updated, etag, last_modified", urls)}
+
+    def scheduling_details(self, urls):
+        """Map URL -> (page_url, date_updated, insertion order) for the given listings, see `scheduler`."""
+        return {row[0]: row[1:] for row in self._lookup("page_url, date_updated, rowid", urls)}
+
+    def set_validators(self, url, etag, last_modified):
+        self._execute("UPDATE listings SET etag = ?, last_modified = ? WHERE url = ?", (etag, last_modified, url))
+
+    def mark_removed(self, property_type, seen_before):
+        """
+        Flag listings not seen on any search page since `seen_before` as removed.
+
+        Returns:
+            list: URLs newly flagged as removed
+        """
+        urls = [row[0] for row in self._execute(
+            "SELECT url FROM listings WHERE property_type = ? AND removed_at IS NULL "
+            "AND (last_seen IS NULL OR last_seen < ?)", (property_type, seen_before))]
+        now = time.time()
+        self._executemany("UPDATE listings SET removed_at = ? WHERE url = ?", ((now, url) for url in urls))
+        return urls
+
+    # -- shared -------------------------------------------------------------------------------
+
+    def _pending(self, table, property_type):
+        removed = " AND removed_at IS NULL" if table == "listings" else ""
+        rows = self._execute(
+            f"SELECT url FROM {table} WHERE property_type = ? AND status IN (?, ?) AND attempts < ?{removed}",
+            (property_type, PENDING, FAILED, MAX_RUN_ATTEMPTS))
+        return [row[0] for row in rows]
+
+    def _lookup(self, columns, urls):
+        """Rows of (url, *columns) for the known listings among `urls`, `LOOKUP_BATCH` URLs per query."""
+        urls = list(urls)
+        rows = []
+        for start in range(0, len(urls), LOOKUP_BATCH):
+            batch = urls[start:start + LOOKUP_BATCH]
+            rows += self._execute(f"SELECT url, {columns} FROM listings WHERE url IN ({', '.join('?' * len(batch))})",
+                                  batch)
+        return rows
+
+    def _mark(self, table, url, status):
+        self._execute(f"UPDATE {table} SET status = ?, {COUNT_ATTEMPT}, last_fetched = ? WHERE url = ?",
+                      (status, status, time.time(), url))
+
+    def import_legacy_csv(self, property_type, page_urls_path, listing_urls_path, scraped_data_path):
+        """
+        One-off import of the CSV files older versions used for resuming, so an interrupted
+        run started before the state store existed picks up where it left off.
+
+        Args:
+            property_type (str): Property category the files belong to
+            page_urls_path (str | Path): `<type>_page_urls.csv` left behind by an interrupted run
+            listing_urls_path (str | Path): `<type>_listing_urls.csv` from the input directory
+            scraped_data_path (str | Path): `<type>.csv` from the output directory
+        """
+        if self.count_pages(property_type) or self.count_listings(property_type):
+            return
+        if os.path.isfile(page_urls_path):
+            with open(page_urls_path, newline='', encoding='UTF-8', errors='replace') as file:
+                self.add_pages(property_type, (row["property_page_url"] for row in csv.DictReader(file)))
+        if not os.path.isfile(listing_urls_path):
+            return
+        with open(listing_urls_path, newline='', encoding='UTF-8', errors='replace') as file:
+            rows = [(row.get("listing_url"), property_type, row.get("page_url")) for row in csv.DictReader(file)]
+        self._executemany("INSERT OR IGNORE INTO listings (url, property_type, page_url) VALUES (?, ?, ?)",
+                          (row for row in rows if row[0]))
+        self.add_pages(property_type, {row[2] for row in rows if row[2]})
+        self._executemany("UPDATE pages SET status = 'done' WHERE url = ?", ((row[2],) for row in rows if row[2]))
+
+        if os.path.isfile(scraped_data_path):
+            with open(scraped_data_path, newline='', encoding='UTF-8', errors='replace') as file:
+                self.mark_listings((row.get("listing_url") for row in csv.DictReader(file)), DONE)
+        logging.info(f"Property {property_type}: Imported {len(rows)} listing URL(s) from legacy CSV files")
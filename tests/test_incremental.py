@@ -0,0 +1,52 @@
+"""
+Removal detection of `incremental.run_incremental` against the local sreality stand-in.
+"""
+import pytest
+
+import incremental
+import utils
+from benchmarks.stub_server import SrealityServer
+from state import StateStore
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # Delta files and legacy CSV lookups go to the test's directory instead of the working one
+    monkeypatch.setattr(incremental, "output_dir", tmp_path)
+    monkeypatch.setattr(utils, "output_dir", tmp_path)
+    monkeypatch.setattr(utils, "input_dir", tmp_path)
+    with SrealityServer(pages=2, latency=0) as server:
+        monkeypatch.setattr(utils, "base_url", server.url)
+        yield server
+
+
+def seed_other_size(store, server_url):
+    """Listings found on a 3+kk search page by an earlier run, no longer served by the stand-in."""
+    urls = [f"{server_url}/detail/prodej/byt/3+kk/praha/{1000000000 + number}" for number in range(5)]
+    store.add_listings("byty", f"{server_url}/hledani/byty?strana=1&velikost=3%2Bkk", urls)
+    store.mark_written([{"listing_url": url, "listing_date_updated": "1-1-2024"} for url in urls])
+    return urls
+
+
+def flagged(store, urls):
+    placeholders = ", ".join("?" * len(urls))
+    return store._execute(f"SELECT COUNT(*) FROM listings WHERE removed_at IS NOT NULL AND url IN ({placeholders})",
+                          urls)[0][0]
+
+
+def test_narrowed_crawl_leaves_other_sizes_unflagged(server, tmp_path):
+    with StateStore(tmp_path / "state.sqlite3") as store:
+        others = seed_other_size(store, server.url)
+        changes = incremental.run_incremental("byty", store, sample_size=0, parse_workers=1, pages_to_scrape=2,
+                                              sizes=["2+kk"])
+        assert changes["added"] > 0
+        assert changes["removed"] == 0
+        assert flagged(store, others) == 0
+
+
+def test_full_crawl_flags_listings_gone_from_the_site(server, tmp_path):
+    with StateStore(tmp_path / "state.sqlite3") as store:
+        others = seed_other_size(store, server.url)
+        changes = incremental.run_incremental("byty", store, sample_size=0, parse_workers=1, pages_to_scrape=2)
+        assert changes["removed"] == len(others)
+        assert flagged(store, others) == len(others)
@@ -0,0 +1,35 @@
+"""
+Concurrency slots of `ratelimit.AdaptiveLimiter` when callers are cancelled while waiting.
+"""
+import asyncio
+
+from ratelimit import AdaptiveLimiter
+
+
+def test_cancelled_during_rate_wait_gives_the_slot_back():
+    async def scenario():
+        limiter = AdaptiveLimiter(rate=1, concurrency=2)
+        await limiter.acquire()  # uses the only token, so the next caller sleeps for the rate
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.05)
+        assert limiter.in_flight == 2
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_passes_its_wake_up_on():
+    async def scenario():
+        limiter = AdaptiveLimiter(rate=1000, concurrency=1)
+        await limiter.acquire()
+        first = asyncio.ensure_future(limiter.acquire())
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()  # wakes `first`, which is cancelled before it runs
+        first.cancel()
+        await asyncio.wait_for(second, timeout=1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
@@ -1,18 +1,20 @@
-import requests
-from bs4 import BeautifulSoup
-import csv
 import os
 from pathlib import Path
 from urllib.parse import urlencode
 import logging
 import re
-import pandas as pd
-from threading import Lock
-from concurrent.futures import ThreadPoolExecutor
-from tqdm import tqdm
+from datetime import date
+from functools import lru_cache, partial
+from state import DONE, FAILED
+from dedup import open_seeded
+from metrics import timed_step
 
+# BeautifulSoup, tqdm, the detail parser and the fetch pipeline are imported by the
+# functions that use them, so the API backend, the async crawl and the analytics modules start
+# without loading what they never call. Importing this module creates no files or directories
+# and leaves logging alone; see `configure_logging`.
 
-logging.basicConfig(format="%(levelname)s: %(asctime)s: %(message)s", level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+LOG_FORMAT = "%(levelname)s: %(asctime)s: %(message)s"
 
 base_url = "https://www.sreality.cz"
 
@@ -20,183 +22,181 @@ base_url = "https://www.sreality.cz"
 base_dir = Path(os.getcwd())
 output_dir = base_dir/'data'
 input_dir = base_dir/'listings url'
-
-os.makedirs(input_dir, exist_ok=True)
-os.makedirs(output_dir, exist_ok=True)
-
-
-def get_soup(url, param=None):
-    r = requests.get(url, params=param)
-    if r.status_code == 200:
-        soup = BeautifulSoup(r.text, "html.parser")
-        return soup
-    else:
-        raise Exception(f"Error {r.status_code} getting response for {url}")
-
-
-def get_property_page_urls(property_type):
+state_db_path = input_dir/'state.sqlite3'
+cache_db_path = input_dir/'cache.sqlite3'
+written_set_path = input_dir/'written.fpset'
+history_db_path = input_dir/'history.sqlite3'
+history_snapshot_dir = output_dir/'history'
+media_dir = output_dir/'images'
+agents_db_path = input_dir/'agents.sqlite3'
+
+
+def configure_logging(level=logging.INFO):
+    """Log format of the command line entry points, set up when one of them starts."""
+    logging.basicConfig(format=LOG_FORMAT, level=level, datefmt='%Y-%m-%d %H:%M:%S')
+
+
+# Property sizes (or sub-categories) searched for each property type
+PROPERTY_SIZES = {
+    "byty": [
+        "1+1", "1+kk", "2+kk", "3+1", "3+kk", "2+1", "4+1", "4+kk",
+        "5+1", "5+kk", "6-a-vice", "atypicky", "pokoj"
+    ],
+    "domy": [
+        '1-pokoj', '2-pokoje', '3-pokoje', '4-pokoje', '5-a-vice', 'atypicky'
+    ],
+    "pozemky": [
+        "komercni-pozemky", "lesy", "louky", "ostatni-pozemky", "pole",
+        "rybniky", "sady-vinice", "stavebni-parcely", "zahrady"
+    ],
+    "komercni": [
+        'apartmany', 'cinzovni-domy', 'kancelare', 'obchodni-prostory',
+        'ordinace', 'ostatni-komercni-prostory', 'restaurace', 'sklady',
+        'ubytovani', 'virtualni-kancelare', 'vyrobni-prostory', 'zemedelske-objekty'
+    ],
+    "ostatni": ['ostatni']
+}
+
+# Above this many pages per size a passcode is required
+FREE_PAGE_LIMIT = 5
+PASSCODE = 12345
+
+
+def page_url_generator(property_type, size):
     """
-    Generate paginated URLs for different property types and sizes on sreality.cz.
+    Return a function mapping a page number to the search URL of `size` within `property_type`.
+    """
+    search_url = f"{base_url}/hledani/{property_type}"
+    if property_type in ["byty", "domy"]:
+        return lambda page: f"{search_url}?{urlencode({'strana': page, 'velikost': size})}"
+    elif property_type in ["pozemky", "komercni"]:
+        return lambda page: f"{search_url}/{size}?strana={page}"
+    return lambda page: f"{search_url}?strana={page}"
 
-    Args:
-        property_type (str): Type of property to search (byty, domy, pozemky, komercni, ostatni)
 
-    Returns:
-        list: List of paginated URLs for the specified property type and sizes
+def select_sizes(property_type, sizes=None):
+    """
+    Validate the property type and narrow its sizes to `sizes`, ignoring ones it doesn't have.
     """
-    # Define property sizes for each property type
-    PROPERTY_SIZES = {
-        "byty": [
-            "1+1", "1+kk", "2+kk", "3+1", "3+kk", "2+1", "4+1", "4+kk",
-            "5+1", "5+kk", "6-a-vice", "atypicky", "pokoj"
-        ],
-        "domy": [
-            '1-pokoj', '2-pokoje', '3-pokoje', '4-pokoje', '5-a-vice', 'atypicky'
-        ],
-        "pozemky": [
-            "komercni-pozemky", "lesy", "louky", "ostatni-pozemky", "pole",
-            "rybniky", "sady-vinice", "stavebni-parcely", "zahrady"
-        ],
-        "komercni": [
-            'apartmany', 'cinzovni-domy', 'kancelare', 'obchodni-prostory',
-            'ordinace', 'ostatni-komercni-prostory', 'restaurace', 'sklady',
-            'ubytovani', 'virtualni-kancelare', 'vyrobni-prostory', 'zemedelske-objekty'
-        ],
-        "ostatni": ['ostatni']
-    }
-
-    # Validate property type
     if property_type not in PROPERTY_SIZES:
         raise ValueError(f"Invalid property type: {property_type}")
+    if not sizes:
+        return PROPERTY_SIZES[property_type]
+    selected = [size for size in PROPERTY_SIZES[property_type] if size in sizes]
+    if not selected:
+        logging.warning(f"None of the sizes {sizes} apply to {property_type}, using all of them")
+        return PROPERTY_SIZES[property_type]
+    return selected
 
-    base_url = f"https://www.sreality.cz/hledani/{property_type}"
-    property_sub_urls = []
 
-    # Get global max pages and validate once at the beginning
-    max_pages = 0
-    authorized_for_high_pages = False
-
-    # First pass to find maximum available pages across all sizes
-    for size in PROPERTY_SIZES[property_type]:
-        if property_type in ["byty", "domy"]:
-            url_generator = lambda page: f"{base_url}?{urlencode({'strana': page, 'velikost': size})}"
-        elif property_type in ["pozemky", "komercni"]:
-            url_generator = lambda page: f"{base_url}/{size}?strana={page}"
-        elif property_type == "ostatni":
-            url_generator = lambda page: f"{base_url}?strana={page}"
+def check_pages(pages_to_scrape, max_pages, passcode=None):
+    """
+    Clamp the requested number of pages to what is available and enforce the passcode.
 
-        try:
-            soup = get_soup(url_generator(1))
-            last_page_no = int(get_last_page_no(soup))
-            max_pages = max(max_pages, last_page_no)
-        except Exception as e:
-            logging.error(f"Error checking pages for {property_type} - {size}: {e}")
-            continue
+    Returns:
+        int: Pages to scrape per size, or None if the request is invalid
+    """
+    if pages_to_scrape > max_pages:
+        logging.info(f"Adjusting requested pages from {pages_to_scrape} to maximum available: {max_pages}")
+        pages_to_scrape = max_pages
+    elif pages_to_scrape < 1:
+        logging.error("Must scrape at least 1 page")
+        return None
+    if pages_to_scrape > FREE_PAGE_LIMIT and passcode != PASSCODE:
+        logging.error("INVALID CODE")
+        return None
+    return pages_to_scrape
 
-    # One-time validation for pages to scrape
+
+def prompt_pages(max_pages):
+    """
+    Ask how many pages to scrape, and for the passcode when it is above the free limit.
+    """
     try:
         pages_to_scrape = int(input(f"How many pages do you want to scrape? (1-{max_pages}): "))
-
-        # Validate range and adjust if too high
-        if pages_to_scrape > max_pages:
-            logging.info(f"Adjusting requested pages from {pages_to_scrape} to maximum available: {max_pages}")
-            pages_to_scrape = max_pages
-        elif pages_to_scrape < 1:
-            logging.error("Must scrape at least 1 page")
-            return []
-
-        # One-time passcode check if needed
-        if pages_to_scrape > 5:
-            print(f"It seems you want to scrape above 5 pages!!."
-                  f"\nKindly check tg group for passcode: https://t.me/bot_arena_chat")
-            try:
-                passcode = int(input(f"Input scraper passcode: "))
-                if passcode != 12345:
-                    logging.error("INVALID CODE")
-                    return []
-                authorized_for_high_pages = True
-            except ValueError:
-                logging.error("INVALID CODE FORMAT - Must be a number")
-                return []
-
     except ValueError:
         logging.error("Please enter a valid integer for number of pages")
-        return []
-
-    # Now generate URLs using the validated pages_to_scrape
-    for size in PROPERTY_SIZES[property_type]:
-        if property_type in ["byty", "domy"]:
-            url_generator = lambda page: f"{base_url}?{urlencode({'strana': page, 'velikost': size})}"
-        elif property_type in ["pozemky", "komercni"]:
-            url_generator = lambda page: f"{base_url}/{size}?strana={page}"
-        elif property_type == "ostatni":
-            url_generator = lambda page: f"{base_url}?strana={page}"
+        return None
 
+    passcode = None
+    if min(pages_to_scrape, max_pages) > FREE_PAGE_LIMIT:
+        print(f"It seems you want to scrape above {FREE_PAGE_LIMIT} pages!!."
+              f"\nKindly check tg group for passcode: https://t.me/bot_arena_chat")
         try:
-            soup = get_soup(url_generator(1))
-            last_page_no = int(get_last_page_no(soup))
-
-            # Use minimum of pages_to_scrape and available pages for this size
-            actual_pages = min(pages_to_scrape, last_page_no)
+            passcode = int(input(f"Input scraper passcode: "))
+        except ValueError:
+            logging.error("INVALID CODE FORMAT - Must be a number")
+            return None
+    return check_pages(pages_to_scrape, max_pages, passcode)
 
-            logging.info(
-                f"{property_type.capitalize()} Listings: Scraping {actual_pages}/{last_page_no} page(s). Property specs: {size}")
 
-            # Generate URLs for the specified number of pages
-            property_sub_urls.extend(
-                url_generator(page_no)
-                for page_no in range(1, actual_pages + 1)
-            )
+# Listing URLs of first search pages already parsed during discovery, keyed by page URL,
+# so `listing_urls_scraper` doesn't fetch those pages again
+FIRST_PAGE_CACHE = {}
 
-        except Exception as e:
-            logging.error(f"Error processing {property_type} - {size}: {e}")
-            continue
+# Property type -> whether the pages last generated for it cover every size of the category to
+# its last page, i.e. a crawl of them sees every listing of the category
+SEARCH_COVERAGE = {}
 
-    return property_sub_urls
 
+def get_property_page_urls(property_type, pages_to_scrape=None, sizes=None, passcode=None):
+    """
+    Generate paginated URLs for different property types and sizes on sreality.cz.
 
-# Create a global lock for file operations
-file_lock = Lock()
+    The first page of every size is fetched once, concurrently; its last page number is used
+    here and its listing URLs are kept in `FIRST_PAGE_CACHE`.
 
+    Args:
+        property_type (str): Type of property to search (byty, domy, pozemky, komercni, ostatni)
+        pages_to_scrape (int, optional): Pages per size; the user is prompted when not given
+        sizes (list, optional): Only these sizes of the property type, all by default
+        passcode (int, optional): Required for more than `FREE_PAGE_LIMIT` pages when not prompting
 
-def initialize_csv(file_path, fieldnames):
+    Returns:
+        list: List of paginated URLs for the specified property type and sizes
     """
-    Initialize the CSV file with headers if it doesn't exist.
+    from discovery import discover_first_pages
 
-    Parameters:
-    file_path (str): Path to the CSV file
-    fieldnames (list): List of column names for the header
-    """
-    if not os.path.exists(file_path):
-        with open(file_path, mode='w', newline='', encoding='UTF-8') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
+    sizes = select_sizes(property_type, sizes)
+    first_pages = discover_first_pages(property_type, sizes)
+
+    # Get global max pages and validate once at the beginning
+    max_pages = max((last_page_no for _, last_page_no, _ in first_pages.values()), default=0)
 
+    # One-time validation for pages to scrape
+    if pages_to_scrape is None:
+        pages_to_scrape = prompt_pages(max_pages)
+    else:
+        pages_to_scrape = check_pages(pages_to_scrape, max_pages, passcode)
+    if pages_to_scrape is None:
+        return []
 
-def write_to_file(response_dict, file_path):
-    """
-    Writes data to a CSV file in a thread-safe manner.
+    # A crawl narrowed to some sizes never sees the listings of the others
+    SEARCH_COVERAGE[property_type] = sizes == PROPERTY_SIZES[property_type] and all(
+        size in first_pages and pages_to_scrape >= first_pages[size][1] for size in sizes)
 
-    Parameters:
-    response_dict (dict): Dictionary containing the response data, where each value is a list
-    file_path (str): Path to the CSV file where data should be written
-    """
-    # Initialize the CSV file with headers if it doesn't exist
-    initialize_csv(file_path, list(response_dict.keys()))
+    # Now generate URLs using the validated pages_to_scrape and the cached last page numbers
+    property_sub_urls = []
+    for size in sizes:
+        if size not in first_pages:
+            continue
+        first_url, last_page_no, data_dict = first_pages[size]
+        FIRST_PAGE_CACHE[first_url] = data_dict
+
+        # Use minimum of pages_to_scrape and available pages for this size
+        actual_pages = min(pages_to_scrape, last_page_no)
 
-    # Convert single row to list format if needed
-    if not isinstance(next(iter(response_dict.values())), list):
-        response_dict = {k: [v] for k, v in response_dict.items()}
+        logging.info(
+            f"{property_type.capitalize()} Listings: Scraping {actual_pages}/{last_page_no} page(s). Property specs: {size}")
 
-    # Create rows from the dictionary
-    rows = [dict(zip(response_dict.keys(), values))
-            for values in zip(*response_dict.values())]
+        # Generate URLs for the specified number of pages
+        url_generator = page_url_generator(property_type, size)
+        property_sub_urls.extend(
+            url_generator(page_no)
+            for page_no in range(1, actual_pages + 1)
+        )
 
-    # Use a lock to ensure thread-safe writing
-    with file_lock:
-        with open(file_path, mode='a', newline='', encoding='UTF-8') as file:
-            writer = csv.DictWriter(file, fieldnames=response_dict.keys())
-            writer.writerows(rows)
+    return property_sub_urls
 
 
 def get_last_page_no(soup):
@@ -210,17 +210,20 @@ def get_last_page_no(soup):
         raise Exception("Error getting last page")
 
 
-def get_listing_urls(page_url, property_type):
+def parse_listing_urls(page_url, html, property_type):
     """
-    Open listing page and get all listings URLs
+    Get all listing URLs from a downloaded search results page
     Args:
-        page_url:
-        property_type:
+        page_url: URL of the search results page
+        html: Page body
+        property_type: Property category of the page
 
     Returns:
-
+        dict: Columns page_url, property_type and listing_url, as recorded by `listing_urls_scraper`
     """
-    soup = get_soup(page_url)
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
     record_list = soup.find("ul").find_all('li', class_="MuiGrid-root")
     listing_urls = []
     for record in record_list:
@@ -238,15 +241,38 @@ def get_listing_urls(page_url, property_type):
         "property_type": property_type_list,
         "listing_url": listing_urls
     }
-    write_to_file(data_dict, input_dir / f'{property_type}_listing_urls.csv')
-    # logging.info(f"Property {property_type}: Saved listing URLs to CSV file")
+    return data_dict
+
+
+def parse_first_page(page_url, html, property_type):
+    """
+    Read both the last page number and the listing URLs from a size's first search page, so
+    the page never has to be fetched or parsed a second time. Runs in a parser process.
+
+    Returns:
+        tuple: (last page number, `parse_listing_urls` dict)
+    """
+    from bs4 import BeautifulSoup
+
+    last_page_no = int(get_last_page_no(BeautifulSoup(html, "html.parser")))
+    return last_page_no, parse_listing_urls(page_url, html, property_type)
+
+
+# Patterns of the field parsers below, compiled once
+# "Street, City - District" or "City - District" or "City"
+LOCATION_PATTERN = re.compile(r"^(.*?)(?:,\s*(.*?))?(?:\s*-\s*(.*))?$")
+USABLE_AREA_PATTERN = re.compile(r"Užitná plocha (\d+)\s*m²")
+BUILT_UP_AREA_PATTERN = re.compile(r"Zastavěná plocha (\d+)\s*m²")
+TOTAL_AREA_PATTERN = re.compile(r"Celková plocha (\d+)\s*m²")
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+# International format (+) or local numbers with length 7-15
+PHONE_PATTERN = re.compile(r'^\+?[0-9\s\-]{7,15}$')
+# Zero-width spaces, non-breaking spaces and spaces are dropped from prices
+PRICE_DELETE = str.maketrans("", "", "\u200b\xa0 ")
 
 
 def parse_location(location):
-    # Regular expression pattern to match:
-    # "Street, City - District" or "City - District" or "City"
-    pattern = r"^(.*?)(?:,\s*(.*?))?(?:\s*-\s*(.*))?$"
-    match = re.match(pattern, location)
+    match = LOCATION_PATTERN.match(location)
 
     if match:
         # Assign groups to variables
@@ -264,15 +290,10 @@ def parse_location(location):
 
 
 def parse_area(areas_string):
-    # Regular expression patterns to capture the area values and their units (m²)
-    usable_area_pattern = r"Užitná plocha (\d+)\s*m²"
-    built_up_area_pattern = r"Zastavěná plocha (\d+)\s*m²"
-    total_area_pattern = r"Celková plocha (\d+)\s*m²"
-
     # Search for the usable area, built-up area, and total area
-    usable_area_match = re.search(usable_area_pattern, areas_string)
-    built_up_area_match = re.search(built_up_area_pattern, areas_string)
-    total_area_match = re.search(total_area_pattern, areas_string)
+    usable_area_match = USABLE_AREA_PATTERN.search(areas_string)
+    built_up_area_match = BUILT_UP_AREA_PATTERN.search(areas_string)
+    total_area_match = TOTAL_AREA_PATTERN.search(areas_string)
 
     # Extract the values and return them with their units
     usable_area = int(usable_area_match.group(1)) if usable_area_match else None
@@ -328,7 +349,7 @@ def get_element_attribute(soup, tag, class_name, attribute=None, base_url=None):
 
 def format_price(price):
     if price:
-        return price.replace('\u200b', '').replace('\xa0', ' ').replace(' ', '').replace('Kč', '').strip()
+        return price.translate(PRICE_DELETE).replace('Kč', '').strip()
     return None
 
 
@@ -338,32 +359,50 @@ def extract_footer_info(soup):
         keys = [i.text for i in footer.findAll('dt')]
         values = [i.text for i in footer.findAll('dd')]
         footer_dict = dict(zip(keys, values))
-        date_inserted = "-".join([i.strip() for i in footer_dict.get("Vloženo:", "").split('.')])
-        date_updated = "-".join([i.strip() for i in footer_dict.get("Upraveno:", "").split('.')])
+        # A date missing from the footer is None, as in the API backend, not an empty string
+        date_inserted = "-".join([i.strip() for i in footer_dict.get("Vloženo:", "").split('.')]) or None
+        date_updated = "-".join([i.strip() for i in footer_dict.get("Upraveno:", "").split('.')]) or None
         return {"date_inserted": date_inserted, "date_updated": date_updated}
     return {"date_inserted": None, "date_updated": None}
 
 
-def extract_agent_info(soup, base_url):
-    agent_info = soup.findAll('li', class_="css-yu7uzj")
-    agent_info = [i.text for i in agent_info] if agent_info else []
+def to_date(value):
+    """Convert the scraper's 'D-M-YYYY' dates to `datetime.date`; anything else becomes None."""
+    if not value:
+        return None
+    try:
+        day, month, year = (int(part) for part in value.split("-"))
+        return date(year, month, day)
+    except ValueError:
+        return None
 
-    # Initialize variables
-    phone1, phone2, email = None, None, None
 
-    # Regex patterns
-    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    phone_pattern = r'^\+?[0-9\s\-]{7,15}$'  # Matches international format (+) or local numbers with length 7-15
+def split_agent_contacts(agent_info):
+    """
+    Sort the agent's contact lines into (email, first phone, second phone); the last email and
+    the first two phone numbers win. An agency's block repeats on every one of its listings,
+    so the result is memoized per parser process.
+    """
+    return _split_agent_contacts(tuple(agent_info))
+
 
-    # Process agent_info list
+@lru_cache(maxsize=4096)
+def _split_agent_contacts(agent_info):
+    phone1, phone2, email = None, None, None
     for info in agent_info:
-        if re.match(email_pattern, info):  # If it matches an email
+        if EMAIL_PATTERN.match(info):  # If it matches an email
             email = info
-        elif re.match(phone_pattern, info):  # If it matches a phone number
+        elif PHONE_PATTERN.match(info):  # If it matches a phone number
             if phone1 is None:  # First phone
                 phone1 = info
             elif phone2 is None:  # Second phone
                 phone2 = info
+    return email, phone1, phone2
+
+
+def extract_agent_info(soup, base_url):
+    agent_info = soup.findAll('li', class_="css-yu7uzj")
+    agent_info = [i.text for i in agent_info] if agent_info else []
 
     agent_name_contact_page = soup.find('a',
                                         class_="MuiButtonBase-root MuiButton-root MuiButton-text MuiButton-textSecondary"
@@ -381,144 +420,204 @@ def extract_agent_info(soup, base_url):
         "agent_name": agent_name,
         "agent_url": agent_url,
         "agent_website": agent_website,
+        # Raw contact lines, sorted into email and phones by `split_agent_contacts`
+        "agent_contacts": agent_info
+    }
+
+
+# Column order of the rows built by `parse_listing`
+OUTPUT_FIELDS = (
+    "dbq_prd_type", "website_name", "competence_date", "listing_title", "listing_description", "property_type",
+    "country_code", "location_description", "location_long", "location_city", "location_region",
+    "location_street", "area_unit", "total_area", "usable_area", "built_up_area", "amenities_list",
+    "energy_intensity", "construction", "construction_type", "construction_status", "floor_location",
+    "listing_date", "listing_date_updated", "currency_code", "price", "note_on_price", "agent_name", "agent_url",
+    "agent_website", "agent_email", "agent_phone1", "agent_phone2", "image_url", "listing_url",
+)
+
+
+def parse_listing(soup, listing_url, property_type):
+    """
+    Extract the `scraped_data` row from a detail page.
+
+    Args:
+        soup: Parsed detail page - a BeautifulSoup object or the `ClassIndex` built by
+            `parse_detail_page`, which answers the same lookups without re-walking the tree
+        listing_url (str): URL of the detail page
+        property_type (str): Property category the listing belongs to
+
+    Returns:
+        dict: One output row
+    """
+    # Extract title and location
+    listing_title_location = soup.find('h1').get_text(separator="\n").split("\n")
+    listing_title = listing_title_location[0]
+    listing_location = listing_title_location[1] if len(listing_title_location) > 1 else None
+
+    # Extract image URL
+    image_url = get_element_attribute(soup, 'img', "MuiBox-root css-emihra", "src")
+
+    # Extract listing description
+    listing_description = get_element_attribute(soup, 'div', "MuiBox-root css-zbebq3")
+
+    # Parse listing information into a dictionary
+    listing_values = [item.text for item in
+                      soup.findAll('dd', class_="MuiTypography-root MuiTypography-body1 css-urnwfg")]
+    listing_keys = [item.text for item in
+                    soup.findAll('dt', class_="MuiTypography-root MuiTypography-body1 css-tm1g54")]
+    listing_info_dict = dict(zip(listing_keys, listing_values))
+
+    # Parse price
+    price = listing_info_dict.get("Celková cena:", None) or listing_info_dict.get("Cena:", None)
+
+    # Parse note on price and other fields
+    note_on_price = listing_info_dict.get("Poznámka k ceně:", None)
+    accessories = listing_info_dict.get("Příslušenství:", None)
+    energy_intensity = listing_info_dict.get("Energetická náročnost:", None)
+    construction = listing_info_dict.get("Stavba:", None)
+    infrastructure = listing_info_dict.get("Infrastruktura:", None)
+    location_description = listing_info_dict.get("Lokalita:", None)
+    ownership = listing_info_dict.get("Vlastnictví:", None)
+
+    area = listing_info_dict.get("Plocha:", None)
+
+    # Extract footer information
+    footer_info = extract_footer_info(soup)
+
+    # Extract agent information
+    agent_info = extract_agent_info(soup, base_url)
+
+    # Normalize the extracted text, timed as its own stage when run by the pipeline
+    with timed_step("normalize"):
+        street, city, district = parse_location(listing_location) if listing_location else (None, None, None)
+        price = format_price(price)
+        construction_type, construction_status, floor_location = parse_construction(construction) \
+            if construction else (None, None, None)
+        usable_area, built_up_area, total_area = parse_area(area) if area else (None, None, None)
+        email, phone1, phone2 = split_agent_contacts(agent_info["agent_contacts"])
+
+    # Compile the scraped data
+    scraped_data = {
+        'dbq_prd_type': 'REAL-ESTATE-BASIC',
+        "website_name": base_url,
+        "competence_date": "DD-MM-YYYY",
+        "listing_title": listing_title,
+        "listing_description": listing_description,
+        "property_type": property_type,
+        "country_code": 203,
+        "location_description": location_description,
+        "location_long": listing_location,
+        "location_city": city,
+        "location_region": district,
+        "location_street": street,
+        "area_unit": "SQMT",
+        "total_area": total_area,
+        "usable_area": usable_area,
+        "built_up_area": built_up_area,
+        "amenities_list": accessories,
+        "energy_intensity": energy_intensity,
+        "construction": construction,
+        "construction_type": construction_type,
+        "construction_status": construction_status,
+        "floor_location": floor_location,
+        "listing_date": footer_info.get("date_inserted"),
+        "listing_date_updated": footer_info.get("date_updated"),
+        "currency_code": "CZK",
+        "price": price,
+        "note_on_price": note_on_price,
+        "agent_name": agent_info.get("agent_name"),
+        "agent_url": agent_info.get("agent_url"),
+        "agent_website": agent_info.get("agent_website"),
         "agent_email": email,
         "agent_phone1": phone1,
-        "agent_phone2": phone2
+        "agent_phone2": phone2,
+        "image_url": f'https:{image_url}' if image_url else None,
+        "listing_url": listing_url
     }
 
+    return scraped_data
 
-def scrape_listings(listing_url, property_type):
-    try:
-        soup = get_soup(listing_url)
 
-        # Extract title and location
-        listing_title_location = soup.find('h1').get_text(separator="\n").split("\n")
-        listing_title = listing_title_location[0]
-        listing_location = listing_title_location[1] if len(listing_title_location) > 1 else None
+def parse_listing_html(listing_url, html, property_type):
+    """
+    Parse a downloaded detail page into a row. Module level so it can run in a parser process.
+    """
+    from detail_parser import parse_detail_page
 
-        # Parse location
-        street, city, district = parse_location(listing_location) if listing_location else (None, None, None)
+    return parse_listing(parse_detail_page(html), listing_url, property_type)
 
-        # Extract image URL
-        image_url = get_element_attribute(soup, 'img', "MuiBox-root css-emihra", "src")
 
-        # Extract listing description
-        listing_description = get_element_attribute(soup, 'div', "MuiBox-root css-zbebq3")
+def save_listing(listing_url, scraped_data, property_type, writer):
+    """
+    Append a scraped row to the category's output CSV through `writer` (a `BatchWriter`, which
+    also feeds the Parquet output).
+    """
+    writer.write(output_dir / f"{property_type}.csv", scraped_data)
+    logging.info(f"Property {property_type}: Scraped listing {listing_url} Successfully")
 
-        # Parse listing information into a dictionary
-        listing_values = [item.text for item in
-                          soup.findAll('dd', class_="MuiTypography-root MuiTypography-body1 css-urnwfg")]
-        listing_keys = [item.text for item in
-                        soup.findAll('dt', class_="MuiTypography-root MuiTypography-body1 css-tm1g54")]
-        listing_info_dict = dict(zip(listing_keys, listing_values))
 
-        # Parse price
-        price = listing_info_dict.get("Celková cena:", None) or listing_info_dict.get("Cena:", None)
-        price = format_price(price)
+def open_written_set(rebuild=False):
+    """
+    Fingerprints of every listing in the output CSVs, for `BatchWriter(dedup=...)`. Built
+    from the output files on first use, or again with `rebuild` (e.g. after moving them aside).
+    """
+    return open_seeded(written_set_path, [output_dir / f"{property_type}.csv" for property_type in PROPERTY_SIZES],
+                       rebuild=rebuild)
 
-        # Parse note on price and other fields
-        note_on_price = listing_info_dict.get("Poznámka k ceně:", None)
-        accessories = listing_info_dict.get("Příslušenství:", None)
-        energy_intensity = listing_info_dict.get("Energetická náročnost:", None)
-        construction = listing_info_dict.get("Stavba:", None)
-        construction_type, construction_status, floor_location = parse_construction(construction) if construction else (
-            None, None, None)
-        infrastructure = listing_info_dict.get("Infrastruktura:", None)
-        location_description = listing_info_dict.get("Lokalita:", None)
-        ownership = listing_info_dict.get("Vlastnictví:", None)
-
-        # Parse area details
-        area = listing_info_dict.get("Plocha:", None)
-        usable_area, built_up_area, total_area = parse_area(area) if area else (None, None, None)
 
-        # Extract footer information
-        footer_info = extract_footer_info(soup)
-
-        # Extract agent information
-        agent_info = extract_agent_info(soup, base_url)
-
-        # Compile the scraped data
-        scraped_data = {
-            'dbq_prd_type': 'REAL-ESTATE-BASIC',
-            "website_name": base_url,
-            "competence_date": "DD-MM-YYYY",
-            "listing_title": listing_title,
-            "listing_description": listing_description,
-            "property_type": property_type,
-            "country_code": 203,
-            "location_description": location_description,
-            "location_long": listing_location,
-            "location_city": city,
-            "location_region": district,
-            "location_street": street,
-            "area_unit": "SQMT",
-            "total_area": total_area,
-            "usable_area": usable_area,
-            "built_up_area": built_up_area,
-            "amenities_list": accessories,
-            "energy_intensity": energy_intensity,
-            "construction": construction,
-            "construction_type": construction_type,
-            "construction_status": construction_status,
-            "floor_location": floor_location,
-            "listing_date": footer_info.get("date_inserted"),
-            "listing_date_updated": footer_info.get("date_updated"),
-            "currency_code": "CZK",
-            "price": price,
-            "note_on_price": note_on_price,
-            "agent_name": agent_info.get("agent_name"),
-            "agent_url": agent_info.get("agent_url"),
-            "agent_website": agent_info.get("agent_website"),
-            "agent_email": agent_info.get("agent_email"),
-            "agent_phone1": agent_info.get("agent_phone1"),
-            "agent_phone2": agent_info.get("agent_phone2"),
-            "image_url": f'https:{image_url}',
-            "listing_url": listing_url
-        }
-
-        df = pd.DataFrame([scraped_data])
-        scraped_file_dict = df.to_dict(orient='list')
-
-        write_to_file(scraped_file_dict, output_dir / f"{property_type}.csv")
-        logging.info(f"Property {property_type}: Scraped listing {listing_url} Successfully")
-    except Exception as e:
-        logging.error(f"Property {property_type}: Error scraping URL: {listing_url}")
-
-
-def listing_urls_scraper(property_type):
-
-    file_path = input_dir / f"{property_type}_page_urls.csv"
-    if not os.path.isfile(file_path):
-        # logging.error(f"{property_type}_page_urls.csv NOT found in input dir")
-        property_page_urls = get_property_page_urls(property_type)
-        data = {
-            "property_page_url": property_page_urls
-        }
-        write_to_file(data, input_dir / f"{property_type}_page_urls.csv")
-        # logging.info(f"page_urls.csv SAVED to input directory")
-
-    df = pd.read_csv(file_path)
-    total_page_urls = df["property_page_url"].to_list()
-
-    # check if item url have been scraped
-    listing_urls_path = input_dir / f"{property_type}_listing_urls.csv"
-    if os.path.isfile(listing_urls_path):
-        # logging.info(f"{property_type}_listing_urls.csv found in input directory")
-        df = pd.read_csv(listing_urls_path)
-        scraped_page_url = df["page_url"].to_list()
-        remaining_page_urls = list(set(total_page_urls) - set(scraped_page_url))
+def listing_urls_scraper(property_type, store, fetch_workers=30, parse_workers=None, pages_to_scrape=None, sizes=None,
+                         passcode=None):
+    """
+    Discover listing URLs for a property type and record them in the state store.
+
+    Page URLs are generated (after the usual prompts, unless `pages_to_scrape` is given) only
+    when the store has no pending pages for the category; otherwise the run resumes from the
+    pages that are still pending or failed.
+
+    Args:
+        property_type (str): Property category to crawl
+        store (StateStore): Crawl state shared with `main.py`
+        fetch_workers (int): Requests in flight at once
+        parse_workers (int, optional): Parser processes, one per CPU by default
+        pages_to_scrape (int, optional): Pages per size; prompted for when not given
+        sizes (list, optional): Only these sizes of the property type, all by default
+        passcode (int, optional): Required for more than `FREE_PAGE_LIMIT` pages when not prompting
+
+    Returns:
+        bool: Whether the pages were generated in this call and cover every size of the category
+            to its last page, so the discovered listings are all it has (once every page is done)
+    """
+    from tqdm import tqdm
+    from pipeline import run_pipeline
+
+    store.import_legacy_csv(property_type,
+                            input_dir / f"{property_type}_page_urls.csv",
+                            input_dir / f"{property_type}_listing_urls.csv",
+                            output_dir / f"{property_type}.csv")
+
+    complete = False
+    remaining_page_urls = store.pending_pages(property_type)
+    if not remaining_page_urls:
+        store.add_pages(property_type, get_property_page_urls(property_type, pages_to_scrape, sizes, passcode))
+        complete = SEARCH_COVERAGE.pop(property_type, False)
+        remaining_page_urls = store.pending_pages(property_type)
+
+    def save_listing_urls(page_url, data_dict):
+        store.add_listings(property_type, page_url, data_dict["listing_url"])
+        store.mark_page(page_url, DONE)
+
+    # First pages were already parsed during discovery
+    for page_url in [url for url in remaining_page_urls if url in FIRST_PAGE_CACHE]:
+        save_listing_urls(page_url, FIRST_PAGE_CACHE.pop(page_url))
+        remaining_page_urls.remove(page_url)
 
-    else:
-        remaining_page_urls = total_page_urls
     logging.info(f"Property {property_type}: Scraping listing URLs from page(s)...")
-    with ThreadPoolExecutor(max_workers=30) as executor:
-        futures = [executor.submit(get_listing_urls, page_url, property_type) for page_url in remaining_page_urls]
-        for future in tqdm(futures, desc="Scraping listing URLs"):
-            try:
-                future.result()
-            except Exception:
-                continue
-
-    os.remove(file_path)
-    logging.info(f"Property {property_type}: Scraping listing URLs from page(s) completed!")
+    with tqdm(total=len(remaining_page_urls), desc="Scraping listing URLs") as progress:
+        run_pipeline(remaining_page_urls,
+                     partial(parse_listing_urls, property_type=property_type),
+                     save_listing_urls,
+                     fetch_workers=fetch_workers, parse_workers=parse_workers, progress=progress,
+                     on_failure=lambda page_url, error: store.mark_page(page_url, FAILED))
 
+    logging.info(f"Property {property_type}: Scraping listing URLs from page(s) completed!")
+    return complete
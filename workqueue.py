@@ -0,0 +1,497 @@
+"""
+Leased work queues shared by the nodes of a distributed crawl (see `distributed`).
+
+Items are page or listing URLs of one category. A worker leases a few at a time; a lease
+that is neither completed nor failed before `visibility_timeout` runs out is handed to the
+next worker that asks, so the work of a crashed node is picked up again. Completing an item
+stores its result for the coordinator in the same step, and only the first completion of an
+item is accepted: when an expired lease is finished by two workers, one result is dropped.
+
+Three interchangeable backends implement the same methods:
+
+- `MemoryQueue`: in-process, for tests and single-process runs
+- `SQLiteQueue`: one SQLite file on storage all nodes can reach
+- `RedisQueue`: a Redis server (needs the `redis` package)
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from state import DONE, FAILED, MAX_RUN_ATTEMPTS, PENDING
+
+
+LEASED = "leased"
+
+# Item kinds
+PAGE = "page"
+LISTING = "listing"
+
+# Seconds a leased item stays invisible to other workers
+DEFAULT_VISIBILITY_TIMEOUT = 300.0
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def open_queue(url, **kwargs):
+    """
+    Open a queue from a URL: `sqlite:///path/to/queue.sqlite3`, `redis://host:6379/0` or
+    `memory://`. Keyword arguments go to the backend.
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteQueue(url[len("sqlite:///"):], **kwargs)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(url, **kwargs)
+    if url == "memory://":
+        return MemoryQueue(**kwargs)
+    raise ValueError(f"Invalid queue URL: {url} (use sqlite:///<path>, redis://<host> or memory://)")
+
+
+class MemoryQueue:
+    """
+    In-process queue with the same semantics as the shared backends.
+
+    Args:
+        visibility_timeout (float): Seconds a lease lasts
+        max_attempts (int): Leases an item gets before it is reported as failed
+    """
+
+    def __init__(self, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_attempts=MAX_RUN_ATTEMPTS):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # (kind, url) -> [property_type, state, attempts, worker, lease_until], in insertion order
+        self.items = OrderedDict()
+        self.results_log = OrderedDict()
+        self.next_result = 1
+        self.cursor = 0
+        self.finished = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def put(self, kind, property_type, urls):
+        """Queue URLs that are not already waiting or leased. Returns the number queued."""
+        added = 0
+        with self.lock:
+            for url in urls:
+                item = self.items.get((kind, url))
+                if item is None or item[1] in (DONE, FAILED):
+                    self.items[(kind, url)] = [property_type, PENDING, 0, None, None]
+                    added += 1
+        return added
+
+    def lease(self, kind, property_type, worker, count):
+        """Lease up to `count` waiting (or expired) items of a kind and category. Returns their URLs."""
+        now = time.time()
+        urls = []
+        with self.lock:
+            for (item_kind, url), item in self.items.items():
+                if len(urls) >= count:
+                    break
+                if item_kind != kind or item[0] != property_type:
+                    continue
+                expired = item[1] == LEASED and item[4] < now
+                if expired and item[2] >= self.max_attempts:
+                    item[1:] = [FAILED, item[2], None, None]
+                    self._add_result(kind, url, property_type, None)
+                elif item[1] == PENDING or expired:
+                    item[1:] = [LEASED, item[2] + 1, worker, now + self.visibility_timeout]
+                    urls.append(url)
+        return urls
+
+    def complete(self, kind, property_type, url, worker, result):
+        """
+        Finish a leased item and store its result for the coordinator.
+
+        Returns:
+            bool: False when the item was already finished (by a worker whose lease had expired)
+        """
+        with self.lock:
+            item = self.items.get((kind, url))
+            if item is None or item[1] != LEASED:
+                return False
+            item[1:] = [DONE, item[2], None, None]
+            self._add_result(kind, url, item[0], result)
+        return True
+
+    def fail(self, kind, property_type, url, worker):
+        """Give a lease back; the item waits for another attempt or is reported as failed."""
+        with self.lock:
+            item = self.items.get((kind, url))
+            if item is None or item[1] != LEASED or item[3] != worker:
+                return
+            if item[2] >= self.max_attempts:
+                item[1:] = [FAILED, item[2], None, None]
+                self._add_result(kind, url, item[0], None)
+            else:
+                item[1:] = [PENDING, item[2], None, None]
+
+    def _add_result(self, kind, url, property_type, result):
+        self.results_log[self.next_result] = (kind, url, property_type, result)
+        self.next_result += 1
+
+    def results(self, count):
+        """
+        Up to `count` results not returned to this queue object yet, oldest first, as
+        (result_id, kind, url, property_type, result) with result None for failed items.
+        Unacknowledged results are returned again by a new queue object, e.g. after a restart.
+        """
+        with self.lock:
+            batch = [(result_id, *entry) for result_id, entry in self.results_log.items()
+                     if result_id > self.cursor][:count]
+            if batch:
+                self.cursor = batch[-1][0]
+        return batch
+
+    def ack(self, result_ids):
+        """Delete results the coordinator has durably handled."""
+        with self.lock:
+            for result_id in result_ids:
+                self.results_log.pop(result_id, None)
+
+    def outstanding(self):
+        """Items still waiting or leased."""
+        with self.lock:
+            return sum(item[1] in (PENDING, LEASED) for item in self.items.values())
+
+    def set_finished(self, finished):
+        """Tell workers whether to exit once nothing is left to lease."""
+        self.finished = finished
+
+    def is_finished(self):
+        return self.finished
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    property_type TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    PRIMARY KEY (kind, url)
+);
+CREATE INDEX IF NOT EXISTS items_leasable ON items (kind, property_type, state, lease_until);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    property_type TEXT NOT NULL,
+    result TEXT
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SQLiteQueue:
+    """
+    Queue in a SQLite file on storage shared by all nodes (e.g. an NFS mount).
+
+    Every lease, completion and failure is one `BEGIN IMMEDIATE` transaction, so nodes
+    serialize on the file lock. The rollback journal is kept instead of WAL, which needs
+    shared memory that network filesystems don't provide.
+
+    Args:
+        db_path (str | Path): Location of the SQLite database file
+        visibility_timeout (float): Seconds a lease lasts
+        max_attempts (int): Leases an item gets before it is reported as failed
+    """
+
+    def __init__(self, db_path, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, max_attempts=MAX_RUN_ATTEMPTS):
+        self.db_path = str(db_path)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.cursor = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _transaction(self, function, *args):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(*args)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def _add_result(self, kind, url, property_type, result):
+        self.conn.execute("INSERT INTO results (kind, url, property_type, result) VALUES (?, ?, ?, ?)",
+                          (kind, url, property_type, json.dumps(result, ensure_ascii=False)))
+
+    def put(self, kind, property_type, urls):
+        def put():
+            added = 0
+            for url in urls:
+                added += self.conn.execute(
+                    "INSERT INTO items (kind, url, property_type) VALUES (?, ?, ?) "
+                    "ON CONFLICT (kind, url) DO UPDATE SET property_type = excluded.property_type, state = ?, "
+                    "attempts = 0, worker = NULL, lease_until = NULL WHERE state IN (?, ?)",
+                    (kind, url, property_type, PENDING, DONE, FAILED)).rowcount
+            return added
+        return self._transaction(put)
+
+    def lease(self, kind, property_type, worker, count):
+        def lease():
+            now = time.time()
+            exhausted = self.conn.execute(
+                "SELECT url FROM items WHERE kind = ? AND property_type = ? AND state = ? AND lease_until < ? "
+                "AND attempts >= ?", (kind, property_type, LEASED, now, self.max_attempts)).fetchall()
+            for (url,) in exhausted:
+                self.conn.execute("UPDATE items SET state = ?, worker = NULL, lease_until = NULL "
+                                  "WHERE kind = ? AND url = ?", (FAILED, kind, url))
+                self._add_result(kind, url, property_type, None)
+            urls = [row[0] for row in self.conn.execute(
+                "SELECT url FROM items WHERE kind = ? AND property_type = ? "
+                "AND (state = ? OR (state = ? AND lease_until < ?)) ORDER BY rowid LIMIT ?",
+                (kind, property_type, PENDING, LEASED, now, count))]
+            self.conn.executemany(
+                "UPDATE items SET state = ?, attempts = attempts + 1, worker = ?, lease_until = ? "
+                "WHERE kind = ? AND url = ?",
+                ((LEASED, worker, now + self.visibility_timeout, kind, url) for url in urls))
+            return urls
+        return self._transaction(lease)
+
+    def complete(self, kind, property_type, url, worker, result):
+        def complete():
+            finished = self.conn.execute(
+                "UPDATE items SET state = ?, worker = NULL, lease_until = NULL WHERE kind = ? AND url = ? AND state = ?",
+                (DONE, kind, url, LEASED)).rowcount
+            if finished:
+                self._add_result(kind, url, property_type, result)
+            return bool(finished)
+        return self._transaction(complete)
+
+    def fail(self, kind, property_type, url, worker):
+        def fail():
+            row = self.conn.execute("SELECT attempts FROM items WHERE kind = ? AND url = ? AND state = ? AND worker = ?",
+                                    (kind, url, LEASED, worker)).fetchone()
+            if row is None:
+                return
+            state = FAILED if row[0] >= self.max_attempts else PENDING
+            self.conn.execute("UPDATE items SET state = ?, worker = NULL, lease_until = NULL WHERE kind = ? AND url = ?",
+                              (state, kind, url))
+            if state == FAILED:
+                self._add_result(kind, url, property_type, None)
+        self._transaction(fail)
+
+    def results(self, count):
+        with self.lock:
+            rows = self.conn.execute("SELECT id, kind, url, property_type, result FROM results WHERE id > ? "
+                                     "ORDER BY id LIMIT ?", (self.cursor, count)).fetchall()
+        if rows:
+            self.cursor = rows[-1][0]
+        return [(result_id, kind, url, property_type, json.loads(result))
+                for result_id, kind, url, property_type, result in rows]
+
+    def ack(self, result_ids):
+        self._transaction(lambda: self.conn.executemany("DELETE FROM results WHERE id = ?",
+                                                        ((result_id,) for result_id in result_ids)))
+
+    def outstanding(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM items WHERE state IN (?, ?)",
+                                     (PENDING, LEASED)).fetchone()[0]
+
+    def set_finished(self, finished):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('finished', ?)",
+                              ("1" if finished else "0",))
+
+    def is_finished(self):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'finished'").fetchone()
+        return row is not None and row[0] == "1"
+
+
+# Redis scripts: each runs atomically on the server. Keys are named in `RedisQueue._keys`.
+_PUT_SCRIPT = """
+local added = 0
+for _, url in ipairs(ARGV) do
+    local state = redis.call('HGET', KEYS[1], url)
+    if state ~= 'pending' and state ~= 'leased' then
+        redis.call('HSET', KEYS[1], url, 'pending')
+        redis.call('HSET', KEYS[2], url, 0)
+        redis.call('RPUSH', KEYS[3], url)
+        added = added + 1
+    end
+end
+return added
+"""
+
+_LEASE_SCRIPT = """
+local now, lease_until, count = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local worker, max_attempts, kind, property_type = ARGV[4], tonumber(ARGV[5]), ARGV[6], ARGV[7]
+for _, url in ipairs(redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', now)) do
+    redis.call('ZREM', KEYS[5], url)
+    redis.call('HDEL', KEYS[3], url)
+    if tonumber(redis.call('HGET', KEYS[2], url) or '0') >= max_attempts then
+        redis.call('HSET', KEYS[1], url, 'failed')
+        redis.call('XADD', KEYS[6], '*', 'kind', kind, 'url', url, 'property_type', property_type, 'result', 'null')
+    else
+        redis.call('HSET', KEYS[1], url, 'pending')
+        redis.call('LPUSH', KEYS[4], url)
+    end
+end
+local urls = {}
+while #urls < count do
+    local url = redis.call('LPOP', KEYS[4])
+    if not url then break end
+    if redis.call('HGET', KEYS[1], url) == 'pending' then
+        redis.call('HSET', KEYS[1], url, 'leased')
+        redis.call('HINCRBY', KEYS[2], url, 1)
+        redis.call('HSET', KEYS[3], url, worker)
+        redis.call('ZADD', KEYS[5], lease_until, url)
+        table.insert(urls, url)
+    end
+end
+return urls
+"""
+
+_COMPLETE_SCRIPT = """
+local url = ARGV[1]
+if redis.call('HGET', KEYS[1], url) ~= 'leased' then return 0 end
+redis.call('HSET', KEYS[1], url, 'done')
+redis.call('HDEL', KEYS[3], url)
+redis.call('ZREM', KEYS[5], url)
+redis.call('XADD', KEYS[6], '*', 'kind', ARGV[2], 'url', url, 'property_type', ARGV[3], 'result', ARGV[4])
+return 1
+"""
+
+_FAIL_SCRIPT = """
+local url, worker = ARGV[1], ARGV[2]
+if redis.call('HGET', KEYS[1], url) ~= 'leased' or redis.call('HGET', KEYS[3], url) ~= worker then return 0 end
+redis.call('HDEL', KEYS[3], url)
+redis.call('ZREM', KEYS[5], url)
+if tonumber(redis.call('HGET', KEYS[2], url) or '0') >= tonumber(ARGV[3]) then
+    redis.call('HSET', KEYS[1], url, 'failed')
+    redis.call('XADD', KEYS[6], '*', 'kind', ARGV[4], 'url', url, 'property_type', ARGV[5], 'result', 'null')
+else
+    redis.call('HSET', KEYS[1], url, 'pending')
+    redis.call('RPUSH', KEYS[4], url)
+end
+return 1
+"""
+
+
+class RedisQueue:
+    """
+    Queue on a Redis server. Leasing, completing and failing are Lua scripts, so each is
+    atomic on the server; waiting items are lists, leases a sorted set by expiry and results
+    a stream. Lease expiry uses the clocks of the nodes, which should be kept in sync.
+
+    Args:
+        url (str): Redis URL, e.g. redis://host:6379/0
+        prefix (str): Prefix of every key, to keep several crawls on one server apart
+        visibility_timeout (float): Seconds a lease lasts
+        max_attempts (int): Leases an item gets before it is reported as failed
+    """
+
+    def __init__(self, url, prefix="sreality", visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT,
+                 max_attempts=MAX_RUN_ATTEMPTS):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.cursor = "0-0"
+        self.put_script = self.redis.register_script(_PUT_SCRIPT)
+        self.lease_script = self.redis.register_script(_LEASE_SCRIPT)
+        self.complete_script = self.redis.register_script(_COMPLETE_SCRIPT)
+        self.fail_script = self.redis.register_script(_FAIL_SCRIPT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.redis.close()
+
+    def _keys(self, kind, property_type):
+        # state, attempts, worker, waiting, leases, results
+        return [f"{self.prefix}:state:{kind}", f"{self.prefix}:attempts:{kind}", f"{self.prefix}:worker:{kind}",
+                f"{self.prefix}:waiting:{kind}:{property_type}", f"{self.prefix}:leases:{kind}:{property_type}",
+                f"{self.prefix}:results"]
+
+    def put(self, kind, property_type, urls):
+        keys = self._keys(kind, property_type)
+        urls = list(urls)
+        return sum(self.put_script(keys=[keys[0], keys[1], keys[3]], args=urls[i:i + 1000])
+                   for i in range(0, len(urls), 1000))
+
+    def lease(self, kind, property_type, worker, count):
+        now = time.time()
+        return self.lease_script(keys=self._keys(kind, property_type),
+                                 args=[now, now + self.visibility_timeout, count, worker, self.max_attempts, kind,
+                                       property_type])
+
+    def complete(self, kind, property_type, url, worker, result):
+        return bool(self.complete_script(keys=self._keys(kind, property_type),
+                                         args=[url, kind, property_type, json.dumps(result, ensure_ascii=False)]))
+
+    def fail(self, kind, property_type, url, worker):
+        self.fail_script(keys=self._keys(kind, property_type), args=[url, worker, self.max_attempts, kind, property_type])
+
+    def results(self, count):
+        entries = self.redis.xrange(f"{self.prefix}:results", min=self.cursor, count=count + 1)
+        entries = [entry for entry in entries if entry[0] != self.cursor][:count]
+        if entries:
+            self.cursor = entries[-1][0]
+        return [(result_id, fields["kind"], fields["url"], fields["property_type"], json.loads(fields["result"]))
+                for result_id, fields in entries]
+
+    def ack(self, result_ids):
+        if result_ids:
+            self.redis.xdel(f"{self.prefix}:results", *result_ids)
+
+    def outstanding(self):
+        total = 0
+        for key in self.redis.scan_iter(f"{self.prefix}:waiting:*"):
+            total += self.redis.llen(key)
+        for key in self.redis.scan_iter(f"{self.prefix}:leases:*"):
+            total += self.redis.zcard(key)
+        return total
+
+    def set_finished(self, finished):
+        if finished:
+            self.redis.set(f"{self.prefix}:finished", 1)
+        else:
+            self.redis.delete(f"{self.prefix}:finished")
+
+    def is_finished(self):
+        return bool(self.redis.exists(f"{self.prefix}:finished"))
@@ -0,0 +1,177 @@
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import default_metrics, queue_depth, record_failure
+
+
+# Rows buffered before a flush, and the longest a row may wait for one (seconds)
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+_CLOSE = object()
+
+
+class BatchWriter:
+    """
+    Single background writer for all CSV output.
+
+    Rows are handed over through a queue and written by one thread that keeps one open
+    handle per output file, so callers never take a lock or reopen files. Buffered rows are
+    flushed every `batch_size` rows or `flush_interval` seconds, whichever comes first, and
+    every flush is fsync'ed: a crash loses at most the batch that was still being buffered.
+
+    Use it as a context manager so the last batch is flushed and the files are closed.
+
+    Args:
+        batch_size (int): Rows to buffer before flushing
+        flush_interval (float): Maximum seconds between flushes while rows are pending
+        max_queue (int): Rows that may wait for the writer thread before `write` blocks
+        on_flush (callable, optional): Called as `on_flush(file_path, rows)` once rows are on
+            disk, e.g. to mark them done in the state store only after they are durable
+        dedup (FingerprintSet, optional): Drop rows whose `listing_url` it already holds, i.e.
+            rows written before; rows are added to it once they are on disk. Dropped rows are
+            still passed to `on_flush`, since they are on disk already
+        parquet (ParquetSink, optional): Also gets every row written to the CSV files, so the
+            Parquet copy holds the same rows, without the duplicates `dedup` drops
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL, max_queue=10000,
+                 on_flush=None, dedup=None, parquet=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.dedup = dedup
+        self.parquet = parquet
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.files = {}
+        self.pending = {}
+        self.pending_count = 0
+        # Listing URLs in `pending`, and rows dropped as duplicates since the last flush
+        self.pending_urls = set()
+        self.duplicates = {}
+        self.dropped = 0
+        self.stage = default_metrics.stage()
+        self.rows_written = default_metrics.counter("scraper_rows_written_total", "Rows flushed to disk")
+        self.untrack = queue_depth().track(self.queue.qsize, "writer")
+        self.thread = threading.Thread(target=self._run, name="BatchWriter", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, file_path, row):
+        """Queue one row (a dict) for `file_path`."""
+        self.queue.put((str(file_path), row))
+
+    def write_many(self, file_path, rows):
+        for row in rows:
+            self.write(file_path, row)
+
+    def close(self):
+        """Flush everything still queued and close the files."""
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        self.untrack()
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _CLOSE:
+                self._flush()
+                for handle, _ in self.files.values():
+                    handle.close()
+                self.files.clear()
+                return
+
+            if item is not None:
+                file_path, row = item
+                if self._is_duplicate(row):
+                    self.duplicates.setdefault(file_path, []).append(row)
+                else:
+                    self.pending.setdefault(file_path, []).append(row)
+                    self.pending_count += 1
+
+            if self.pending_count >= self.batch_size or time.monotonic() >= deadline:
+                self._flush()
+                deadline = time.monotonic() + self.flush_interval
+
+    def _is_duplicate(self, row):
+        if self.dedup is None:
+            return False
+        url = row.get("listing_url")
+        if url in self.pending_urls or url in self.dedup:
+            self.dropped += 1
+            logging.info(f"Skipped duplicate row of {url}")
+            return True
+        self.pending_urls.add(url)
+        return False
+
+    def _open(self, file_path, fieldnames):
+        if file_path not in self.files:
+            new_file = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+            if new_file:
+                os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+            else:
+                with open(file_path, newline='', encoding='UTF-8') as existing:
+                    header = next(csv.reader(existing), [])
+                if header != list(fieldnames):
+                    raise ValueError(f"columns differ from the file's header, e.g. after switching --agents "
+                                     f"on or off; move {file_path} aside to start a new file")
+            handle = open(file_path, mode='a', newline='', encoding='UTF-8')
+            writer = csv.DictWriter(handle, fieldnames=fieldnames)
+            if new_file:
+                writer.writeheader()
+            self.files[file_path] = (handle, writer)
+        return self.files[file_path]
+
+    def _write_parquet(self, file_path, rows):
+        # The CSV is the record the state store follows, so a Parquet error must not keep these
+        # rows from being marked written
+        try:
+            for row in rows:
+                self.parquet.write(row)
+        except Exception as e:
+            record_failure("write", e)
+            logging.error(f"Error writing {len(rows)} row(s) of {file_path} to Parquet: {e}")
+
+    def _flush(self):
+        for file_path, rows in self.pending.items():
+            try:
+                with self.stage.time("write"):
+                    handle, writer = self._open(file_path, list(rows[0].keys()))
+                    writer.writerows(rows)
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                self.rows_written.inc(amount=len(rows))
+                if self.parquet is not None:
+                    self._write_parquet(file_path, rows)
+                if self.dedup is not None:
+                    for row in rows:
+                        self.dedup.add(row["listing_url"])
+                if self.on_flush is not None:
+                    self.on_flush(file_path, rows)
+            except Exception as e:
+                record_failure("write", e)
+                logging.error(f"Error writing {len(rows)} row(s) to {file_path}: {e}")
+        for file_path, rows in self.duplicates.items():
+            try:
+                if self.on_flush is not None:
+                    self.on_flush(file_path, rows)
+            except Exception as e:
+                logging.error(f"Error handling {len(rows)} duplicate row(s) of {file_path}: {e}")
+        self.pending.clear()
+        self.pending_count = 0
+        self.pending_urls.clear()
+        self.duplicates.clear()